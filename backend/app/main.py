@@ -1,8 +1,40 @@
-from fastapi import FastAPI
+import os
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import forms, formio, ai
+from fastapi.responses import PlainTextResponse
+from .routers import forms, formio, ai, attachments
+from .services import formio_service, ai_service, job_service, document_service, upload_service, report_service, submission_service, outbox_service, template_service, admission_service, metrics
 
-app = FastAPI(title="Digital Form Builder API")
+# The services log through the "app" logger tree, next to uvicorn's own output
+logging.basicConfig(format="%(levelname)s:     %(name)s: %(message)s")
+logging.getLogger("app").setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share pooled Form.io and OpenAI clients for the lifetime of the app
+    await formio_service.startup()
+    await job_service.startup()
+    await report_service.startup()
+    await submission_service.startup()
+    await outbox_service.startup()
+    await template_service.startup()
+    await metrics.startup()
+    try:
+        yield
+    finally:
+        await metrics.shutdown()
+        await template_service.shutdown()
+        await outbox_service.shutdown()
+        await submission_service.shutdown()
+        await report_service.shutdown()
+        await job_service.shutdown()
+        await formio_service.shutdown()
+        await ai_service.shutdown()
+        document_service.shutdown()
+
+app = FastAPI(title="Digital Form Builder API", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -13,11 +45,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads before their bodies are parsed
+app.add_middleware(upload_service.UploadSizeLimitMiddleware)
+
+# Rate limit and queue the model-backed routes before their bodies are read
+app.add_middleware(admission_service.AdmissionMiddleware)
+
+# Outermost, so request timings include the other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers
 app.include_router(forms.router, prefix="/api/forms", tags=["Forms"])
 app.include_router(formio.router, prefix="/api/formio", tags=["Form.io"])
 app.include_router(ai.router, prefix="/api/ai", tags=["AI"])
+app.include_router(attachments.router, prefix="/api/attachments", tags=["Attachments"])
 
 @app.get("/")
 async def read_root():
-    return {"message": "Welcome to Digital Form Builder API"} 
\ No newline at end of file
+    return {"message": "Welcome to Digital Form Builder API"}
+
+@app.get("/api/admission")
+async def read_admission():
+    """Current admission state: slots in use, queued requests by priority and rejections"""
+    return admission_service.state()
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """Prometheus metrics: request and stage latencies, upstream calls, tokens, payload sizes and queues"""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(await metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+import json
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any
-from ..services import ai_service
+from ..services import ai_service, template_service, upload_service
 
 router = APIRouter()
 
@@ -13,11 +15,60 @@ async def process_form(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Only PDF, JPEG, and PNG files are supported")
     
     try:
-        form_structure = await ai_service.process_form(file)
-        return {"form_structure": form_structure}
+        with await upload_service.ingest(file) as upload:
+            form_structure, cache_status = await ai_service.process_upload(upload)
+        return {"form_structure": form_structure, "cache": cache_status}
+    except upload_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def digitization_stream(file: UploadFile, format: str) -> StreamingResponse:
+    """
+    Ingest an upload and stream its digitization events as NDJSON or
+    server-sent events. Errors before the first event are raised as HTTP
+    errors; later ones are sent as an "error" event.
+    """
+    try:
+        upload = await upload_service.ingest(file)
+    except upload_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    events = ai_service.stream_upload(upload)
+    try:
+        first = await anext(events)
+    except Exception as e:
+        upload.close()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def encode(event: Dict[str, Any]) -> str:
+        if format == "sse":
+            return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    async def stream():
+        try:
+            yield encode(first)
+            async for event in events:
+                yield encode(event)
+        except Exception as e:
+            yield encode({"type": "error", "detail": str(e)})
+        finally:
+            await events.aclose()
+            upload.close()
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@router.post("/process-form/stream")
+async def process_form_stream(file: UploadFile = File(...), format: str = Query("ndjson", pattern="^(ndjson|sse)$")):
+    """
+    Process a form image/PDF, streaming each component as soon as the model has produced it
+    """
+    if file.content_type not in ["application/pdf", "image/jpeg", "image/png"]:
+        raise HTTPException(status_code=400, detail="Only PDF, JPEG, and PNG files are supported")
+    
+    return await digitization_stream(file, format)
+
 @router.post("/enhance-form")
 async def enhance_form(form_data: Dict[str, Any]):
     """
@@ -38,7 +89,33 @@ async def extract_text(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Only PDF, JPEG, and PNG files are supported")
     
     try:
-        text = await ai_service.extract_text(file)
-        return {"text": text}
+        with await upload_service.ingest(file) as upload:
+            text, cache_status = await ai_service.extract_text_upload(upload)
+        return {"text": text, "cache": cache_status}
+    except upload_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.get("/templates")
+async def get_templates():
+    """
+    List the form templates uploads are matched against, most recently used first
+    """
+    try:
+        return await template_service.list_templates()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/templates/{template_id}")
+async def delete_template(template_id: int):
+    """
+    Remove a form template, so matching uploads go to the model again
+    """
+    try:
+        deleted = await template_service.delete_template(template_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return {"message": "Template deleted successfully"}
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.responses import FileResponse
+from ..services import attachment_service, upload_service
+
+router = APIRouter()
+
+# Attachments are addressed by the hash of their content, so a URL never
+# changes meaning and clients may cache it forever
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Browsers must use the type we send, never guess one from the content
+NOSNIFF = {"X-Content-Type-Options": "nosniff"}
+
+@router.post("")
+async def upload_attachment(file: UploadFile = File(...)):
+    """
+    Upload an inspection photo and get back its id and URLs
+    """
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="Only image files are supported")
+    
+    try:
+        with await upload_service.ingest(file) as upload:
+            return await attachment_service.store_upload(upload)
+    except upload_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except attachment_service.UnsupportedImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{attachment_id}")
+async def get_attachment(attachment_id: str):
+    """
+    Download an attachment; supports Range and conditional requests
+    """
+    try:
+        metadata = attachment_service.metadata(attachment_id)
+    except attachment_service.AttachmentNotFoundError:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    headers = {"ETag": f'"{attachment_id}"', "Cache-Control": IMMUTABLE_CACHE, **NOSNIFF}
+    if metadata["type"] in attachment_service.IMAGE_TYPES.values():
+        return FileResponse(attachment_service.blob_path(attachment_id), media_type=metadata["type"], headers=headers)
+    # Anything else, including blobs stored before uploads were checked, is
+    # only offered as a download so it never renders in the app's origin
+    return FileResponse(
+        attachment_service.blob_path(attachment_id),
+        media_type=attachment_service.DOWNLOAD_TYPE,
+        filename=attachment_id,
+        content_disposition_type="attachment",
+        headers=headers,
+    )
+
+@router.get("/{attachment_id}/thumbnail")
+async def get_attachment_thumbnail(attachment_id: str):
+    """
+    Download a JPEG thumbnail of an attachment, generating it on first use
+    """
+    try:
+        path = await attachment_service.ensure_thumbnail(attachment_id)
+    except attachment_service.AttachmentNotFoundError:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"ETag": f'"{attachment_id}-thumbnail"', "Cache-Control": IMMUTABLE_CACHE, **NOSNIFF},
+    )
@@ -1,50 +1,122 @@
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any, List
-from ..services import formio_service
+import httpx
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, Any, Optional, Awaitable, Tuple
+from ..services import formio_service, validation_service, fast_json
+from ..services.fast_json import JSONResponse
 
 router = APIRouter()
 
+async def relay(request: Request, path: str, invalidate: Optional[str] = None, invalidate_all: bool = False):
+    """
+    Pass the request through to Form.io and relay its answer byte for byte,
+    with its status, ETag and Content-Encoding, without decoding it. Large
+    bodies are streamed as they arrive.
+    """
+    content = await request.body() if request.method in ("POST", "PUT", "PATCH") else None
+    try:
+        upstream = await formio_service.open_stream(
+            request.method, path, params=request.query_params, content=content, request_headers=request.headers
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if invalidate is not None or invalidate_all:
+            formio_service.invalidate_forms(invalidate)
+    headers = {
+        name: upstream.headers[name]
+        for name in formio_service.PASSTHROUGH_RESPONSE_HEADERS
+        if name in upstream.headers
+    }
+    length = upstream.headers.get("content-length", "")
+    if length.isdigit() and int(length) <= formio_service.FORMIO_PASSTHROUGH_BUFFER:
+        try:
+            body = b"".join([chunk async for chunk in upstream.aiter_raw()])
+        finally:
+            await upstream.aclose()
+        return Response(body, status_code=upstream.status_code, headers=headers)
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers=headers,
+        background=BackgroundTask(upstream.aclose),
+    )
+
+async def relay_cached(request: Request, read: Awaitable[Tuple[bytes, Optional[str]]]):
+    """
+    Answer a definition read from the form cache, so pass-through GETs keep
+    its revalidation and request coalescing: the cached bytes are sent as
+    Form.io sent them, with their ETag, or 304 when the client has them
+    """
+    try:
+        body, etag = await read
+    except httpx.HTTPStatusError as e:
+        return Response(e.response.content, status_code=e.response.status_code, media_type=e.response.headers.get("content-type"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    headers = {"ETag": etag} if etag else {}
+    if etag and etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+async def read_json(request: Request) -> Dict[str, Any]:
+    try:
+        return fast_json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be JSON")
+
 @router.get("/forms")
-async def get_formio_forms():
+async def get_formio_forms(request: Request):
     """
     Get all forms from form.io
     """
+    if formio_service.FORMIO_PASSTHROUGH:
+        return await relay_cached(request, formio_service.get_forms_raw())
     try:
         forms = await formio_service.get_formio_forms()
-        return forms
+        return JSONResponse(forms)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/forms")
-async def create_formio_form(form_data: Dict[str, Any]):
+async def create_formio_form(request: Request):
     """
     Create a new form in form.io
     """
+    if formio_service.FORMIO_PASSTHROUGH:
+        return await relay(request, "/form", invalidate_all=True)
+    form_data = await read_json(request)
     try:
         result = await formio_service.create_formio_form(form_data)
-        return result
+        return JSONResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/forms/{form_id}")
-async def get_formio_form(form_id: str):
+async def get_formio_form(form_id: str, request: Request):
     """
     Get a specific form from form.io
     """
+    if formio_service.FORMIO_PASSTHROUGH:
+        return await relay_cached(request, formio_service.get_form_raw(form_id))
     try:
         form = await formio_service.get_formio_form(form_id)
-        return form
+        return JSONResponse(form)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/forms/{form_id}")
-async def update_formio_form(form_id: str, form_data: Dict[str, Any]):
+async def update_formio_form(form_id: str, request: Request):
     """
     Update a form in form.io
     """
+    if formio_service.FORMIO_PASSTHROUGH:
+        return await relay(request, f"/form/{form_id}", invalidate=form_id)
+    form_data = await read_json(request)
     try:
         result = await formio_service.update_formio_form(form_id, form_data)
-        return result
+        return JSONResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -60,23 +132,44 @@ async def delete_formio_form(form_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/forms/{form_id}/submissions")
-async def get_formio_submissions(form_id: str):
+async def get_formio_submissions(
+    form_id: str,
+    page_size: Optional[int] = Query(None, ge=1, le=formio_service.FORMIO_MAX_PAGE_SIZE),
+    concurrency: Optional[int] = Query(None, ge=1, le=formio_service.FORMIO_MAX_PAGE_CONCURRENCY),
+):
     """
-    Get all submissions for a specific form
+    Stream all submissions for a specific form as NDJSON, one submission per line
     """
+    submissions = formio_service.iter_submissions(
+        form_id,
+        page_size=page_size or formio_service.FORMIO_PAGE_SIZE,
+        concurrency=concurrency or formio_service.FORMIO_PAGE_CONCURRENCY,
+    )
     try:
-        submissions = await formio_service.get_formio_submissions(form_id)
-        return submissions
+        # Fetch the first submission up front so upstream errors still become a 500
+        first = await anext(submissions, None)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def ndjson():
+        if first is None:
+            return
+        yield fast_json.dumps(first) + b"\n"
+        async for submission in submissions:
+            yield fast_json.dumps(submission) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @router.post("/forms/{form_id}/submissions")
-async def create_formio_submission(form_id: str, submission_data: Dict[str, Any]):
+async def create_formio_submission(form_id: str, request: Request):
     """
     Create a new submission for a form
     """
+    submission_data = await read_json(request)
     try:
         result = await formio_service.create_formio_submission(form_id, submission_data)
-        return result
+        return JSONResponse(result)
+    except validation_service.SubmissionValidationError as e:
+        raise HTTPException(status_code=400, detail=e.to_dict())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
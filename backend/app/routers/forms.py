@@ -1,8 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Header, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 import json
-from ..services import formio_service, ai_service
+from .ai import digitization_stream
+from ..services import formio_service, ai_service, job_service, upload_service, report_service, export_service, submission_service, outbox_service, validation_service
 
 router = APIRouter()
 
@@ -18,11 +19,61 @@ async def upload_form(
     
     try:
         # Process the uploaded form
-        form_structure = await ai_service.process_form(file)
-        return {"form_structure": form_structure}
+        with await upload_service.ingest(file) as upload:
+            form_structure, cache_status = await ai_service.process_upload(upload)
+        return {"form_structure": form_structure, "cache": cache_status}
+    except upload_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/upload/stream")
+async def upload_form_stream(
+    file: UploadFile = File(...),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+):
+    """
+    Upload a paper form and stream the detected components while the AI is still reading it
+    """
+    if file.content_type not in ["application/pdf", "image/jpeg", "image/png"]:
+        raise HTTPException(status_code=400, detail="Only PDF, JPEG, and PNG files are supported")
+    
+    return await digitization_stream(file, format)
+
+@router.post("/jobs", status_code=202)
+async def create_upload_job(
+    file: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None),
+    x_tenant_id: str = Header("default"),
+):
+    """
+    Queue a paper form for digitization and return a job id straight away
+    """
+    if file.content_type not in ["application/pdf", "image/jpeg", "image/png"]:
+        raise HTTPException(status_code=400, detail="Only PDF, JPEG, and PNG files are supported")
+    
+    try:
+        with await upload_service.ingest(file) as upload:
+            return await job_service.submit_job(upload, tenant=x_tenant_id, callback_url=callback_url)
+    except upload_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except job_service.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except job_service.InvalidCallbackError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    """
+    Get the status and, once finished, the result of a digitization job
+    """
+    job = await job_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @router.post("/create")
 async def create_form(form_data: dict):
     """
@@ -45,6 +96,137 @@ async def get_forms():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/submissions")
+async def get_submissions():
+    """
+    Get all form submissions
+    """
+    try:
+        submissions = await formio_service.get_submissions()
+        return submissions
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/submissions/batch")
+async def submit_batch(request: Request):
+    """
+    Submit many queued submissions at once, as a JSON array or an NDJSON stream.
+    Each item is {"formId", "idempotencyKey"?, "data", ...}; results are per item.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/jsonl")):
+            items = submission_service.iter_ndjson(request.stream())
+        else:
+            try:
+                items = json.loads(await request.body())
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+            if isinstance(items, dict):
+                items = items.get("submissions")
+            if not isinstance(items, list):
+                raise HTTPException(status_code=400, detail="Expected a JSON array of submissions")
+        results = await submission_service.submit_batch(items)
+        return submission_service.summarize(results)
+    except HTTPException:
+        raise
+    except submission_service.BatchTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/outbox")
+async def get_outbox_stats():
+    """
+    Get the depth and lag of the local submission outbox
+    """
+    try:
+        return await outbox_service.get_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/outbox/{entry_id}")
+async def get_outbox_entry(entry_id: str):
+    """
+    Get the delivery status of a queued submission
+    """
+    entry = await outbox_service.get_entry(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Outbox entry not found")
+    return entry
+
+@router.get("/report")
+async def generate_report(
+    location: Optional[str] = None,
+    priority: Optional[str] = None,
+    form_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Generate a maintenance report from the local issue index, filtered and paginated
+    """
+    try:
+        report = await report_service.generate_report(
+            location=location,
+            priority=priority,
+            form_id=form_id,
+            date_from=date_from,
+            date_to=date_to,
+            limit=limit,
+            offset=offset,
+        )
+        return report
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/report/export")
+async def export_report(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|xlsx|pdf)$"),
+    location: Optional[str] = None,
+    priority: Optional[str] = None,
+    form_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    photos: bool = True,
+):
+    """
+    Download the maintenance report as CSV, XLSX or PDF, streamed as it is
+    written; XLSX and PDF include photo thumbnails unless photos=false
+    """
+    chunks = export_service.export_report(
+        format,
+        location=location,
+        priority=priority,
+        form_id=form_id,
+        date_from=date_from,
+        date_to=date_to,
+        photos=photos,
+        base_url=str(request.base_url),
+    )
+    try:
+        # Start the export up front so a failure before any output is still a 500
+        first = await anext(chunks)
+    except Exception as e:
+        await chunks.aclose()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def body():
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type=export_service.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_service.filename(format)}"'},
+    )
+
 @router.get("/{form_id}")
 async def get_form(form_id: str):
     """
@@ -68,34 +250,23 @@ async def update_form(form_id: str, form_data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{form_id}/submit")
-async def submit_form(form_id: str, submission_data: dict):
+async def submit_form(form_id: str, submission_data: dict, idempotency_key: Optional[str] = Header(None)):
     """
-    Submit a form with the provided data
+    Submit a form with the provided data; retries with the same Idempotency-Key are not resubmitted.
+    Answers 200 with the Form.io submission; with SUBMISSION_OUTBOX enabled it
+    answers 202 with an outbox entry once the submission is on local disk.
     """
     try:
-        result = await formio_service.submit_form(form_id, submission_data)
+        if outbox_service.SUBMISSION_OUTBOX:
+            entry = await outbox_service.enqueue(form_id, submission_data, idempotency_key)
+            return JSONResponse(status_code=202, content=entry)
+        result, _ = await submission_service.submit(form_id, submission_data, idempotency_key)
         return result
+    except submission_service.IdempotencyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except validation_service.SubmissionValidationError as e:
+        raise HTTPException(status_code=400, detail=e.to_dict())
+    except outbox_service.InvalidSubmissionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/submissions")
-async def get_submissions():
-    """
-    Get all form submissions
-    """
-    try:
-        submissions = await formio_service.get_submissions()
-        return submissions
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/report")
-async def generate_report():
-    """
-    Generate a maintenance report based on form submissions
-    """
-    try:
-        report = await formio_service.generate_report()
-        return report
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
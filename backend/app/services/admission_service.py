@@ -0,0 +1,346 @@
+import os
+import json
+import math
+import time
+import heapq
+import asyncio
+import sqlite3
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, Tuple
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+from . import metrics, worker_lock
+from .cache import SHARED_CACHE_PATH
+
+load_dotenv()
+
+# Admission control settings
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+# Clients are told apart by address, as resolved from the trusted proxy's
+# forwarding headers (serve.py --forwarded-allow-ips). Name a header here
+# only when a gateway in front authenticates callers and sets it itself:
+# clients could otherwise pick a fresh value for every request.
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "").lower()
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+# Per-route overrides as JSON, e.g. {"/api/ai/process-form": {"rate": 0.5, "burst": 10}}
+ADMISSION_RULES = os.getenv("ADMISSION_RULES")
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# Lower runs first
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# The routes that call the model. rate is requests per second per client,
+# burst the bucket size; concurrency=False routes are only rate limited.
+# Rules apply to POST unless they list other methods.
+DEFAULT_RULES: Dict[str, Dict[str, Any]] = {
+    "/api/ai/process-form": {"rate": 0.2, "burst": 5, "class": INTERACTIVE},
+    "/api/ai/process-form/stream": {"rate": 0.2, "burst": 5, "class": INTERACTIVE},
+    "/api/ai/extract-text": {"rate": 0.2, "burst": 5, "class": INTERACTIVE},
+    "/api/ai/enhance-form": {"rate": 0.2, "burst": 5, "class": INTERACTIVE},
+    "/api/forms/upload": {"rate": 0.2, "burst": 5, "class": INTERACTIVE},
+    "/api/forms/upload/stream": {"rate": 0.2, "burst": 5, "class": INTERACTIVE},
+    # Jobs are admitted cheaply; their workers take batch slots when they run
+    "/api/forms/jobs": {"rate": 1.0, "burst": 50, "class": BATCH, "concurrency": False},
+    # Exports are long streams; they are rate limited but hold no slot
+    "/api/forms/report/export": {"rate": 0.1, "burst": 3, "class": BATCH, "concurrency": False, "methods": ("GET",)},
+}
+
+class AdmissionError(Exception):
+    """Raised when a request is not admitted; carries the status and Retry-After to answer with"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float, reason: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def load_rules() -> Dict[str, Dict[str, Any]]:
+    rules = {path: dict(rule) for path, rule in DEFAULT_RULES.items()}
+    if ADMISSION_RULES:
+        for path, rule in json.loads(ADMISSION_RULES).items():
+            rules[path] = {**rules.get(path, {"rate": 1.0, "burst": 5, "class": INTERACTIVE}), **rule}
+    return rules
+
+class TokenBuckets:
+    """Per-client token buckets, keeping the most recently seen clients"""
+
+    def __init__(self, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+
+    def take(self, key: Tuple[str, str], rate: float, burst: float) -> float:
+        """Take one token; returns 0 when admitted, otherwise the seconds until a token is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate if rate > 0 else 60.0
+
+    async def acquire(self, key: Tuple[str, str], rate: float, burst: float) -> float:
+        return self.take(key, rate, burst)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class SharedTokenBuckets:
+    """
+    Per-client token buckets in the shared SQLite database, so that every
+    worker process on the host draws from the same bucket for a client
+    """
+
+    def __init__(self, path: str, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.path = path
+        self.max_clients = max_clients
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily and again after a fork, like the shared cache
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS admission_buckets ("
+                "client TEXT NOT NULL, path TEXT NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (client, path))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS admission_buckets_updated ON admission_buckets (updated)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def take(self, key: Tuple[str, str], rate: float, burst: float) -> float:
+        """Take one token; returns 0 when admitted, otherwise the seconds until a token is available"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM admission_buckets WHERE client = ? AND path = ?", key
+                ).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                admitted = tokens >= 1
+                if admitted:
+                    tokens -= 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO admission_buckets (client, path, tokens, updated) VALUES (?, ?, ?, ?)",
+                    (*key, tokens, now),
+                )
+                self._takes += 1
+                if self._takes % 100 == 0:
+                    # Keep the most recently seen clients
+                    conn.execute(
+                        "DELETE FROM admission_buckets WHERE rowid IN (SELECT rowid FROM admission_buckets "
+                        "ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                        (self.max_clients,),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if admitted:
+            return 0.0
+        return (1 - tokens) / rate if rate > 0 else 60.0
+
+    async def acquire(self, key: Tuple[str, str], rate: float, burst: float) -> float:
+        return await asyncio.to_thread(self.take, key, rate, burst)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM admission_buckets").fetchone()[0]
+
+class PriorityLimiter:
+    """
+    Global cap on concurrent expensive requests with a bounded wait queue.
+    A freed slot goes to the oldest interactive waiter before any batch one.
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.queued = {name: 0 for name in PRIORITIES}
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._hold_seconds = 1.0
+
+    def retry_after(self) -> float:
+        return self._hold_seconds * (sum(self.queued.values()) + 1) / max(1, self.limit)
+
+    async def acquire(self, priority: str, timeout: Optional[float], bounded: bool = True):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if bounded and sum(self.queued.values()) >= self.max_queue:
+            raise AdmissionError(503, "Server busy, too many requests waiting", self.retry_after(), "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._sequence), future))
+        self.queued[priority] += 1
+        try:
+            await asyncio.wait([future], timeout=timeout)
+        except BaseException:
+            self._abandon(future, priority)
+            raise
+        if not future.done():
+            self._abandon(future, priority)
+            raise AdmissionError(503, "Server busy, timed out waiting for capacity", self.retry_after(), "queue_timeout")
+
+    def _abandon(self, future: asyncio.Future, priority: str):
+        if future.done() and not future.cancelled():
+            # The slot was handed over just as we gave up; pass it on
+            self.release(None)
+        else:
+            future.cancel()
+            self.queued[priority] -= 1
+
+    def release(self, held: Optional[float]):
+        if held is not None:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+        while self._waiters:
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self.queued[next(name for name, rank in PRIORITIES.items() if rank == priority)] -= 1
+            # Hand the slot straight over; active stays the same
+            future.set_result(None)
+            return
+        self.active -= 1
+
+rules = load_rules()
+# Rate limits hold across worker processes through the shared database; the
+# concurrency cap and queue are split between them (see worker_lock.share)
+buckets = SharedTokenBuckets(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else TokenBuckets()
+limiter = PriorityLimiter(worker_lock.share(ADMISSION_MAX_CONCURRENT), worker_lock.share(ADMISSION_MAX_QUEUE))
+rejected = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+
+admission_active = metrics.Gauge("elyndra_admission_active", "Expensive requests and batch jobs holding a slot")
+admission_queued = metrics.Gauge("elyndra_admission_queued", "Requests waiting for a slot by priority class", ("priority",))
+admission_rejected = metrics.Counter("elyndra_admission_rejected_total", "Requests turned away by reason", ("reason",))
+
+@metrics.collector
+async def _collect_metrics():
+    admission_active.set(limiter.active)
+    for priority, count in limiter.queued.items():
+        admission_queued.set(count, priority=priority)
+
+def _reject(error: AdmissionError) -> AdmissionError:
+    rejected[error.reason] += 1
+    admission_rejected.inc(reason=error.reason)
+    return error
+
+@asynccontextmanager
+async def slot(priority: str = BATCH, timeout: Optional[float] = None, bounded: bool = False):
+    """Hold a slot of the global cap; background work waits without a queue bound by default"""
+    if not ADMISSION_ENABLED:
+        yield
+        return
+    await limiter.acquire(priority, timeout, bounded)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        limiter.release(time.monotonic() - started)
+
+def client_id(scope) -> str:
+    if ADMISSION_CLIENT_HEADER:
+        for name, value in scope["headers"]:
+            if name.decode("latin-1") == ADMISSION_CLIENT_HEADER and value:
+                return value.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def request_priority(scope, rule: Dict[str, Any]) -> str:
+    """The route's class, lowered to batch when the client asks with X-Priority: batch"""
+    for name, value in scope["headers"]:
+        if name == b"x-priority" and value.decode("latin-1").lower() == BATCH:
+            return BATCH
+    return rule.get("class", INTERACTIVE)
+
+async def admit(scope) -> Optional[Tuple[str, bool]]:
+    """
+    Rate limit and queue one request. Returns None for routes without a
+    rule, otherwise (priority, holds a slot); raises AdmissionError.
+    """
+    rule = rules.get(scope["path"].rstrip("/") or "/")
+    if rule is None or scope["method"] not in rule.get("methods", ("POST",)):
+        return None
+    wait = await buckets.acquire((client_id(scope), scope["path"]), rule["rate"], rule["burst"])
+    if wait:
+        raise _reject(AdmissionError(429, "Rate limit exceeded", wait, "rate_limited"))
+    priority = request_priority(scope, rule)
+    if not rule.get("concurrency", True):
+        return priority, False
+    try:
+        await limiter.acquire(priority, ADMISSION_QUEUE_TIMEOUT)
+    except AdmissionError as e:
+        raise _reject(e)
+    return priority, True
+
+def state() -> Dict[str, Any]:
+    return {
+        "enabled": ADMISSION_ENABLED,
+        "concurrency": {
+            "limit": limiter.limit,
+            "active": limiter.active,
+            "queued": dict(limiter.queued),
+            "maxQueue": limiter.max_queue,
+            "avgHoldSeconds": round(limiter._hold_seconds, 3),
+            "workers": worker_lock.WORKER_PROCESSES,
+        },
+        "clients": len(buckets),
+        "rejected": dict(rejected),
+        "rules": rules,
+    }
+
+class AdmissionMiddleware:
+    """
+    Admit requests to the expensive AI routes: per-client token buckets
+    answer 429, a full or slow wait queue answers 503, both with Retry-After
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        try:
+            admitted = await admit(scope)
+        except AdmissionError as e:
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)}
+            )
+            return await response(scope, receive, send)
+        if admitted is None or not admitted[1]:
+            return await self.app(scope, receive, send)
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
@@ -1,34 +1,134 @@
 import os
 import json
-from typing import Dict, Any
-import base64
-import openai
+import asyncio
+import copy
+import time
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple, Union, AsyncIterator, Callable
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 from fastapi import UploadFile
+from .cache import LRUCache, DiskCache, TieredCache, shared_cache
+from .single_flight import SingleFlight
+from .json_stream import ComponentStream
+from . import document_service, template_service, upload_service, metrics, worker_lock
 
 load_dotenv()
 
-# Load OpenAI API key from environment
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Load OpenAI settings from environment
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
 
-async def process_form(file: UploadFile) -> Dict[str, Any]:
-    """
-    Process a form image/PDF using OpenAI to extract structure
-    """
-    # Read the file content
-    content = await file.read()
-    
-    # For PDFs, we need to convert to image (simplified for this prototype)
-    if file.content_type == "application/pdf":
-        # In a real implementation, you'd use a PDF-to-image converter
-        # For this prototype, we'll just handle it as an image
-        pass
-    
-    # Convert to base64 for OpenAI API
-    encoded_image = base64.b64encode(content).decode('utf-8')
-    
-    # Example of a working form.io structure to use as a template
-    example_template = """
+# Models and prompt version used for digitization; bump the version whenever
+# the prompts change so cached results from older prompts are not reused
+PROCESS_FORM_MODEL = "gpt-4o"
+EXTRACT_TEXT_MODEL = "gpt-4o"
+PROMPT_VERSION = "2"
+ENHANCE_FORM_MODEL = "gpt-4"
+
+# Form enhancement is split into sections of at most this many fields
+ENHANCE_SECTION_FIELDS = int(os.getenv("ENHANCE_SECTION_FIELDS", "20"))
+ENHANCE_CONCURRENCY = int(os.getenv("ENHANCE_CONCURRENCY", "4"))
+
+# Digitization result cache: in-memory LRU plus the shared cache (SHARED_CACHE_PATH)
+# or, failing that, an optional on-disk tier
+DIGITIZATION_CACHE_SIZE = int(os.getenv("DIGITIZATION_CACHE_SIZE", "256"))
+DIGITIZATION_CACHE_DIR = os.getenv("DIGITIZATION_CACHE_DIR")
+DIGITIZATION_CACHE_TTL = float(os.getenv("DIGITIZATION_CACHE_TTL", str(30 * 24 * 3600)))
+DIGITIZATION_CACHE_MAX_FILES = int(os.getenv("DIGITIZATION_CACHE_MAX_FILES", "10000"))
+
+# Shared async client and the limit on concurrent outbound model calls
+_client: Optional[AsyncOpenAI] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+def get_client() -> AsyncOpenAI:
+    """Return the shared OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=OPENAI_MAX_RETRIES,
+        )
+    return _client
+
+async def shutdown():
+    """Close the shared OpenAI client"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+model_tokens = metrics.Counter("elyndra_model_tokens_total", "Tokens used by model calls", ("model", "kind"))
+model_slot_waiting = metrics.Gauge("elyndra_model_slot_waiting", "Model calls waiting for a free concurrency slot")
+
+def _model_semaphore() -> asyncio.Semaphore:
+    """Semaphore bounding the number of model calls in flight, this worker process's share of OPENAI_MAX_CONCURRENCY"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(worker_lock.share(OPENAI_MAX_CONCURRENCY))
+    return _semaphore
+
+@asynccontextmanager
+async def _model_slot():
+    """Hold one of the model concurrency slots, recording how long it took to get one"""
+    semaphore = _model_semaphore()
+    with model_slot_waiting.track(), metrics.stage_seconds.time(stage="model_queue"):
+        await semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+def record_usage(model: str, usage: Any):
+    """Count the tokens reported by a completion or the last chunk of a stream"""
+    if usage is None:
+        return
+    model_tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    model_tokens.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+async def _create_completion(**kwargs):
+    """Call the chat completions API; the caller must hold a model slot"""
+    model = kwargs.get("model", "")
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with metrics.upstream_in_flight.track(upstream="openai"):
+            response = await get_client().chat.completions.create(**kwargs)
+        status = "ok"
+    finally:
+        # For streamed calls this is the time until the stream opened
+        metrics.upstream_seconds.observe(time.perf_counter() - started, upstream="openai", operation=model, status=status)
+    if not kwargs.get("stream"):
+        record_usage(model, getattr(response, "usage", None))
+    return response
+
+async def _chat_completion(**kwargs):
+    """Call the chat completions API, waiting for a free concurrency slot first"""
+    async with _model_slot():
+        return await _create_completion(**kwargs)
+
+def _digitization_store():
+    """The second cache tier: shared by all workers when configured, else an optional directory"""
+    shared = shared_cache("digitization", ttl=DIGITIZATION_CACHE_TTL, max_entries=DIGITIZATION_CACHE_MAX_FILES)
+    if shared is not None:
+        return shared
+    if DIGITIZATION_CACHE_DIR:
+        return DiskCache(DIGITIZATION_CACHE_DIR, ttl=DIGITIZATION_CACHE_TTL, max_entries=DIGITIZATION_CACHE_MAX_FILES)
+    return None
+
+digitization_cache = TieredCache(LRUCache(max_entries=DIGITIZATION_CACHE_SIZE), _digitization_store())
+# Identical model work in flight at once (same file or section, operation,
+# model and prompt) runs once; keyed like the digitization cache
+model_flights = SingleFlight("model")
+
+# Example of a working form.io structure to use as a template
+EXAMPLE_TEMPLATE = """
     {
         "title": "Register",
         "display": "form",
@@ -117,10 +217,237 @@ async def process_form(file: UploadFile) -> Dict[str, Any]:
         }]
     }
     """
+
+SUBMIT_BUTTON = {
+    "input": True,
+    "label": "Submit",
+    "tableView": False,
+    "key": "submit",
+    "size": "md",
+    "leftIcon": "",
+    "rightIcon": "",
+    "block": False,
+    "action": "submit",
+    "disableOnInvalid": False,
+    "theme": "primary",
+    "type": "button"
+}
+
+async def process_form(file: UploadFile) -> Dict[str, Any]:
+    """
+    Process a form image/PDF using OpenAI to extract structure
+    """
+    with await upload_service.ingest(file) as upload:
+        form_structure, _ = await process_upload(upload)
+    return form_structure
+
+async def process_form_content(content: bytes, content_type: str) -> Tuple[Dict[str, Any], str]:
+    """
+    Process form file content already in memory, returning the form
+    structure and the cache status
+    """
+    with upload_service.from_bytes(content, content_type) as upload:
+        return await process_upload(upload)
+
+async def process_upload(upload: upload_service.Upload) -> Tuple[Dict[str, Any], str]:
+    """
+    Process an ingested upload, returning the form structure and whether
+    it came from the digitization cache ("hit"), a stored template of the
+    same layout ("template"), an identical digitization already in flight
+    ("coalesced") or the model ("miss")
+    """
+    cache_key = ":".join([upload.sha256, "process_form", PROCESS_FORM_MODEL, PROMPT_VERSION])
+    cached = await digitization_cache.get(cache_key)
+    if cached is not None:
+        metrics.cache_requests.inc(cache="digitization", result="hit")
+        return copy.deepcopy(cached), "hit"
+    
+    metrics.cache_requests.inc(cache="digitization", result="miss")
+
+    async def digitize():
+        with metrics.stage_seconds.time(span="process_form", stage="process_form"):
+            form_structure, status = await _process_form(upload.source, upload.content_type)
+        await digitization_cache.set(cache_key, form_structure)
+        return form_structure, status
+
+    # The same file uploaded twice at once (a double click) is digitized once
+    (form_structure, status), shared = await model_flights.do(cache_key, digitize)
+    return copy.deepcopy(form_structure), "coalesced" if shared else status
+
+def _template_version() -> str:
+    """Templates are only reused with the model and prompts that produced them"""
+    return f"{PROCESS_FORM_MODEL}:{PROMPT_VERSION}"
+
+async def _render_and_fingerprint(source: Union[bytes, str], content_type: str, page_count: int) -> List[Tuple[Union[bytes, str], str, Optional[int]]]:
+    """
+    Render every page and take its layout fingerprint, as (image, mime
+    type, fingerprint). The fingerprint is None for an image Pillow cannot
+    read; the model may still manage, so that is not an error here.
+    """
+    async def render(index: int):
+        image, mime_type = await document_service.render_page(source, content_type, index)
+        try:
+            return image, mime_type, await document_service.fingerprint(image)
+        except Exception:
+            return image, mime_type, None
+
+    return list(await asyncio.gather(*(render(index) for index in range(page_count))))
+
+async def _match_template(pages: List[Tuple[Union[bytes, str], str, Optional[int]]]) -> Tuple[Optional[Dict[str, Any]], Optional[List[int]]]:
+    """The schema of a stored template matching the pages, if any, and the fingerprints to learn from otherwise"""
+    fingerprints = [fingerprint for _, _, fingerprint in pages]
+    if None in fingerprints:
+        return None, None
+    return await template_service.match(fingerprints, _template_version()), fingerprints
+
+async def _process_form(source: Union[bytes, str], content_type: str) -> Tuple[Dict[str, Any], str]:
+    """
+    Digitize a file, returning the form structure and where it came from:
+    a stored template of the same layout ("template") or the model ("miss")
+    """
+    # PDFs become one image per page; images are a single page
+    page_count = await document_service.count_pages(source, content_type)
+    if template_service.TEMPLATE_MATCHING:
+        # All pages are fingerprinted before any goes to the model, since a
+        # matching template makes the model calls unnecessary
+        pages = await _render_and_fingerprint(source, content_type, page_count)
+        template, fingerprints = await _match_template(pages)
+        if template is not None:
+            return template, "template"
+        page_structures = await asyncio.gather(*(
+            _process_page(image, mime_type, index + 1, page_count) for index, (image, mime_type, _) in enumerate(pages)
+        ))
+        form_structure = merge_page_structures(list(page_structures))
+        ensure_submit_button(form_structure)
+        if fingerprints is not None:
+            await template_service.learn(fingerprints, _template_version(), form_structure)
+        return form_structure, "miss"
+    
+    async def process_page(index: int) -> Dict[str, Any]:
+        image, mime_type = await document_service.render_page(source, content_type, index)
+        return await _process_page(image, mime_type, index + 1, page_count)
+    
+    # Render and analyze the pages in parallel, so each page goes to the model
+    # as soon as it is rendered; the model slots bound the concurrency
+    page_structures = await asyncio.gather(*(process_page(index) for index in range(page_count)))
+    
+    form_structure = merge_page_structures(list(page_structures))
+    ensure_submit_button(form_structure)
+    return form_structure, "miss"
+
+async def stream_upload(upload: upload_service.Upload) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Digitize an ingested upload, yielding events as the model writes: a
+    "pages" event, then a "component" event for each top-level component
+    as soon as it has been parsed (pages in order, all pages analyzed in
+    parallel), then a "form" event with the merged structure. The final
+    structure is authoritative: merging renames clashing keys and adds the
+    submit button.
+    """
+    cache_key = ":".join([upload.sha256, "process_form", PROCESS_FORM_MODEL, PROMPT_VERSION])
+    cached = await digitization_cache.get(cache_key)
+    cache_status = "hit"
+    if cached is None:
+        # A plain digitization of the same file already running is waited for rather than repeated
+        _, result = await model_flights.join(cache_key)
+        cached = result[0] if result is not None else None
+        cache_status = "coalesced"
+    page_count = await document_service.count_pages(upload.source, upload.content_type)
+    pages, fingerprints = None, None
+    if cached is None and template_service.TEMPLATE_MATCHING:
+        pages = await _render_and_fingerprint(upload.source, upload.content_type, page_count)
+        cached, fingerprints = await _match_template(pages)
+        cache_status = "template"
+        if cached is not None:
+            await digitization_cache.set(cache_key, cached)
+    if cached is not None:
+        form_structure = copy.deepcopy(cached)
+        yield {"type": "pages", "pages": 1}
+        for component in form_structure.get("components", []):
+            if not _is_submit_button(component):
+                yield {"type": "component", "page": 1, "component": component}
+        yield {"type": "form", "form_structure": form_structure, "cache": cache_status}
+        return
+
+    yield {"type": "pages", "pages": page_count}
+    queues = [asyncio.Queue() for _ in range(page_count)]
+
+    async def stream_page(index: int) -> Dict[str, Any]:
+        if pages is not None:
+            image, mime_type, _ = pages[index]
+        else:
+            image, mime_type = await document_service.render_page(upload.source, upload.content_type, index)
+        return await _stream_page(image, mime_type, index + 1, page_count, queues[index].put_nowait)
+
+    tasks = [asyncio.create_task(stream_page(index)) for index in range(page_count)]
+    for index, task in enumerate(tasks):
+        task.add_done_callback(lambda _, queue=queues[index]: queue.put_nowait(None))
+    try:
+        # Later pages keep running while earlier ones are still being streamed
+        for index, task in enumerate(tasks):
+            while True:
+                component = await queues[index].get()
+                if component is None:
+                    break
+                if not _is_submit_button(component):
+                    yield {"type": "component", "page": index + 1, "component": component}
+        page_structures = [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    form_structure = merge_page_structures(page_structures)
+    ensure_submit_button(form_structure)
+    await digitization_cache.set(cache_key, form_structure)
+    if fingerprints is not None:
+        await template_service.learn(fingerprints, _template_version(), form_structure)
+    yield {"type": "form", "form_structure": copy.deepcopy(form_structure), "cache": "miss"}
+
+async def _stream_page(
+    image: Union[bytes, str],
+    mime_type: str,
+    page_number: int,
+    page_count: int,
+    emit: Callable[[Dict[str, Any]], None],
+) -> Dict[str, Any]:
+    """Like _process_page, but streams the reply and emits each top-level component as it completes"""
+    page_note = ""
+    if page_count > 1:
+        page_note = f"This image is page {page_number} of {page_count} of the form. Only include the fields on this page.\n\n"
     
+    parser = ComponentStream()
+    async with _model_slot():
+        image_url = upload_service.data_url(image, mime_type)
+        stream = await _analyze_page(image_url, page_note, stream=True)
+        async for chunk in stream:
+            record_usage(PROCESS_FORM_MODEL, getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                for component in parser.feed(delta):
+                    emit(component)
+    return parser.result()
+
+async def _process_page(image: Union[bytes, str], mime_type: str, page_number: int, page_count: int) -> Dict[str, Any]:
+    page_note = ""
+    if page_count > 1:
+        page_note = f"This image is page {page_number} of {page_count} of the form. Only include the fields on this page.\n\n"
+    
+    async with _model_slot():
+        # Build the base64 data URL only once a slot is free, so waiting
+        # uploads do not each hold an encoded copy in memory
+        image_url = upload_service.data_url(image, mime_type)
+        response = await _analyze_page(image_url, page_note)
+    
+    # Extract the form structure from the response
+    return json.loads(response.choices[0].message.content)
+
+async def _analyze_page(image_url: str, page_note: str, stream: bool = False):
     # Call OpenAI API to analyze the form
-    response = openai.chat.completions.create(
-        model="gpt-4o",
+    return await _create_completion(
+        model=PROCESS_FORM_MODEL,
         messages=[
             {
                 "role": "system",
@@ -137,185 +464,354 @@ async def process_form(file: UploadFile) -> Dict[str, Any]:
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": f"Extract the COMPLETE form structure from this image and create a comprehensive form.io compatible JSON representation. Identify and include EVERY field visible in the image without exception.\n\nAnalyze the form systematically, working from top to bottom, left to right. Don't miss any field, checkbox, dropdown, or other input element. For each field, determine the most appropriate form.io component type.\n\nUse the example below as a reference for the format, but adapt to include ALL field types present in this specific form:\n\n{example_template}"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
+                    {"type": "text", "text": f"{page_note}Extract the COMPLETE form structure from this image and create a comprehensive form.io compatible JSON representation. Identify and include EVERY field visible in the image without exception.\n\nAnalyze the form systematically, working from top to bottom, left to right. Don't miss any field, checkbox, dropdown, or other input element. For each field, determine the most appropriate form.io component type.\n\nUse the example below as a reference for the format, but adapt to include ALL field types present in this specific form:\n\n{EXAMPLE_TEMPLATE}"},
+                    {"type": "image_url", "image_url": {"url": image_url}}
                 ]
             }
         ],
         response_format={"type": "json_object"},
-        max_tokens=4000
+        max_tokens=4000,
+        stream=stream,
+        # Streams only report token usage when asked to
+        **({"stream_options": {"include_usage": True}} if stream else {})
     )
+
+def iter_components(components: List[Dict[str, Any]]):
+    """Yield every component in a Form.io component tree, including nested ones"""
+    for component in components:
+        yield component
+        yield from iter_components(component.get("components", []))
+        for column in component.get("columns", []):
+            yield from iter_components(column.get("components", []))
+        for row in component.get("rows", []):
+            for cell in row if isinstance(row, list) else []:
+                yield from iter_components(cell.get("components", []))
+
+def merge_page_structures(page_structures: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge per-page form structures into one form, keeping the first page's
+    form properties and renaming keys that clash with earlier pages
+    """
+    if len(page_structures) == 1:
+        return page_structures[0]
     
-    # Extract the form structure from the response
-    form_structure = json.loads(response.choices[0].message.content)
-    
-    # Ensure submit button exists
-    has_submit = False
+    merged = {key: value for key, value in page_structures[0].items() if key != "components"}
+    merged["components"] = []
+    seen_keys = set()
+    for page in page_structures:
+        components = [
+            component for component in page.get("components", [])
+            if not (component.get("type") == "button" and component.get("action") == "submit")
+        ]
+        renamed = {}
+        for component in iter_components(components):
+            key = component.get("key")
+            if not key:
+                continue
+            if key in seen_keys:
+                suffix = 2
+                while f"{key}{suffix}" in seen_keys:
+                    suffix += 1
+                renamed[key] = f"{key}{suffix}"
+                component["key"] = renamed[key]
+            seen_keys.add(component["key"])
+        # Keep conditionals pointing at the renamed fields on the same page
+        for component in iter_components(components):
+            conditional = component.get("conditional") or {}
+            if conditional.get("when") in renamed:
+                conditional["when"] = renamed[conditional["when"]]
+        merged["components"].extend(components)
+    return merged
+
+def ensure_submit_button(form_structure: Dict[str, Any]):
+    """Append a submit button unless the form already has one"""
     for component in form_structure["components"]:
         if component.get("type") == "button" and component.get("action") == "submit":
-            has_submit = True
-            break
-    
-    if not has_submit:
-        form_structure["components"].append({
-            "input": True,
-            "label": "Submit",
-            "tableView": False,
-            "key": "submit",
-            "size": "md",
-            "leftIcon": "",
-            "rightIcon": "",
-            "block": False,
-            "action": "submit",
-            "disableOnInvalid": False,
-            "theme": "primary",
-            "type": "button"
-        })
-    
-    return form_structure
+            return
+    form_structure["components"].append(copy.deepcopy(SUBMIT_BUTTON))
 
-async def enhance_form(form_data: Dict[str, Any]) -> Dict[str, Any]:
+ENHANCE_SYSTEM_PROMPT = (
+    "You are an AI assistant specialized in enhancing digital form structures. "
+    "Your task is to comprehensively improve the given part of a form.io compatible form structure by:"
+    "1. Adding appropriate validation rules for ALL fields (required, pattern matching, min/max length, etc.)"
+    "2. Optimizing field organization and layout for better user experience"
+    "3. Implementing smart conditional logic between related fields"
+    "4. Enhancing labels, placeholders, and help text for clarity"
+    "5. Ensuring proper field types and formats (email validation, phone formats, etc.)"
+    "6. Preserving all existing fields and their keys exactly while improving their configuration"
+    "7. Maintaining proper form.io structure and properties"
+    "Be thorough and comprehensive - enhance EVERY field in the section while ensuring the structure remains fully compatible with form.io. "
+    "Respond with a JSON object of the form {\"components\": [...]} holding the enhanced section."
+)
+
+def _input_keys(components: List[Dict[str, Any]]) -> List[str]:
+    return [
+        component["key"] for component in iter_components(components)
+        if component.get("input") and component.get("key") and component.get("type") != "button"
+    ]
+
+def _is_submit_button(component: Dict[str, Any]) -> bool:
+    return component.get("type") == "button" and component.get("action") == "submit"
+
+def _child_lists(component: Dict[str, Any]) -> List[Tuple[Tuple, List[Dict[str, Any]]]]:
     """
-    Enhance a form structure using OpenAI
+    The component lists a layout component holds, each with its place: a
+    panel's children, each column's and each table cell's
     """
-    # Convert form structure to string for OpenAI
-    form_json = json.dumps(form_data, indent=2)
-    
-    # Example of a working form.io structure to use as a template
-    example_template = """
-    {
-        "title": "Register",
-        "display": "form",
-        "type": "form",
-        "name": "register",
-        "path": "register",
-        "components": [{
-            "input": true,
-            "tableView": true,
-            "inputType": "text",
-            "inputMask": "",
-            "label": "First Name",
-            "key": "firstName",
-            "placeholder": "",
-            "prefix": "",
-            "suffix": "",
-            "multiple": false,
-            "defaultValue": "",
-            "protected": false,
-            "unique": false,
-            "persistent": true,
-            "validate": {
-                "required": true,
-                "minLength": "",
-                "maxLength": "",
-                "pattern": "",
-                "custom": "",
-                "customPrivate": false
-            },
-            "conditional": {
-                "show": "",
-                "when": null,
-                "eq": ""
-            },
-            "type": "textfield",
-            "tags": [],
-            "lockKey": true,
-            "isNew": false
-        }, {
-            "label": "Radio",
-            "optionsLabelPosition": "right",
-            "inline": false,
-            "tableView": false,
-            "values": [
-                {
-                    "label": "yes",
-                    "value": "yes",
-                    "shortcut": ""
-                },
-                {
-                    "label": "no",
-                    "value": "no",
-                    "shortcut": ""
-                }
-            ],
-            "validateWhenHidden": false,
-            "key": "radio",
-            "type": "radio",
-            "input": true
-        }, {
-            "label": "Comment/Action",
-            "applyMaskOn": "change",
-            "tableView": true,
-            "validateWhenHidden": false,
-            "key": "commentAction",
-            "type": "textfield",
-            "input": true,
-            "conditional": {
-                "show": true,
-                "when": "radio",
-                "eq": "yes"
-            }
-        }, {
-            "input": true,
-            "label": "Submit",
-            "tableView": false,
-            "key": "submit",
-            "size": "md",
-            "leftIcon": "",
-            "rightIcon": "",
-            "block": false,
-            "action": "submit",
-            "disableOnInvalid": false,
-            "theme": "primary",
-            "type": "button"
-        }]
-    }
+    children: List[Tuple[Tuple, List[Dict[str, Any]]]] = []
+    if component.get("components"):
+        children.append((("components",), component["components"]))
+    for column_index, column in enumerate(component.get("columns") or []):
+        if isinstance(column, dict) and "components" in column:
+            children.append((("columns", column_index), column["components"]))
+    for row_index, row in enumerate(component.get("rows") or []):
+        for cell_index, cell in enumerate(row if isinstance(row, list) else []):
+            if isinstance(cell, dict) and "components" in cell:
+                children.append((("rows", row_index, cell_index), cell["components"]))
+    return children
+
+def _with_children(component: Dict[str, Any], children: List[Tuple[Tuple, List[Dict[str, Any]]]]) -> Dict[str, Any]:
+    """A copy of a layout component with its component lists replaced, the inverse of _child_lists"""
+    rebuilt = {**component}
+    if "columns" in rebuilt:
+        rebuilt["columns"] = [{**column} if isinstance(column, dict) else column for column in rebuilt["columns"]]
+    if "rows" in rebuilt:
+        rebuilt["rows"] = [
+            [{**cell} if isinstance(cell, dict) else cell for cell in row] if isinstance(row, list) else row
+            for row in rebuilt["rows"]
+        ]
+    for place, components in children:
+        if place[0] == "components":
+            rebuilt["components"] = components
+        elif place[0] == "columns":
+            rebuilt["columns"][place[1]]["components"] = components
+        else:
+            rebuilt["rows"][place[1]][place[2]]["components"] = components
+    return rebuilt
+
+def plan_sections(components: List[Dict[str, Any]], max_fields: int) -> List[Tuple[str, Any]]:
     """
-    
-    # Call OpenAI API to enhance the form
-    response = openai.chat.completions.create(
-        model="gpt-4",
+    Split a component tree into sections for enhancement. Layout components
+    such as panels become sections of their own, runs of top-level fields
+    are grouped up to max_fields, and a layout too large for one section is
+    kept as a shell whose component lists (a panel's children, each column,
+    each table cell) are planned the same way. Returns ("section",
+    components), ("shell", (component, [(place, plan), ...])) and ("keep",
+    component) steps in form order.
+    """
+    plan: List[Tuple[str, Any]] = []
+    group: List[Dict[str, Any]] = []
+    group_fields = 0
+
+    def flush():
+        nonlocal group, group_fields
+        if group:
+            plan.append(("section", group))
+        group, group_fields = [], 0
+
+    for component in components:
+        if _is_submit_button(component):
+            flush()
+            plan.append(("keep", component))
+            continue
+        field_count = len(_input_keys([component]))
+        is_layout = any(component.get(name) for name in ("components", "columns", "rows"))
+        if is_layout and field_count > max_fields and _child_lists(component):
+            flush()
+            children = [(place, plan_sections(child, max_fields)) for place, child in _child_lists(component)]
+            plan.append(("shell", (component, children)))
+        elif is_layout and field_count:
+            flush()
+            plan.append(("section", [component]))
+        else:
+            if group and group_fields + field_count > max_fields:
+                flush()
+            group.append(component)
+            group_fields += field_count
+    flush()
+    return plan
+
+def _section_cache_key(components: List[Dict[str, Any]]) -> str:
+    encoded = json.dumps(components, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return ":".join([hashlib.sha256(encoded).hexdigest(), "enhance_section", ENHANCE_FORM_MODEL, PROMPT_VERSION])
+
+async def _enhance_section(components: List[Dict[str, Any]], form_keys: List[str]) -> List[Dict[str, Any]]:
+    """Enhance one section, reusing the cached result when the section has been enhanced before"""
+    cache_key = _section_cache_key(components)
+    cached = await digitization_cache.get(cache_key)
+    if cached is not None:
+        metrics.cache_requests.inc(cache="enhance_section", result="hit")
+        return copy.deepcopy(cached)
+
+    metrics.cache_requests.inc(cache="enhance_section", result="miss")
+    # Every caller gets its own copy: the result is shared with whoever joined the call
+    enhanced, _ = await model_flights.do(cache_key, lambda: _enhance_section_now(components, form_keys, cache_key))
+    return copy.deepcopy(enhanced)
+
+async def _enhance_section_now(components: List[Dict[str, Any]], form_keys: List[str], cache_key: str) -> List[Dict[str, Any]]:
+    """Send one section to the model and cache the result"""
+    section_json = json.dumps(components, indent=2)
+    response = await _chat_completion(
+        model=ENHANCE_FORM_MODEL,
         messages=[
-            {
-                "role": "system",
-                "content": "You are an AI assistant specialized in enhancing digital form structures. "
-                           "Your task is to comprehensively improve the given form.io compatible form structure by:"
-                           "1. Adding appropriate validation rules for ALL fields (required, pattern matching, min/max length, etc.)"
-                           "2. Optimizing field organization and layout for better user experience"
-                           "3. Implementing smart conditional logic between related fields"
-                           "4. Enhancing labels, placeholders, and help text for clarity"
-                           "5. Ensuring proper field types and formats (email validation, phone formats, etc.)"
-                           "6. Preserving all existing fields while improving their configuration"
-                           "7. Maintaining proper form.io structure and properties"
-                           "Be thorough and comprehensive - enhance EVERY field in the form while ensuring the entire structure remains fully compatible with form.io."
-            },
+            {"role": "system", "content": ENHANCE_SYSTEM_PROMPT},
             {
                 "role": "user",
-                "content": f"Enhance this form.io structure to create a polished, professional form with proper validation and organization:\n\n{form_json}\n\n"
-                           f"Improve EVERY field in the form while maintaining form.io compatibility. Reference this example for the correct property structure, but adapt to the specific fields in this form:\n\n{example_template}"
+                "content": f"Enhance this section of a form.io structure to create a polished, professional form with proper validation and organization:\n\n{section_json}\n\n"
+                           f"Conditionals may refer to these field keys from elsewhere in the form: {', '.join(form_keys)}\n\n"
+                           f"Improve EVERY field in the section while maintaining form.io compatibility. Reference this example for the correct property structure, but adapt to the specific fields in this section:\n\n{EXAMPLE_TEMPLATE}"
             }
         ],
         response_format={"type": "json_object"},
         max_tokens=4000
     )
-    
-    # Extract the enhanced form structure directly from the response
-    enhanced_form = json.loads(response.choices[0].message.content)
-    return enhanced_form
+    try:
+        enhanced = json.loads(response.choices[0].message.content).get("components")
+    except (ValueError, AttributeError):
+        enhanced = None
+    # A reply that is not a component list, or that drops or renames a field, would lose data
+    if not isinstance(enhanced, list) or not all(isinstance(component, dict) for component in enhanced) \
+            or not set(_input_keys(components)) <= set(_input_keys(enhanced)):
+        return components
+
+    await digitization_cache.set(cache_key, copy.deepcopy(enhanced))
+    # Sending the enhanced section back unchanged is a hit as well
+    await digitization_cache.set(_section_cache_key(enhanced), copy.deepcopy(enhanced))
+    return enhanced
+
+def _reconcile_keys(components: List[Dict[str, Any]], original_keys: List[str]):
+    """
+    Rename fields added by enhancement whose keys clash with other fields,
+    and drop conditionals that point at fields the form does not have
+    """
+    # Each original key stays with the first field not added by enhancement
+    # that holds it; every other field with a taken key is renamed, wherever
+    # it sits, so a section that repeats one of its own keys is caught too
+    keepers = {}
+    original = set(original_keys)
+    for component in iter_components(components):
+        key = component.get("key")
+        if key in original and key not in keepers and not component.get("_added"):
+            keepers[key] = component
+    seen = set(keepers)
+    for component in iter_components(components):
+        key = component.get("key")
+        if not key or keepers.get(key) is component:
+            continue
+        if key in seen:
+            suffix = 2
+            while f"{key}{suffix}" in seen:
+                suffix += 1
+            component["key"] = f"{key}{suffix}"
+        seen.add(component["key"])
+    for component in iter_components(components):
+        component.pop("_added", None)
+        conditional = component.get("conditional")
+        if isinstance(conditional, dict) and conditional.get("when") and conditional["when"] not in seen:
+            component["conditional"] = {"show": "", "when": None, "eq": ""}
+
+async def enhance_form(form_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Enhance a form structure using OpenAI, one section at a time. Sections
+    are enhanced concurrently and merged back in order; unchanged sections
+    are served from the cache, so only edited sections are sent again.
+    """
+    with metrics.stage_seconds.time(span="enhance_form", stage="enhance_form"):
+        return await _enhance_form(copy.deepcopy(form_data))
+
+async def _enhance_form(form_data: Dict[str, Any]) -> Dict[str, Any]:
+    components = form_data.get("components") or []
+    form_keys = _input_keys(components)
+    plan = plan_sections(components, ENHANCE_SECTION_FIELDS)
+
+    sections: List[List[Dict[str, Any]]] = []
+
+    def collect(steps: List[Tuple[str, Any]]):
+        for kind, value in steps:
+            if kind == "section":
+                sections.append(value)
+            elif kind == "shell":
+                for _, children in value[1]:
+                    collect(children)
+
+    collect(plan)
+    slots = asyncio.Semaphore(ENHANCE_CONCURRENCY)
+
+    async def enhance(section: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        async with slots:
+            enhanced = await _enhance_section(section, form_keys)
+        # Mark fields the model added so a clash renames them, not the original
+        original = set(_input_keys(section))
+        for component in iter_components(enhanced):
+            if component.get("key") and component["key"] not in original:
+                component["_added"] = True
+        return enhanced
+
+    results = iter(await asyncio.gather(*(enhance(section) for section in sections)))
+
+    def assemble(steps: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        assembled = []
+        for kind, value in steps:
+            if kind == "section":
+                assembled.extend(next(results))
+            elif kind == "shell":
+                shell, children = value
+                assembled.append(_with_children(shell, [(place, assemble(steps)) for place, steps in children]))
+            else:
+                assembled.append(value)
+        return assembled
+
+    form_data["components"] = assemble(plan)
+    _reconcile_keys(form_data["components"], form_keys)
+    return form_data
 
 async def extract_text(file: UploadFile) -> str:
     """
     Extract text from form image/PDF
     """
-    # Read the file content
-    content = await file.read()
+    with await upload_service.ingest(file) as upload:
+        text, _ = await extract_text_upload(upload)
+    return text
+
+async def extract_text_upload(upload: upload_service.Upload) -> Tuple[str, str]:
+    """
+    Extract text from an ingested upload, returning the text and the cache status
+    """
+    cache_key = ":".join([upload.sha256, "extract_text", EXTRACT_TEXT_MODEL, PROMPT_VERSION])
+    cached = await digitization_cache.get(cache_key)
+    if cached is not None:
+        metrics.cache_requests.inc(cache="extract_text", result="hit")
+        return cached, "hit"
     
-    # Convert to base64 for OpenAI API
-    encoded_image = base64.b64encode(content).decode('utf-8')
+    metrics.cache_requests.inc(cache="extract_text", result="miss")
+
+    async def extract():
+        page_count = await document_service.count_pages(upload.source, upload.content_type)
+
+        async def extract_page(index: int) -> str:
+            image, mime_type = await document_service.render_page(upload.source, upload.content_type, index)
+            return await _extract_text(image, mime_type)
+
+        page_texts = await asyncio.gather(*(extract_page(index) for index in range(page_count)))
+        text = "\n\n".join(page_texts)
+        await digitization_cache.set(cache_key, text)
+        return text
+
+    text, shared = await model_flights.do(cache_key, extract)
+    return text, "coalesced" if shared else "miss"
+
+async def _extract_text(image: Union[bytes, str], mime_type: str) -> str:
+    async with _model_slot():
+        image_url = upload_service.data_url(image, mime_type)
+        response = await _read_page(image_url)
     
+    # Return the extracted text
+    return response.choices[0].message.content
+
+async def _read_page(image_url: str):
     # Call OpenAI API to extract text
-    response = openai.chat.completions.create(
-        model="gpt-4o",
+    return await _create_completion(
+        model=EXTRACT_TEXT_MODEL,
         messages=[
             {
                 "role": "system",
@@ -326,12 +822,9 @@ async def extract_text(file: UploadFile) -> str:
                 "role": "user",
                 "content": [
                     {"type": "text", "text": "Extract all text from this form image."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
+                    {"type": "image_url", "image_url": {"url": image_url}}
                 ]
             }
         ],
         max_tokens=4000
-    )
-    
-    # Return the extracted text
-    return response.choices[0].message.content 
\ No newline at end of file
+    ) 
\ No newline at end of file
@@ -0,0 +1,209 @@
+import io
+import os
+import json
+import uuid
+import base64
+import asyncio
+import hashlib
+import tempfile
+from typing import Dict, Any, Optional, Union
+from dotenv import load_dotenv
+from . import document_service, upload_service
+
+load_dotenv()
+
+# Content-addressed photo storage settings
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "data/attachments")
+ATTACHMENT_URL_PREFIX = os.getenv("ATTACHMENT_URL_PREFIX", "/api/attachments")
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "75"))
+
+# Raster formats kept as photos, by Pillow format name, with the type they
+# are served as. Anything else (SVG above all, which can carry script) is
+# refused on upload and served only as a download.
+IMAGE_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+}
+DOWNLOAD_TYPE = "application/octet-stream"
+
+class AttachmentNotFoundError(Exception):
+    """Raised when no blob exists for an attachment id"""
+
+class UnsupportedImageError(ValueError):
+    """Raised when an upload is not a raster image Pillow can read"""
+
+def _is_attachment_id(attachment_id: str) -> bool:
+    return len(attachment_id) == 64 and all(c in "0123456789abcdef" for c in attachment_id)
+
+def _path(kind: str, attachment_id: str, suffix: str = "") -> str:
+    if not _is_attachment_id(attachment_id):
+        raise AttachmentNotFoundError(attachment_id)
+    return os.path.join(ATTACHMENT_DIR, kind, attachment_id[:2], attachment_id + suffix)
+
+def blob_path(attachment_id: str) -> str:
+    return _path("blobs", attachment_id)
+
+def thumbnail_path(attachment_id: str) -> str:
+    return _path("thumbs", attachment_id, ".jpg")
+
+def _meta_path(attachment_id: str) -> str:
+    return _path("blobs", attachment_id, ".json")
+
+def describe(attachment_id: str, content_type: Optional[str] = None, size: Optional[int] = None) -> Dict[str, Any]:
+    """The reference stored in submissions and reports instead of the photo itself"""
+    reference = {
+        "id": attachment_id,
+        "url": f"{ATTACHMENT_URL_PREFIX}/{attachment_id}",
+        "thumbnailUrl": f"{ATTACHMENT_URL_PREFIX}/{attachment_id}/thumbnail",
+    }
+    if content_type is not None:
+        reference["type"] = content_type
+    if size is not None:
+        reference["size"] = size
+    return reference
+
+def metadata(attachment_id: str) -> Dict[str, Any]:
+    try:
+        with open(_meta_path(attachment_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except OSError:
+        raise AttachmentNotFoundError(attachment_id)
+
+def image_type(source: Union[bytes, str]) -> Optional[str]:
+    """The MIME type of a supported raster image, judged by its content rather than its name, or None"""
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source, formats=list(IMAGE_TYPES)) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        return None
+    return IMAGE_TYPES.get(image_format)
+
+def _commit(attachment_id: str, write_blob, content_type: str, size: int) -> bool:
+    """
+    Put a blob in place unless it already exists. write_blob(path) writes
+    the content to a temporary path that is then renamed into place.
+    Returns True if the blob was new.
+    """
+    path = blob_path(attachment_id)
+    if os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    suffix = f".{uuid.uuid4().hex}.tmp"
+    write_blob(path + suffix)
+    with open(_meta_path(attachment_id) + suffix, "w", encoding="utf-8") as f:
+        json.dump({"type": content_type, "size": size}, f)
+    # Metadata goes first so a visible blob always has it
+    os.replace(_meta_path(attachment_id) + suffix, _meta_path(attachment_id))
+    os.replace(path + suffix, path)
+    return True
+
+def _remove(attachment_id: str):
+    """Take a blob back out of the store, blob first so a visible blob always has metadata"""
+    for path in (blob_path(attachment_id), _meta_path(attachment_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def store_bytes(content: bytes, content_type: str) -> Dict[str, Any]:
+    """
+    Store in-memory content, deduplicated by SHA-256. Content that is not a
+    supported image is kept as a plain download whatever type it claims.
+    """
+    attachment_id = hashlib.sha256(content).hexdigest()
+    content_type = image_type(content) or DOWNLOAD_TYPE
+
+    def write_blob(path: str):
+        with open(path, "wb") as f:
+            f.write(content)
+
+    _commit(attachment_id, write_blob, content_type, len(content))
+    return describe(attachment_id, content_type, len(content))
+
+async def store_upload(upload: upload_service.Upload) -> Dict[str, Any]:
+    """
+    Store an ingested photo, reusing the hash computed while it streamed in.
+    Raises UnsupportedImageError unless it is a raster image in IMAGE_TYPES;
+    the type recorded is the one read from the content.
+    """
+    content_type = await asyncio.to_thread(image_type, upload.source)
+    if content_type is None:
+        raise UnsupportedImageError("Only JPEG, PNG, GIF, WebP, BMP and TIFF images are supported")
+    attachment_id = upload.sha256
+    created = await asyncio.to_thread(_commit, attachment_id, upload.save_to, content_type, upload.size)
+    if created:
+        try:
+            await ensure_thumbnail(attachment_id)
+        except Exception as e:
+            # A photo without a thumbnail is not kept, so nothing refers to it
+            await asyncio.to_thread(_remove, attachment_id)
+            if isinstance(e, (OSError, ValueError, SyntaxError)):
+                raise UnsupportedImageError(f"The image could not be decoded: {e}") from e
+            raise
+    return describe(attachment_id, content_type, upload.size)
+
+def make_thumbnail(source: str, destination: str, size: int, quality: int):
+    """Write a JPEG thumbnail of an image; runs in the document process pool"""
+    from PIL import Image, ImageOps
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            image.save(f, format="JPEG", quality=quality, optimize=True)
+        os.replace(tmp_path, destination)
+
+async def ensure_thumbnail(attachment_id: str) -> str:
+    """Return the thumbnail path, generating it in the worker pool on first use"""
+    destination = thumbnail_path(attachment_id)
+    if not os.path.exists(destination):
+        source = blob_path(attachment_id)
+        if not os.path.exists(source):
+            raise AttachmentNotFoundError(attachment_id)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            document_service.get_pool(), make_thumbnail, source, destination, THUMBNAIL_SIZE, THUMBNAIL_QUALITY
+        )
+    return destination
+
+def _inline_file(value: Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get("url"), str) and value["url"].startswith("data:")
+
+def has_inline_files(value: Any) -> bool:
+    """Whether a submission (or any part of one) carries base64 data URLs"""
+    if _inline_file(value):
+        return True
+    if isinstance(value, dict):
+        return any(has_inline_files(item) for item in value.values())
+    if isinstance(value, list):
+        return any(has_inline_files(item) for item in value)
+    return False
+
+def externalize(value: Any) -> Any:
+    """
+    Return a copy of value with every inline data URL file object (as
+    Form.io's base64 file storage produces) moved into the blob store and
+    replaced by a reference
+    """
+    if _inline_file(value):
+        header, _, encoded = value["url"].partition(",")
+        content_type = header[len("data:"):].split(";")[0] or "application/octet-stream"
+        reference = store_bytes(base64.b64decode(encoded), content_type)
+        for key in ("name", "originalName"):
+            if key in value:
+                reference[key] = value[key]
+        reference["storage"] = "url"
+        return reference
+    if isinstance(value, dict):
+        return {key: externalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [externalize(item) for item in value]
+    return value
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple, Union
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# SQLite database shared by all worker processes on the host; unset keeps
+# every cache private to its process
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
+# How long a deleted key stays marked as deleted, so slow writers that
+# started before the delete cannot bring the old value back
+SHARED_CACHE_TOMBSTONE_TTL = 600
+
+class LRUCache:
+    """Bounded in-memory cache with least-recently-used eviction and an optional TTL"""
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class DiskCache:
+    """
+    JSON values stored one file per key, expired by TTL and evicted
+    oldest-first past max_entries. Entries are counted as they are written
+    rather than by listing the directory, which happens only when the
+    count passes max_entries: eviction then goes a tenth below it, so the
+    walk is paid once per that many new entries.
+    """
+
+    def __init__(self, directory: str, ttl: Optional[float] = None, max_entries: int = 10000):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Entries removed beyond max_entries on each eviction
+        self.slack = max(1, max_entries // 10)
+        os.makedirs(directory, exist_ok=True)
+        # Counted on the first write; approximate when several processes
+        # share the directory, and corrected by every eviction
+        self._count: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                self._discard(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: Any):
+        if self._count is None:
+            self._count = len(self._entries(time.time()))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        new = not os.path.exists(path)
+        # Write to a temporary file first so readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        if new:
+            self._count += 1
+            if self._count > self.max_entries:
+                self.evict()
+
+    def delete(self, key: str):
+        self._discard(self._path(key))
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        if self._count:
+            self._count -= 1
+
+    def _entries(self, now: float) -> List[Tuple[float, str]]:
+        """(mtime, path) of every entry, removing expired ones on the way"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if self.ttl and mtime + self.ttl < now:
+                    self._remove(path)
+                else:
+                    entries.append((mtime, path))
+        return entries
+
+    def evict(self):
+        """Remove expired entries, then the oldest ones until the cache is slack entries below max_entries"""
+        entries = self._entries(time.time())
+        keep = max(0, self.max_entries - self.slack)
+        if len(entries) > keep:
+            entries.sort()
+            for _, path in entries[:len(entries) - keep]:
+                self._remove(path)
+            entries = entries[len(entries) - keep:]
+        self._count = len(entries)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class SQLiteCache:
+    """
+    JSON values in a SQLite database in WAL mode, one copy for every worker
+    process on the host. Each value is stamped with the time it was written,
+    so a process can tell whether a copy it already holds is still current.
+    """
+
+    def __init__(self, path: str, namespace: str, ttl: Optional[float] = None, max_entries: int = 10000):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily and again after a fork: a preloaded app is imported
+        # in the parent process and connections must not cross into workers
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, stamp REAL NOT NULL, "
+                "expires REAL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_stamp ON cache (namespace, stamp)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def lookup(self, key: str, stamp: Optional[float] = None) -> Tuple[Optional[float], Optional[Any]]:
+        """
+        The current stamp and value of key, or (None, None) if it is not
+        cached. The value is left out (None) when the stamp matches the one
+        given, i.e. the caller's copy is current and need not be parsed again.
+        """
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT stamp, CASE WHEN stamp = ? THEN NULL ELSE value END FROM cache "
+                "WHERE namespace = ? AND key = ? AND value IS NOT NULL AND (expires IS NULL OR expires > ?)",
+                (stamp, self.namespace, key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None, None
+        try:
+            return row[0], json.loads(row[1]) if row[1] is not None else None
+        except ValueError:
+            return None, None
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.lookup(key)[1]
+
+    def set(self, key: str, value: Any, since: Optional[float] = None) -> Optional[float]:
+        """
+        Store value and return its stamp. With since, the write is dropped
+        (returning None) if the key was written or deleted after that time.
+        """
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        data = json.dumps(value)
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO cache (namespace, key, value, stamp, expires) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, stamp = excluded.stamp, "
+                "expires = excluded.expires WHERE cache.stamp <= ? OR cache.expires <= ?",
+                (self.namespace, key, data, now, expires, since if since is not None else now, now),
+            )
+            written = cursor.rowcount > 0
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(conn, now)
+        return now if written else None
+
+    def delete(self, key: str):
+        """Forget key in every process, rejecting older writes still on their way"""
+        now = time.time()
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, stamp, expires) VALUES (?, ?, NULL, ?, ?)",
+                (self.namespace, key, now, now + SHARED_CACHE_TOMBSTONE_TTL),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Remove expired entries, then the oldest ones until the namespace fits max_entries"""
+        conn.execute("DELETE FROM cache WHERE namespace = ? AND expires <= ?", (self.namespace, now))
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN (SELECT key FROM cache WHERE namespace = ? "
+            "ORDER BY stamp DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
+
+def shared_cache(namespace: str, ttl: Optional[float] = None, max_entries: int = 10000) -> Optional[SQLiteCache]:
+    """A namespace of the cross-process cache, or None when SHARED_CACHE_PATH is not set"""
+    if not SHARED_CACHE_PATH:
+        return None
+    return SQLiteCache(SHARED_CACHE_PATH, namespace, ttl=ttl, max_entries=max_entries)
+
+class TieredCache:
+    """In-memory LRU in front of an optional on-disk or shared tier"""
+
+    def __init__(self, memory: LRUCache, disk: Optional[Union[DiskCache, SQLiteCache]] = None):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    async def delete(self, key: str):
+        self.memory.delete(key)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
@@ -0,0 +1,239 @@
+import os
+import io
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple, Union
+from dotenv import load_dotenv
+from . import metrics
+
+load_dotenv()
+
+# PDF pages are rendered so their longer edge is about this many pixels,
+# enough for the model to read small print without sending oversized images
+PDF_RENDER_LONG_EDGE = int(os.getenv("PDF_RENDER_LONG_EDGE", "2000"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", str(os.cpu_count() or 1)))
+
+# Image preprocessing applied to every page before it is sent to the model
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "true").lower() in ("1", "true", "yes")
+IMAGE_LONG_EDGE = int(os.getenv("IMAGE_LONG_EDGE", "1600"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()  # "jpeg" or "webp"
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() in ("1", "true", "yes")
+IMAGE_DESKEW = os.getenv("IMAGE_DESKEW", "true").lower() in ("1", "true", "yes")
+IMAGE_CROP_MARGINS = os.getenv("IMAGE_CROP_MARGINS", "true").lower() in ("1", "true", "yes")
+IMAGE_MAX_SKEW = float(os.getenv("IMAGE_MAX_SKEW", "5"))
+
+# Bytes received from uploads and bytes of page images sent to the model
+pages_rendered = metrics.Counter("elyndra_pages_rendered_total", "Page images prepared for the model")
+document_bytes = metrics.Counter(
+    "elyndra_document_bytes_total", "Bytes of uploaded documents and of the page images made from them", ("kind",)
+)
+
+# Process pool for CPU-bound rendering, created on first use
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=DOCUMENT_WORKERS)
+    return _pool
+
+def shutdown():
+    """Stop the worker processes"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+def image_options() -> Dict[str, Any]:
+    """Preprocessing settings, passed to the worker processes with each task"""
+    return {
+        "enabled": IMAGE_PREPROCESS,
+        "long_edge": IMAGE_LONG_EDGE,
+        "format": IMAGE_FORMAT,
+        "quality": IMAGE_QUALITY,
+        "grayscale": IMAGE_GRAYSCALE,
+        "deskew": IMAGE_DESKEW,
+        "crop_margins": IMAGE_CROP_MARGINS,
+        "max_skew": IMAGE_MAX_SKEW,
+    }
+
+def _skew_angle(gray, max_skew: float) -> float:
+    """
+    Estimate the page rotation by trying small angles and keeping the one
+    whose horizontal ink profile is sharpest (text lines line up with rows)
+    """
+    from PIL import Image, ImageFilter
+    small = gray.copy()
+    small.thumbnail((800, 800))
+    # Edges rather than dark pixels, so a dark table or border around the page is ignored
+    ink = small.filter(ImageFilter.FIND_EDGES).point(lambda value: 255 if value > 48 else 0)
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_skew * 2)
+    for step in range(-steps, steps + 1):
+        angle = step / 2
+        rotated = ink.rotate(angle, resample=Image.BILINEAR, fillcolor=0)
+        profile = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        mean = sum(profile) / len(profile)
+        score = sum((value - mean) ** 2 for value in profile)
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+def _corner_color(image):
+    """Average colour of the image corners, used to fill the area uncovered by a rotation"""
+    width, height = image.size
+    corners = [image.getpixel(point) for point in ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1))]
+    if image.mode == "L":
+        return sum(corners) // 4
+    return tuple(sum(channel) // 4 for channel in zip(*corners))
+
+def _content_box(gray, padding: float = 0.02):
+    """Bounding box of the non-background area, padded by a fraction of the page size"""
+    from PIL import ImageOps
+    box = ImageOps.invert(gray).point(lambda value: 255 if value > 64 else 0).getbbox()
+    if box is None:
+        return None
+    pad_x, pad_y = int(gray.width * padding), int(gray.height * padding)
+    left, top, right, bottom = box
+    return (max(0, left - pad_x), max(0, top - pad_y), min(gray.width, right + pad_x), min(gray.height, bottom + pad_y))
+
+def encode_image(image, options: Dict[str, Any]) -> Tuple[bytes, str]:
+    buffer = io.BytesIO()
+    if options["format"] == "webp":
+        image.save(buffer, format="WEBP", quality=options["quality"], method=4)
+        return buffer.getvalue(), "image/webp"
+    image.save(buffer, format="JPEG", quality=options["quality"], optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+def preprocess(image, options: Dict[str, Any]) -> Tuple[bytes, str]:
+    """Orient, deskew, crop, convert and downsample a page image, then re-encode it"""
+    from PIL import Image, ImageOps
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L" if options["grayscale"] else "RGB")
+    # Shrink early so deskew and cropping work on a reasonably sized image
+    working_edge = int(options["long_edge"] * 1.25)
+    if max(image.size) > working_edge:
+        image.thumbnail((working_edge, working_edge), Image.LANCZOS)
+    gray = image if image.mode == "L" else image.convert("L")
+    if options["deskew"]:
+        angle = _skew_angle(gray, options["max_skew"])
+        if abs(angle) >= 0.5:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=_corner_color(image))
+            gray = image if image.mode == "L" else image.convert("L")
+    if options["crop_margins"]:
+        box = _content_box(gray)
+        if box is not None:
+            image = image.crop(box)
+    if max(image.size) > options["long_edge"]:
+        image.thumbnail((options["long_edge"], options["long_edge"]), Image.LANCZOS)
+    return encode_image(image, options)
+
+def preprocess_upload(source: Union[bytes, str], options: Dict[str, Any]) -> Tuple[bytes, str]:
+    from PIL import Image
+    return preprocess(Image.open(io.BytesIO(source) if isinstance(source, bytes) else source), options)
+
+def count_pdf_pages(source: Union[bytes, str]) -> int:
+    import pypdfium2 as pdfium
+    document = pdfium.PdfDocument(source)
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+def render_pdf_page(source: Union[bytes, str], index: int, long_edge: int, options: Dict[str, Any]) -> Tuple[bytes, str]:
+    """Render one PDF page so its longer edge is long_edge pixels, then preprocess it"""
+    import pypdfium2 as pdfium
+    document = pdfium.PdfDocument(source)
+    try:
+        page = document[index]
+        width, height = page.get_size()
+        scale = long_edge / max(width, height)
+        image = page.render(scale=scale).to_pil()
+    finally:
+        document.close()
+    if not options["enabled"]:
+        return encode_image(image.convert("RGB"), {**options, "format": "jpeg", "quality": 85})
+    return preprocess(image, options)
+
+# Side of the grid a page is reduced to for its layout fingerprint
+FINGERPRINT_GRID = 16
+FINGERPRINT_BITS = 3 * FINGERPRINT_GRID * FINGERPRINT_GRID
+
+def _threshold_bits(bits: int, values, threshold) -> int:
+    for value in values:
+        bits = (bits << 1) | (value > threshold)
+    return bits
+
+def fingerprint_image(image: Union[bytes, str]) -> int:
+    """
+    Layout fingerprint of a page image as a FINGERPRINT_BITS-bit integer. The
+    paper is flattened out (so shadows and uneven lighting drop away), the
+    ink is cropped to its bounding box and reduced to a small grid, then
+    hashed three ways: which cells hold more ink than the median, and where
+    ink increases to the right and downwards. Handwriting, blur and small
+    shifts flip few bits; a different arrangement of boxes and lines flips
+    many.
+    """
+    from PIL import Image, ImageChops, ImageFilter, ImageOps
+    page = Image.open(io.BytesIO(image) if isinstance(image, bytes) else image)
+    page = ImageOps.exif_transpose(page).convert("L")
+    page.thumbnail((400, 400))
+    paper = page.filter(ImageFilter.MaxFilter(9)).filter(ImageFilter.GaussianBlur(8))
+    ink = ImageChops.subtract(paper, page)
+    box = ink.point(lambda value: 255 if value > 40 else 0).getbbox()
+    if box is not None:
+        ink = ink.crop(box)
+    grid = FINGERPRINT_GRID
+    cells = list(ink.resize((grid, grid), Image.BOX).getdata())
+    bits = _threshold_bits(0, cells, sorted(cells)[len(cells) // 2])
+    rows = list(ink.resize((grid + 1, grid), Image.BOX).getdata())
+    bits = _threshold_bits(bits, (rows[i + i // grid + 1] - rows[i + i // grid] for i in range(grid * grid)), 0)
+    columns = list(ink.resize((grid, grid + 1), Image.BOX).getdata())
+    return _threshold_bits(bits, (columns[i + grid] - columns[i] for i in range(grid * grid)), 0)
+
+def source_size(source: Union[bytes, str]) -> int:
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+async def count_pages(source: Union[bytes, str], content_type: str) -> int:
+    """
+    Number of page images an upload turns into; source is the content
+    itself or the path of a spooled upload
+    """
+    document_bytes.inc(source_size(source), kind="upload")
+    if content_type != "application/pdf":
+        return 1
+    loop = asyncio.get_running_loop()
+    with metrics.stage_seconds.time(stage="count_pages"):
+        page_count = await loop.run_in_executor(get_pool(), count_pdf_pages, source)
+    if page_count > PDF_MAX_PAGES:
+        raise ValueError(f"PDF has {page_count} pages, the limit is {PDF_MAX_PAGES}")
+    return page_count
+
+async def render_page(source: Union[bytes, str], content_type: str, index: int) -> Tuple[Union[bytes, str], str]:
+    """
+    Return (image, mime type) for one preprocessed page, worked on in the
+    process pool. With preprocessing off, image uploads come back as the
+    source unchanged, so a spooled upload stays on disk.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.stage_seconds.time(span="render_page", stage="render_page"):
+        if content_type == "application/pdf":
+            image, mime_type = await loop.run_in_executor(
+                get_pool(), render_pdf_page, source, index, PDF_RENDER_LONG_EDGE, image_options()
+            )
+        elif IMAGE_PREPROCESS:
+            image, mime_type = await loop.run_in_executor(get_pool(), preprocess_upload, source, image_options())
+        else:
+            image, mime_type = source, content_type
+    pages_rendered.inc()
+    document_bytes.inc(source_size(image), kind="model_image")
+    metrics.payload_bytes.observe(source_size(image), kind="model_image")
+    return image, mime_type
+
+async def fingerprint(image: Union[bytes, str]) -> int:
+    """Layout fingerprint of a rendered page, computed in the process pool"""
+    loop = asyncio.get_running_loop()
+    with metrics.stage_seconds.time(stage="fingerprint"):
+        return await loop.run_in_executor(get_pool(), fingerprint_image, image)
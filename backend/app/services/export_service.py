@@ -0,0 +1,493 @@
+import io
+import os
+import re
+import csv
+import zlib
+import asyncio
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator, BinaryIO, Callable
+from urllib.parse import urljoin
+from dotenv import load_dotenv
+from . import attachment_service, report_service
+
+load_dotenv()
+
+# Photos shown per issue in XLSX and PDF exports (CSV lists every photo URL)
+REPORT_EXPORT_PHOTOS = int(os.getenv("REPORT_EXPORT_PHOTOS", "4"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+
+COLUMNS = ("Date submitted", "Location", "Issue type", "Priority", "Status", "Description", "Issue", "Form")
+
+def filename(format: str) -> str:
+    return f"maintenance-report-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+
+def _photo_urls(issue: Dict[str, Any], base_url: str) -> List[str]:
+    return [urljoin(base_url, photo["url"]) for photo in issue["photos"] if isinstance(photo, dict) and photo.get("url")]
+
+def _row(issue: Dict[str, Any]) -> List[Any]:
+    return [
+        issue["dateSubmitted"], issue["location"], issue["issueType"], issue["priority"],
+        issue["status"], issue["description"], issue["id"], issue["formId"],
+    ]
+
+def _read_thumbnail(path: str) -> Tuple[bytes, int, int, str]:
+    from PIL import Image
+    with open(path, "rb") as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as image:
+        return data, image.width, image.height, image.mode
+
+async def _thumbnail_path(photo: Any) -> Optional[str]:
+    """The path of a stored photo's JPEG thumbnail, generated on first use, or None if there is none"""
+    attachment_id = photo.get("id") if isinstance(photo, dict) else None
+    if not isinstance(attachment_id, str):
+        return None
+    try:
+        return await attachment_service.ensure_thumbnail(attachment_id)
+    except Exception:
+        return None
+
+async def _thumbnail(photo: Any) -> Optional[Tuple[bytes, int, int, str]]:
+    """The JPEG thumbnail of a stored photo with its size and mode, or None if there is none"""
+    path = await _thumbnail_path(photo)
+    if path is None:
+        return None
+    try:
+        return await asyncio.to_thread(_read_thumbnail, path)
+    except Exception:
+        return None
+
+def _thumbnail_photos(issue: Dict[str, Any]) -> List[Any]:
+    return [photo for photo in issue["photos"] if isinstance(photo, dict) and photo.get("id")][:REPORT_EXPORT_PHOTOS]
+
+async def export_report(
+    format: str,
+    location: Optional[str] = None,
+    priority: Optional[str] = None,
+    form_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    photos: bool = True,
+    base_url: str = "",
+) -> AsyncIterator[bytes]:
+    """
+    Stream the maintenance report as CSV, XLSX or PDF. Issues are read from
+    a snapshot of the issue index a batch at a time and written out as they
+    are read, so memory stays flat however many issues match.
+    """
+    writers = {"csv": write_csv, "xlsx": write_xlsx, "pdf": write_pdf}
+    async with report_service.export_snapshot(location, priority, form_id, date_from, date_to) as snapshot:
+        async for chunk in writers[format](snapshot, photos=photos, base_url=base_url):
+            yield chunk
+
+# CSV
+
+# Spreadsheet apps run a cell starting with one of these as a formula
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _csv_text(value: Any) -> Any:
+    """Submitted text as a CSV field that opens as text, not as a formula"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+async def write_csv(snapshot: report_service.IssueSnapshot, photos: bool = True, base_url: str = "") -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([*COLUMNS, "Photos"])
+    # With a byte order mark Excel opens the file as UTF-8
+    yield buffer.getvalue().encode("utf-8-sig")
+    async for batch in snapshot.batches():
+        buffer.seek(0)
+        buffer.truncate()
+        for issue in batch:
+            writer.writerow([_csv_text(value) for value in [*_row(issue), " ".join(_photo_urls(issue, base_url))]])
+        yield buffer.getvalue().encode("utf-8")
+
+# XLSX, written with openpyxl in write-only mode: rows go to a temporary
+# file as they are appended and thumbnails are only referenced by path until
+# the workbook is saved, so memory stays flat
+
+# Excel cells hold at most this many characters
+XLSX_MAX_TEXT = 32767
+# Thumbnails are fitted into a box this many pixels square; photo rows are made tall enough
+XLSX_THUMBNAIL_PIXELS = 80
+XLSX_PHOTO_ROW_HEIGHT = 64
+XLSX_COLUMN_WIDTHS = (17, 20, 20, 10, 10, 60, 26, 26)
+# The saved workbook is handed over in chunks of about this size
+XLSX_CHUNK_SIZE = 256 * 1024
+
+# Characters XML 1.0 does not allow, which openpyxl refuses
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+def _excel_date(value: Any) -> Optional[datetime]:
+    """An ISO timestamp as a naive UTC datetime, which Excel shows as a date"""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def _cell_text(value: Any) -> Any:
+    if value is None or value == "":
+        return None
+    return _INVALID_XML.sub("", str(value))[:XLSX_MAX_TEXT]
+
+class _ChunkPipe(io.RawIOBase):
+    """
+    File a worker thread writes to while the event loop reads it, a chunk at
+    a time; writes wait while the reader is behind
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+        self._loop = loop
+        self._aborted = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._aborted:
+            raise OSError("The export was abandoned")
+        asyncio.run_coroutine_threadsafe(self.queue.put(bytes(data)), self._loop).result()
+        return len(data)
+
+    def abort(self):
+        self._aborted = True
+
+async def _stream_from_thread(write: Callable[[BinaryIO], None], chunk_size: int) -> AsyncIterator[bytes]:
+    """Run write(file) in a thread and yield what it writes as it is written"""
+    pipe = _ChunkPipe(asyncio.get_running_loop())
+
+    def run():
+        with io.BufferedWriter(pipe, chunk_size) as output:
+            write(output)
+
+    task = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        while True:
+            chunk = asyncio.ensure_future(pipe.queue.get())
+            await asyncio.wait({chunk, task}, return_when=asyncio.FIRST_COMPLETED)
+            if chunk.done():
+                yield chunk.result()
+                continue
+            chunk.cancel()
+            # Every write returns only once its chunk is queued, so the queue holds the rest
+            while not pipe.queue.empty():
+                yield pipe.queue.get_nowait()
+            task.result()
+            return
+    finally:
+        if not task.done():
+            # Make the thread's next write fail and unblock the one it is waiting on
+            pipe.abort()
+            while not task.done():
+                while not pipe.queue.empty():
+                    pipe.queue.get_nowait()
+                await asyncio.wait({task}, timeout=0.05)
+            task.exception()
+
+def _xlsx_image(path: str):
+    """A thumbnail fitted into the thumbnail box; openpyxl reads the file again only when saving"""
+    from openpyxl.drawing.image import Image
+    try:
+        image = Image(path)
+    except Exception:
+        return None
+    scale = min(XLSX_THUMBNAIL_PIXELS / image.width, XLSX_THUMBNAIL_PIXELS / image.height, 1.0)
+    image.width, image.height = int(image.width * scale), int(image.height * scale)
+    return image
+
+async def write_xlsx(snapshot: report_service.IssueSnapshot, photos: bool = True, base_url: str = "") -> AsyncIterator[bytes]:
+    """
+    Write the report as a workbook with one sheet in a single pass over the
+    snapshot, with a link to each photo and, with photos, its thumbnail.
+    The workbook is saved in a thread and sent as the ZIP is written.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Maintenance report")
+    photo_columns = REPORT_EXPORT_PHOTOS
+    for index, width in enumerate(XLSX_COLUMN_WIDTHS + (14,) * photo_columns, 1):
+        sheet.column_dimensions[get_column_letter(index)].width = width
+    sheet.freeze_panes = "A2"
+    header_font = Font(bold=True)
+    link_font = Font(underline="single", color="FF0563C1")
+    top = Alignment(vertical="top")
+    wrap = Alignment(vertical="top", wrap_text=True)
+
+    def cell(value: Any, **style) -> WriteOnlyCell:
+        styled = WriteOnlyCell(sheet, value)
+        for name, setting in style.items():
+            setattr(styled, name, setting)
+        return styled
+
+    def text(value: Any, **style) -> WriteOnlyCell:
+        # Submitted text is always a string cell; openpyxl would otherwise
+        # store anything starting with "=" as a live formula
+        styled = cell(_cell_text(value), **style)
+        if styled.value is not None:
+            styled.data_type = "s"
+        return styled
+
+    def append(number: int, issue: Dict[str, Any], urls: List[str], thumbnails: List[Optional[str]]):
+        values = _row(issue)
+        date = _excel_date(values[0])
+        row = [cell(date, number_format="yyyy-mm-dd hh:mm", alignment=top) if date else text(values[0])]
+        row += [text(value, alignment=wrap) if index == 5 else text(value) for index, value in enumerate(values[1:], 1)]
+        for url in urls:
+            row.append(cell('=HYPERLINK("{}","Open photo")'.format(url.replace('"', '""')), font=link_font, alignment=top))
+        for column, path in enumerate(thumbnails, len(COLUMNS) + 1):
+            image = _xlsx_image(path) if path else None
+            if image is not None:
+                sheet.add_image(image, f"{get_column_letter(column)}{number}")
+        if any(thumbnails):
+            # Read when the row is written, so it can be dropped straight after
+            sheet.row_dimensions[number].height = XLSX_PHOTO_ROW_HEIGHT
+        sheet.append(row)
+        sheet.row_dimensions.pop(number, None)
+
+    def append_batch(first: int, batch: List[Dict[str, Any]], thumbnails: List[List[Optional[str]]]):
+        for number, (issue, paths) in enumerate(zip(batch, thumbnails), first):
+            append(number, issue, _photo_urls(issue, base_url)[:photo_columns], paths)
+
+    sheet.append([cell(name, font=header_font) for name in COLUMNS] + [cell(f"Photo {index}", font=header_font) for index in range(1, photo_columns + 1)])
+    number = 1
+    async for batch in snapshot.batches():
+        thumbnails = [
+            list(await asyncio.gather(*(_thumbnail_path(photo) for photo in _thumbnail_photos(issue)))) if photos else []
+            for issue in batch
+        ]
+        await asyncio.to_thread(append_batch, number + 1, batch, thumbnails)
+        number += len(batch)
+    sheet.auto_filter.ref = f"A1:{get_column_letter(len(COLUMNS) + photo_columns)}{number}"
+
+    async for chunk in _stream_from_thread(workbook.save, XLSX_CHUNK_SIZE):
+        yield chunk
+
+# PDF, written object by object; only the byte offsets of the objects are
+# kept for the cross-reference table at the end
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+PAGE_MARGIN = 40
+PDF_THUMBNAIL_HEIGHT = 90
+PDF_THUMBNAIL_WIDTH = 120
+PDF_MAX_DESCRIPTION_LINES = 40
+
+# Widths of the printable ASCII characters in Helvetica, per 1000 units of font size
+_HELVETICA_WIDTHS = dict(zip((chr(code) for code in range(32, 127)), (int(width) for width in (
+    "278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 "
+    "278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 667 778 722 667 "
+    "611 722 667 944 667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 556 222 222 500 222 833 "
+    "556 556 556 556 333 500 278 556 500 722 500 500 500 334 260 334 584"
+).split())))
+
+def _text_width(text: str, size: float, bold: bool = False) -> float:
+    units = sum(_HELVETICA_WIDTHS.get(c, 556) for c in text)
+    # Helvetica-Bold is a few percent wider on average
+    return units * size / 1000 * (1.06 if bold else 1.0)
+
+def _wrap(text: str, size: float, width: float) -> List[str]:
+    """Break text into lines of at most width points, at spaces where possible"""
+    space = _text_width(" ", size)
+    lines = []
+    for paragraph in (text or "").splitlines() or [""]:
+        line, line_width = "", 0.0
+        for word in paragraph.split(" "):
+            word_width = _text_width(word, size)
+            if line and line_width + space + word_width > width:
+                lines.append(line)
+                line, line_width = "", 0.0
+            if line:
+                line, line_width = f"{line} {word}", line_width + space + word_width
+                continue
+            # Break words longer than a whole line
+            while word_width > width:
+                cut, cut_width = 0, 0.0
+                while cut < len(word) - 1:
+                    char_width = _text_width(word[cut], size)
+                    if cut and cut_width + char_width > width:
+                        break
+                    cut, cut_width = cut + 1, cut_width + char_width
+                lines.append(word[:cut])
+                word, word_width = word[cut:], word_width - cut_width
+            line, line_width = word, word_width
+        lines.append(line)
+    return lines
+
+def _fit(text: str, size: float, width: float, bold: bool = False) -> str:
+    """Shorten text to one line of at most width points"""
+    if _text_width(text, size, bold) <= width:
+        return text
+    while text and _text_width(text + "...", size, bold) > width:
+        text = text[:-1]
+    return text + "..."
+
+def _pdf_string(text: str) -> str:
+    encoded = text.encode("cp1252", "replace").decode("latin-1")
+    return "(" + encoded.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "") + ")"
+
+class PdfStream:
+    """Numbers PDF objects and serializes them, tracking their offsets in the output"""
+
+    CATALOG, PAGES, FONT, BOLD_FONT, INFO = 1, 2, 3, 4, 5
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = array("Q", [0] * (self.INFO + 1))
+        self.pages = array("L")
+
+    def allocate(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets) - 1
+
+    def emit(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+    def object(self, number: int, body: str) -> bytes:
+        self.offsets[number] = self.position
+        return self.emit(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def stream(self, number: int, dictionary: str, data: bytes) -> bytes:
+        self.offsets[number] = self.position
+        head = f"{number} 0 obj\n<< {dictionary} /Length {len(data)} >>\nstream\n".encode("latin-1")
+        return self.emit(head + data + b"\nendstream\nendobj\n")
+
+    def finish(self, title: str) -> bytes:
+        kids = " ".join(f"{page} 0 R" for page in self.pages)
+        created = datetime.now().strftime("D:%Y%m%d%H%M%S")
+        data = self.object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>")
+        data += self.object(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>")
+        data += self.object(self.INFO, f"<< /Title {_pdf_string(title)} /CreationDate ({created}) >>")
+        start = self.position
+        xref = [f"xref\n0 {len(self.offsets)}\n", "0000000000 65535 f \n"]
+        xref += [f"{offset:010d} 00000 n \n" for offset in self.offsets[1:]]
+        xref.append(f"trailer\n<< /Size {len(self.offsets)} /Root {self.CATALOG} 0 R /Info {self.INFO} 0 R >>\nstartxref\n{start}\n%%EOF\n")
+        return data + self.emit("".join(xref).encode("latin-1"))
+
+class _Page:
+    """Drawing operations and images of the page being laid out"""
+
+    def __init__(self, number: int):
+        self.number = number
+        self.operations: List[str] = []
+        self.images: List[Tuple[str, Tuple[bytes, int, int, str]]] = []
+        self.y = PAGE_HEIGHT - PAGE_MARGIN
+
+    def text(self, x: float, y: float, text: str, size: float, bold: bool = False):
+        font = "F2" if bold else "F1"
+        self.operations.append(f"BT /{font} {size} Tf {x:.2f} {y:.2f} Td {_pdf_string(text)} Tj ET")
+
+    def line(self, x1: float, y1: float, x2: float, y2: float):
+        self.operations.append(f"0.8 G 0.5 w {x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S 0 G")
+
+    def image(self, thumbnail: Tuple[bytes, int, int, str], x: float, y: float, width: float, height: float):
+        name = f"Im{len(self.images) + 1}"
+        self.images.append((name, thumbnail))
+        self.operations.append(f"q {width:.2f} 0 0 {height:.2f} {x:.2f} {y:.2f} cm /{name} Do Q")
+
+def _issue_block(issue: Dict[str, Any]) -> Tuple[str, str, List[str]]:
+    """The heading, details line and wrapped description of an issue"""
+    width = PAGE_WIDTH - 2 * PAGE_MARGIN
+    date = issue["dateSubmitted"] or ""
+    heading = _fit(f"{date[:16].replace('T', ' ')}  -  {issue['location']}", 11, width, bold=True)
+    details = _fit(f"Type: {issue['issueType']}    Priority: {issue['priority']}    Status: {issue['status']}", 9, width)
+    description = _wrap(issue["description"] or "", 10, width)
+    if len(description) > PDF_MAX_DESCRIPTION_LINES:
+        description = description[:PDF_MAX_DESCRIPTION_LINES - 1] + [_fit(description[PDF_MAX_DESCRIPTION_LINES - 1] + " ...", 10, width)]
+    return heading, details, description
+
+async def write_pdf(snapshot: report_service.IssueSnapshot, photos: bool = True, base_url: str = "") -> AsyncIterator[bytes]:
+    """
+    Write the report as an A4 PDF, one block per issue with a row of photo
+    thumbnails, each page sent as soon as it is laid out
+    """
+    title = "Maintenance report"
+    pdf = PdfStream()
+    yield pdf.emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    fonts = pdf.object(pdf.FONT, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    fonts += pdf.object(pdf.BOLD_FONT, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+    yield fonts
+
+    def render(page: _Page) -> bytes:
+        page.text(PAGE_MARGIN, PAGE_MARGIN / 2, f"Page {page.number}", 8)
+        data = b""
+        images = []
+        for name, (jpeg, width, height, mode) in page.images:
+            number = pdf.allocate()
+            color_space = "/DeviceGray" if mode == "L" else "/DeviceRGB"
+            data += pdf.stream(
+                number,
+                f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode",
+                jpeg,
+            )
+            images.append(f"/{name} {number} 0 R")
+        contents = pdf.allocate()
+        data += pdf.stream(contents, "/Filter /FlateDecode", zlib.compress("\n".join(page.operations).encode("latin-1")))
+        number = pdf.allocate()
+        data += pdf.object(
+            number,
+            f"<< /Type /Page /Parent {pdf.PAGES} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 {pdf.FONT} 0 R /F2 {pdf.BOLD_FONT} 0 R >> /XObject << {' '.join(images)} >> >> "
+            f"/Contents {contents} 0 R >>",
+        )
+        pdf.pages.append(number)
+        return data
+
+    page = _Page(1)
+    page.y -= 16
+    page.text(PAGE_MARGIN, page.y, title, 16, bold=True)
+    page.y -= 16
+    generated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    page.text(PAGE_MARGIN, page.y, f"Generated on {generated}    {snapshot.total} issues", 9)
+    page.y -= 20
+    if snapshot.total == 0:
+        page.text(PAGE_MARGIN, page.y - 12, "No issues match the report filters.", 10)
+
+    async for issue in snapshot.issues():
+        heading, details, description = _issue_block(issue)
+        thumbnails = []
+        if photos:
+            found = await asyncio.gather(*(_thumbnail(photo) for photo in _thumbnail_photos(issue)))
+            thumbnails = [thumbnail for thumbnail in found if thumbnail is not None]
+        height = 14 + 13 + 12 * len(description) + (PDF_THUMBNAIL_HEIGHT + 6 if thumbnails else 0) + 12
+        if page.y - height < PAGE_MARGIN:
+            yield render(page)
+            page = _Page(page.number + 1)
+        page.y -= 12
+        page.text(PAGE_MARGIN, page.y, heading, 11, bold=True)
+        page.y -= 13
+        page.text(PAGE_MARGIN, page.y, details, 9)
+        for line in description:
+            page.y -= 12
+            page.text(PAGE_MARGIN, page.y, line, 10)
+        if thumbnails:
+            page.y -= PDF_THUMBNAIL_HEIGHT + 6
+            x = PAGE_MARGIN
+            for thumbnail in thumbnails:
+                scale = min(PDF_THUMBNAIL_WIDTH / thumbnail[1], PDF_THUMBNAIL_HEIGHT / thumbnail[2])
+                width, height = thumbnail[1] * scale, thumbnail[2] * scale
+                page.image(thumbnail, x, page.y, width, height)
+                x += width + 8
+        page.y -= 8
+        page.line(PAGE_MARGIN, page.y, PAGE_WIDTH - PAGE_MARGIN, page.y)
+        page.y -= 4
+    yield render(page)
+    yield pdf.finish(title)
@@ -1,8 +1,12 @@
 import os
+import time
+import asyncio
 import httpx
-from typing import Dict, Any
-from datetime import datetime
+from typing import Dict, Any, Optional, AsyncIterator, List, Set, Tuple
 from dotenv import load_dotenv
+from .cache import LRUCache, shared_cache
+from . import attachment_service, validation_service, fast_json, metrics
+from .single_flight import SingleFlight
 
 load_dotenv()
 
@@ -10,94 +14,415 @@ load_dotenv()
 FORMIO_SERVER_URL = os.getenv("FORMIO_SERVER_URL")
 FORMIO_API_KEY = os.getenv("FORMIO_API_KEY")
 
+# Connection pool settings for the shared Form.io client
+FORMIO_MAX_CONNECTIONS = int(os.getenv("FORMIO_MAX_CONNECTIONS", "100"))
+FORMIO_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("FORMIO_MAX_KEEPALIVE_CONNECTIONS", "20"))
+FORMIO_KEEPALIVE_EXPIRY = float(os.getenv("FORMIO_KEEPALIVE_EXPIRY", "30"))
+FORMIO_HTTP2 = os.getenv("FORMIO_HTTP2", "false").lower() in ("1", "true", "yes")
+FORMIO_TIMEOUT = float(os.getenv("FORMIO_TIMEOUT", "30"))
+FORMIO_CONNECT_TIMEOUT = float(os.getenv("FORMIO_CONNECT_TIMEOUT", "5"))
+
+# Submission paging: Form.io caps each page, so listings walk limit/skip pages
+FORMIO_PAGE_SIZE = int(os.getenv("FORMIO_PAGE_SIZE", "100"))
+FORMIO_PAGE_CONCURRENCY = int(os.getenv("FORMIO_PAGE_CONCURRENCY", "4"))
+# Upper bounds for callers that pick their own page size or concurrency
+FORMIO_MAX_PAGE_SIZE = int(os.getenv("FORMIO_MAX_PAGE_SIZE", "1000"))
+FORMIO_MAX_PAGE_CONCURRENCY = int(os.getenv("FORMIO_MAX_PAGE_CONCURRENCY", str(FORMIO_PAGE_CONCURRENCY)))
+
+# Relay Form.io's bytes on the /api/formio routes instead of parsing and
+# re-serializing them; only routes that change the data decode it. Form
+# definition reads are answered with the bytes kept in the form cache.
+FORMIO_PASSTHROUGH = os.getenv("FORMIO_PASSTHROUGH", "true").lower() in ("1", "true", "yes")
+# Bodies up to this size are relayed in one piece; streaming pays off only for large ones
+FORMIO_PASSTHROUGH_BUFFER = int(os.getenv("FORMIO_PASSTHROUGH_BUFFER", str(1024 * 1024)))
+# Headers a pass-through request forwards to Form.io and relays back
+PASSTHROUGH_REQUEST_HEADERS = ("accept-encoding", "if-none-match", "if-modified-since", "content-type")
+PASSTHROUGH_RESPONSE_HEADERS = (
+    "content-type", "content-encoding", "content-length", "content-range",
+    "etag", "last-modified", "cache-control", "vary",
+)
+
+# Form definition cache: entries younger than FORM_CACHE_TTL are served as
+# is; older ones are served stale for up to FORM_CACHE_STALE_TTL more while
+# a background request revalidates them with ETag / Last-Modified
+FORM_CACHE_SIZE = int(os.getenv("FORM_CACHE_SIZE", "512"))
+FORM_CACHE_TTL = float(os.getenv("FORM_CACHE_TTL", "60"))
+FORM_CACHE_STALE_TTL = float(os.getenv("FORM_CACHE_STALE_TTL", "3600"))
+
 # Headers for API requests
 headers = {
     "Content-Type": "application/json",
     "x-token": FORMIO_API_KEY
 }
 
-async def get_forms():
-    """Get all forms from the database"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FORMIO_SERVER_URL}/form", headers=headers)
+# Shared client, opened and closed by the application lifespan
+_client: Optional[httpx.AsyncClient] = None
+
+form_cache = LRUCache(max_entries=FORM_CACHE_SIZE, ttl=FORM_CACHE_TTL + FORM_CACHE_STALE_TTL)
+# With several workers the shared tier is the source of truth and form_cache
+# only keeps this process's parsed copies of it
+shared_form_cache = shared_cache("form", ttl=FORM_CACHE_TTL + FORM_CACHE_STALE_TTL, max_entries=FORM_CACHE_SIZE)
+# Bumped on every invalidation so a fetch that started before a write
+# does not put the old definition back into the cache
+_cache_epoch = 0
+_refreshing: Set[str] = set()
+# Concurrent misses for the same definition share one request to Form.io
+form_flights = SingleFlight("formio_read")
+_background_tasks: Set[asyncio.Task] = set()
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=FORMIO_SERVER_URL or "",
+        headers={key: value for key, value in headers.items() if value is not None},
+        http2=FORMIO_HTTP2 and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=FORMIO_MAX_CONNECTIONS,
+            max_keepalive_connections=FORMIO_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=FORMIO_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(FORMIO_TIMEOUT, connect=FORMIO_CONNECT_TIMEOUT),
+    )
+
+async def startup():
+    """Open the shared Form.io client"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+async def shutdown():
+    """Close the shared Form.io client and its pooled connections"""
+    global _client
+    for task in list(_background_tasks):
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily outside of the app lifespan"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+# Path segments that are part of the Form.io API rather than ids
+FORMIO_PATH_WORDS = {"form", "submission", "current", "export"}
+
+def _path_template(path: str) -> str:
+    """A Form.io path with ids replaced, for use as a low-cardinality metric label"""
+    return "/".join(
+        segment if not segment or segment in FORMIO_PATH_WORDS else "{id}"
+        for segment in path.split("?")[0].split("/")
+    )
+
+async def _request(
+    method: str,
+    path: str,
+    timeout: Optional[float] = None,
+    allow_not_modified: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """Send a request to Form.io over the shared client"""
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    operation = f"{method} {_path_template(path)}"
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with metrics.upstream_in_flight.track(upstream="formio"):
+            response = await get_client().request(method, path, **kwargs)
+        status = str(response.status_code)
+    finally:
+        metrics.upstream_seconds.observe(time.perf_counter() - started, upstream="formio", operation=operation, status=status)
+    metrics.payload_bytes.observe(len(response.content), kind="formio_response")
+    if not (allow_not_modified and response.status_code == 304):
         response.raise_for_status()
-        return response.json()
+    return response
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    """
+    The cached entry for key. With a shared cache, the local copy is used
+    while its stamp is current, so unchanged definitions stay the same
+    object (and keep their compiled validators). Point lookups in a WAL
+    database are cheaper than a hop to a thread.
+    """
+    entry = form_cache.get(key)
+    if shared_form_cache is None:
+        return entry
+    stamp, shared = shared_form_cache.lookup(key, entry["stamp"] if entry is not None else None)
+    if stamp is None:
+        form_cache.delete(key)
+        return None
+    if shared is None:
+        return entry
+    if entry is not None and shared.get("etag") and shared["etag"] == entry.get("etag"):
+        # Only revalidated elsewhere; keep the object we already have
+        shared["body"] = entry["body"]
+    shared["stamp"] = stamp
+    form_cache.set(key, shared)
+    return shared
+
+def _cache_set(key: str, entry: Dict[str, Any], since: float):
+    """Store an entry unless the key was invalidated (in any worker) after since"""
+    entry = {name: value for name, value in entry.items() if name != "stamp"}
+    if shared_form_cache is not None:
+        stamp = shared_form_cache.set(key, entry, since=since)
+        if stamp is None:
+            return
+        entry["stamp"] = stamp
+    form_cache.set(key, entry)
+
+async def open_stream(
+    method: str,
+    path: str,
+    params: Optional[Any] = None,
+    content: Optional[bytes] = None,
+    request_headers: Optional[Any] = None,
+) -> httpx.Response:
+    """
+    Send a request to Form.io and return the response with its body unread,
+    for relaying as it arrives. The caller's Accept-Encoding is forwarded
+    (identity if it sent none), so compressed bodies are relayed without
+    being decompressed. The caller must close the response.
+    """
+    client = get_client()
+    forwarded = {
+        name: value for name, value in (request_headers or {}).items()
+        if name.lower() in PASSTHROUGH_REQUEST_HEADERS
+    }
+    forwarded.setdefault("accept-encoding", "identity")
+    request = client.build_request(method, path, params=params, content=content, headers=forwarded)
+    operation = f"{method} {_path_template(path)}"
+    started = time.perf_counter()
+    status = "error"
+    try:
+        # Timed to the response headers; the body is relayed afterwards
+        with metrics.upstream_in_flight.track(upstream="formio"):
+            response = await client.send(request, stream=True)
+        status = str(response.status_code)
+    finally:
+        metrics.upstream_seconds.observe(time.perf_counter() - started, upstream="formio", operation=operation, status=status)
+    return response
+
+async def _fetch(key: str, path: str, entry: Optional[Dict[str, Any]], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Fetch path, revalidating the cached entry if there is one, store the
+    result and return its entry. Entries keep Form.io's bytes ("raw") next
+    to the parsed body, so pass-through reads can relay them as they came.
+    """
+    epoch = _cache_epoch
+    started = time.time()
+    request_headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+    response = await _request("GET", path, headers=request_headers, timeout=timeout, allow_not_modified=True)
+    if response.status_code == 304 and entry is not None:
+        entry = {**entry, "fetched": time.time()}
+    else:
+        entry = {
+            "body": fast_json.loads(response.content),
+            "raw": response.text,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "fetched": time.time(),
+        }
+    if epoch == _cache_epoch:
+        _cache_set(key, entry, since=started)
+    return entry
+
+async def _refresh(key: str, path: str, entry: Dict[str, Any]):
+    try:
+        await _fetch(key, path, entry)
+    except Exception:
+        # Keep serving the stale entry; the next read tries again
+        pass
+    finally:
+        _refreshing.discard(key)
+
+async def _cached_entry(key: str, path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Read-through cache for form definitions. Returned entries are shared
+    with the cache and must not be modified.
+    """
+    entry = _cache_get(key)
+    if entry is None:
+        metrics.cache_requests.inc(cache="form", result="miss")
+        # Keyed by epoch too, so a read after a write never joins a fetch started before it
+        entry, _ = await form_flights.do((key, _cache_epoch), lambda: _fetch(key, path, None, timeout))
+        return entry
+    stale = time.time() - entry["fetched"] > FORM_CACHE_TTL
+    metrics.cache_requests.inc(cache="form", result="stale" if stale else "hit")
+    if stale and key not in _refreshing:
+        # Serve the stale entry and revalidate in the background
+        _refreshing.add(key)
+        task = asyncio.create_task(_refresh(key, path, entry))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return entry
+
+async def _cached_get(key: str, path: str, timeout: Optional[float] = None):
+    """The cached body for path; shared with the cache and must not be modified"""
+    return (await _cached_entry(key, path, timeout))["body"]
 
-async def get_form(form_id: str):
+async def _cached_raw(key: str, path: str, timeout: Optional[float] = None) -> Tuple[bytes, Optional[str]]:
+    """The cached JSON bytes for path, as Form.io sent them, and their ETag"""
+    entry = await _cached_entry(key, path, timeout)
+    raw = entry.get("raw")
+    # Entries cached before raw bytes were kept
+    return (raw.encode("utf-8") if raw is not None else fast_json.dumps(entry["body"])), entry.get("etag")
+
+def invalidate_forms(form_id: Optional[str] = None):
+    """Drop the cached form list and, if given, one cached form definition"""
+    global _cache_epoch
+    _cache_epoch += 1
+    keys = ["forms"] if form_id is None else ["forms", f"form:{form_id}"]
+    for key in keys:
+        form_cache.delete(key)
+        if shared_form_cache is not None:
+            shared_form_cache.delete(key)
+
+async def get_forms(timeout: Optional[float] = None):
+    """Get all forms from the database"""
+    return await _cached_get("forms", "/form", timeout=timeout)
+
+async def get_form(form_id: str, timeout: Optional[float] = None):
     """Get a specific form by ID"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FORMIO_SERVER_URL}/form/{form_id}", headers=headers)
-        response.raise_for_status()
-        return response.json()
+    return await _cached_get(f"form:{form_id}", f"/form/{form_id}", timeout=timeout)
+
+async def get_forms_raw(timeout: Optional[float] = None) -> Tuple[bytes, Optional[str]]:
+    """The form list as JSON bytes with its ETag, from the form cache"""
+    return await _cached_raw("forms", "/form", timeout=timeout)
 
-async def create_form(form_data: Dict[str, Any]):
+async def get_form_raw(form_id: str, timeout: Optional[float] = None) -> Tuple[bytes, Optional[str]]:
+    """A form definition as JSON bytes with its ETag, from the form cache"""
+    return await _cached_raw(f"form:{form_id}", f"/form/{form_id}", timeout=timeout)
+
+async def create_form(form_data: Dict[str, Any], timeout: Optional[float] = None):
     """Create a new form"""
     # We no longer need formatting since OpenAI generates properly structured data
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{FORMIO_SERVER_URL}/form",
-            headers=headers,
-            json=form_data
-        )
-        response.raise_for_status()
-        return response.json()
+    response = await _request("POST", "/form", json=form_data, timeout=timeout)
+    invalidate_forms()
+    return response.json()
 
-async def update_form(form_id: str, form_data: Dict[str, Any]):
+async def update_form(form_id: str, form_data: Dict[str, Any], timeout: Optional[float] = None):
     """Update an existing form"""
     # We no longer need formatting here either
-    async with httpx.AsyncClient() as client:
-        response = await client.put(
-            f"{FORMIO_SERVER_URL}/form/{form_id}",
-            headers=headers,
-            json=form_data
-        )
-        response.raise_for_status()
-        return response.json()
+    try:
+        response = await _request("PUT", f"/form/{form_id}", json=form_data, timeout=timeout)
+    finally:
+        invalidate_forms(form_id)
+    return response.json()
 
-async def submit_form(form_id: str, submission_data: Dict[str, Any]):
+async def validate_submission(form_id: str, submission_data: Dict[str, Any], cached_only: bool = False):
+    """
+    Check a submission against the form's rules locally, raising
+    SubmissionValidationError, so bad data never costs an upstream round
+    trip. If the form cannot be loaded (or, with cached_only, is not
+    cached) Form.io is left to validate it.
+    """
+    if not validation_service.VALIDATE_SUBMISSIONS:
+        return
+    if cached_only:
+        entry = _cache_get(f"form:{form_id}")
+        if entry is None:
+            return
+        form = entry["body"]
+    else:
+        try:
+            form = await get_form(form_id)
+        except (httpx.HTTPError, ValueError):
+            return
+    validation_service.get_validator(form_id, form).validate(submission_data)
+
+async def submit_form(form_id: str, submission_data: Dict[str, Any], timeout: Optional[float] = None):
     """Submit a form with data"""
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{FORMIO_SERVER_URL}/form/{form_id}/submission",
-            headers=headers,
-            json=submission_data
-        )
-        response.raise_for_status()
-        return response.json()
+    await validate_submission(form_id, submission_data)
+    # Inline base64 photos go to the attachment store; Form.io keeps references
+    if attachment_service.has_inline_files(submission_data):
+        submission_data = await asyncio.to_thread(attachment_service.externalize, submission_data)
+    response = await _request("POST", f"/form/{form_id}/submission", json=submission_data, timeout=timeout)
+    return response.json()
 
-async def get_submissions():
+async def _externalize_page(page: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Replace inline photos in older submissions with attachment references"""
+    if attachment_service.has_inline_files(page):
+        return await asyncio.to_thread(attachment_service.externalize, page)
+    return page
+
+def _content_range_total(response: httpx.Response) -> Optional[int]:
+    """Total item count from a Form.io Content-Range header such as "0-99/1234" """
+    content_range = response.headers.get("content-range", "")
+    _, _, total = content_range.partition("/")
+    return int(total) if total.isdigit() else None
+
+async def iter_submissions(
+    form_id: Optional[str] = None,
+    page_size: int = FORMIO_PAGE_SIZE,
+    concurrency: int = 1,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield submissions one by one, walking Form.io's limit/skip pages. With
+    concurrency > 1 and a total from Content-Range, up to that many pages
+    are fetched at once; submissions are still yielded in order.
+    """
+    path = f"/form/{form_id}/submission" if form_id else "/submission"
+    # A stable sort keeps pages from overlapping while they are fetched
+    query = {"sort": "created", **(params or {}), "limit": page_size}
+
+    async def fetch_page(skip: int) -> List[Dict[str, Any]]:
+        response = await _request("GET", path, params={**query, "skip": skip}, timeout=timeout)
+        return await _externalize_page(fast_json.loads(response.content))
+
+    response = await _request("GET", path, params={**query, "skip": 0}, timeout=timeout)
+    page = await _externalize_page(fast_json.loads(response.content))
+    for submission in page:
+        yield submission
+    total = _content_range_total(response)
+
+    # Form.io may return fewer than page_size items per page (its own cap on
+    # limit), so every page advances by what it actually held and only the
+    # total, or an empty page when there is none, ends the walk
+    skip = len(page)
+    if concurrency > 1 and total is not None and page:
+        step = len(page)
+        while skip < total:
+            skips = range(skip, min(total, skip + step * concurrency), step)
+            pages = await asyncio.gather(*(fetch_page(page_skip) for page_skip in skips))
+            for page_skip, page in zip(skips, pages):
+                for submission in page:
+                    yield submission
+                skip = page_skip + len(page)
+                if len(page) < step:
+                    # Short of a full page: the pages after it started too far
+                    # on, so the next batch resumes right after this one
+                    break
+            if not page:
+                return
+        return
+
+    while page and (total is None or skip < total):
+        page = await fetch_page(skip)
+        for submission in page:
+            yield submission
+        skip += len(page)
+
+async def get_submissions(timeout: Optional[float] = None):
     """Get all form submissions"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FORMIO_SERVER_URL}/submission", headers=headers)
-        response.raise_for_status()
-        return response.json()
-
-async def generate_report():
-    """Generate a maintenance report based on form submissions"""
-    # Get all submissions
-    submissions = await get_submissions()
-    
-    # Filter submissions with issues (customize based on your form structure)
-    issues = []
-    for submission in submissions:
-        if submission.get("data", {}).get("hasIssues") == True:
-            issues.append({
-                "id": submission.get("_id"),
-                "formId": submission.get("form"),
-                "dateSubmitted": submission.get("created"),
-                "location": submission.get("data", {}).get("location", "Unknown"),
-                "issueType": submission.get("data", {}).get("issueType", "Unknown"),
-                "description": submission.get("data", {}).get("issueDescription", ""),
-                "photos": submission.get("data", {}).get("issuePhotos", []),
-                "priority": submission.get("data", {}).get("issuePriority", "Medium"),
-                "status": "Open"
-            })
-    
-    return {
-        "reportDate": "Generated on: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "totalIssues": len(issues),
-        "issues": issues
-    }
+    return [submission async for submission in iter_submissions(concurrency=FORMIO_PAGE_CONCURRENCY, timeout=timeout)]
 
 # Direct form.io API methods
 async def get_formio_forms():
@@ -116,26 +441,21 @@ async def update_formio_form(form_id: str, form_data: Dict[str, Any]):
     """Update a form in form.io"""
     return await update_form(form_id, form_data)
 
-async def delete_formio_form(form_id: str):
+async def delete_formio_form(form_id: str, timeout: Optional[float] = None):
     """Delete a form from form.io"""
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(
-            f"{FORMIO_SERVER_URL}/form/{form_id}",
-            headers=headers
-        )
-        response.raise_for_status()
-        return response.json()
+    try:
+        response = await _request("DELETE", f"/form/{form_id}", timeout=timeout)
+    finally:
+        invalidate_forms(form_id)
+    return response.json()
 
-async def get_formio_submissions(form_id: str):
+async def get_formio_submissions(form_id: str, timeout: Optional[float] = None):
     """Get all submissions for a specific form"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{FORMIO_SERVER_URL}/form/{form_id}/submission",
-            headers=headers
-        )
-        response.raise_for_status()
-        return response.json()
+    return [
+        submission async for submission in
+        iter_submissions(form_id, concurrency=FORMIO_PAGE_CONCURRENCY, timeout=timeout)
+    ]
 
 async def create_formio_submission(form_id: str, submission_data: Dict[str, Any]):
     """Create a new submission for a form"""
-    return await submit_form(form_id, submission_data) 
\ No newline at end of file
+    return await submit_form(form_id, submission_data)
@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import ipaddress
+from collections import deque
+from urllib.parse import urlsplit
+from typing import Dict, Any, Optional, List, Deque, Set
+import httpx
+from dotenv import load_dotenv
+from . import ai_service, upload_service, admission_service, metrics
+
+load_dotenv()
+
+# Job subsystem settings
+JOB_STORE = os.getenv("JOB_STORE", "memory")  # "memory" or "sqlite"
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "data/jobs.sqlite3")
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", "data/job-uploads")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+JOB_CALLBACK_RETRIES = int(os.getenv("JOB_CALLBACK_RETRIES", "3"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+# Callbacks may only go to these hosts when set (comma-separated); either
+# way they must resolve to public addresses unless private ones are allowed
+JOB_CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+JOB_CALLBACK_ALLOW_PRIVATE = os.getenv("JOB_CALLBACK_ALLOW_PRIVATE", "false").lower() in ("1", "true", "yes")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+class InvalidCallbackError(ValueError):
+    """Raised when a callback URL is malformed or points at a host callbacks may not reach"""
+
+class InMemoryJobStore:
+    """Job records kept in process memory; jobs are lost on restart"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    async def save(self, job: Dict[str, Any]):
+        self._jobs[job["id"]] = dict(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def claim(self, job_id: str, owner: Optional[str], worker: str) -> bool:
+        self._jobs[job_id]["worker"] = worker
+        return True
+
+    async def list_unfinished(self) -> List[Dict[str, Any]]:
+        return [dict(job) for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING)]
+
+    async def delete_finished_before(self, timestamp: float):
+        for job_id in [
+            job["id"] for job in self._jobs.values()
+            if job["status"] in (SUCCEEDED, FAILED) and job["updated"] < timestamp
+        ]:
+            del self._jobs[job_id]
+
+    async def close(self):
+        pass
+
+class SQLiteJobStore:
+    """Job records persisted in SQLite so queued jobs survive restarts"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, created REAL NOT NULL, "
+            "updated REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._lock = asyncio.Lock()
+
+    def _save(self, job: Dict[str, Any]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs (id, status, created, updated, data) VALUES (?, ?, ?, ?, ?)",
+            (job["id"], job["status"], job["created"], job["updated"], json.dumps(job)),
+        )
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _claim(self, job_id: str, owner: Optional[str], worker: str) -> bool:
+        cursor = self._conn.execute(
+            "UPDATE jobs SET data = json_set(data, '$.worker', ?) WHERE id = ? AND json_extract(data, '$.worker') IS ?",
+            (worker, job_id, owner),
+        )
+        return cursor.rowcount > 0
+
+    def _list_unfinished(self) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT data FROM jobs WHERE status IN (?, ?) ORDER BY created", (QUEUED, RUNNING)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _delete_finished_before(self, timestamp: float):
+        self._conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (SUCCEEDED, FAILED, timestamp)
+        )
+
+    async def save(self, job: Dict[str, Any]):
+        async with self._lock:
+            await asyncio.to_thread(self._save, job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, job_id)
+
+    async def claim(self, job_id: str, owner: Optional[str], worker: str) -> bool:
+        """Take a job over from its previous owner, unless another process got there first"""
+        async with self._lock:
+            return await asyncio.to_thread(self._claim, job_id, owner, worker)
+
+    async def list_unfinished(self) -> List[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._list_unfinished)
+
+    async def delete_finished_before(self, timestamp: float):
+        async with self._lock:
+            await asyncio.to_thread(self._delete_finished_before, timestamp)
+
+    async def close(self):
+        self._conn.close()
+
+def create_store():
+    if JOB_STORE == "sqlite":
+        return SQLiteJobStore(JOB_DB_PATH)
+    return InMemoryJobStore()
+
+class FairQueue:
+    """Per-tenant FIFO queues served round-robin so one tenant cannot starve the others"""
+
+    def __init__(self):
+        self._queues: Dict[str, Deque[str]] = {}
+        self._tenants: Deque[str] = deque()
+        self._ready = asyncio.Condition()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    async def put(self, tenant: str, job_id: str):
+        async with self._ready:
+            if tenant not in self._queues:
+                self._queues[tenant] = deque()
+                self._tenants.append(tenant)
+            self._queues[tenant].append(job_id)
+            self._size += 1
+            self._ready.notify()
+
+    async def get(self) -> str:
+        async with self._ready:
+            await self._ready.wait_for(lambda: self._size > 0)
+            tenant = self._tenants.popleft()
+            queue = self._queues[tenant]
+            job_id = queue.popleft()
+            if queue:
+                self._tenants.append(tenant)
+            else:
+                del self._queues[tenant]
+            self._size -= 1
+            return job_id
+
+def _process_started(pid: int) -> Optional[str]:
+    """Start time of a process, which tells a live worker from a later process reusing its pid"""
+    try:
+        with open(f"/proc/{pid}/stat") as handle:
+            return handle.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    """Whether the worker process that owns a job is still running on this host"""
+    if not worker or worker == _worker_id:
+        return False
+    pid, _, started = worker.partition(":")
+    if started:
+        return _process_started(int(pid)) == started
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+_store = None
+_queue: Optional[FairQueue] = None
+# Identifies this process as the owner of the jobs it queues
+_worker_id: Optional[str] = None
+_workers: List[asyncio.Task] = []
+_callback_client: Optional[httpx.AsyncClient] = None
+# Callback deliveries run apart from the workers, so a slow webhook does not hold a worker
+_callbacks: Set[asyncio.Task] = set()
+
+queued_jobs = metrics.Gauge("elyndra_jobs_queued", "Digitization jobs waiting for a worker")
+
+@metrics.collector
+async def _collect_metrics():
+    queued_jobs.set(len(_queue) if _queue is not None else 0)
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in job.items() if key not in ("input_path", "worker")}
+
+async def startup():
+    """
+    Open the job store, re-queue unfinished jobs and start the worker pool.
+    With several worker processes sharing a SQLite store, only jobs whose
+    owner has exited are taken over.
+    """
+    global _store, _queue, _callback_client, _worker_id
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    _worker_id = f"{os.getpid()}:{_process_started(os.getpid()) or ''}"
+    _store = create_store()
+    _queue = FairQueue()
+    _callback_client = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT)
+    for job in await _store.list_unfinished():
+        if _worker_alive(job.get("worker")) or not await _store.claim(job["id"], job.get("worker"), _worker_id):
+            continue
+        job.update(status=QUEUED, worker=_worker_id)
+        await _store.save(job)
+        await _queue.put(job["tenant"], job["id"])
+    for _ in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+
+async def shutdown():
+    """
+    Stop the workers; jobs still running are picked up again on the next
+    start. Callbacks still retrying are dropped.
+    """
+    global _store, _queue, _callback_client
+    for task in [*_workers, *_callbacks]:
+        task.cancel()
+    await asyncio.gather(*_workers, *_callbacks, return_exceptions=True)
+    _workers.clear()
+    _callbacks.clear()
+    if _callback_client is not None:
+        await _callback_client.aclose()
+        _callback_client = None
+    if _store is not None:
+        await _store.close()
+        _store = None
+    _queue = None
+
+async def submit_job(
+    upload: upload_service.Upload,
+    tenant: str = "default",
+    callback_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Move an ingested upload into the job spool and queue it for digitization"""
+    if len(_queue) >= JOB_MAX_QUEUED:
+        raise QueueFullError("Too many queued jobs, try again later")
+    if callback_url:
+        await check_callback_url(callback_url)
+    job_id = uuid.uuid4().hex
+    input_path = os.path.join(JOB_SPOOL_DIR, job_id)
+    await asyncio.to_thread(upload.save_to, input_path)
+    now = time.time()
+    job = {
+        "id": job_id,
+        "tenant": tenant,
+        "status": QUEUED,
+        "filename": upload.filename,
+        "content_type": upload.content_type,
+        "input_path": input_path,
+        "callback_url": callback_url,
+        "created": now,
+        "updated": now,
+        "result": None,
+        "cache": None,
+        "error": None,
+        "worker": _worker_id,
+    }
+    await _store.save(job)
+    await _queue.put(tenant, job_id)
+    return _public(job)
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Get the public view of a job, or None if it does not exist"""
+    job = await _store.get(job_id)
+    return _public(job) if job else None
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        job = await _store.get(job_id)
+        if job is None or job["status"] not in (QUEUED, RUNNING):
+            continue
+        await _run_job(job)
+        await _store.delete_finished_before(time.time() - JOB_RETENTION)
+
+async def _run_job(job: Dict[str, Any]):
+    job.update(status=RUNNING, updated=time.time())
+    await _store.save(job)
+    try:
+        # The spooled input stays until the job finishes, so a job cancelled
+        # by a shutdown can run again on the next start
+        upload = await asyncio.to_thread(
+            upload_service.from_path, job["input_path"], job["content_type"], job["filename"], owned=False
+        )
+        # Jobs queue behind interactive uploads
+        with upload:
+            async with admission_service.slot(admission_service.BATCH):
+                form_structure, cache_status = await ai_service.process_upload(upload)
+        job.update(status=SUCCEEDED, result=form_structure, cache=cache_status)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        job.update(status=FAILED, error=str(e))
+    job["updated"] = time.time()
+    await _store.save(job)
+    try:
+        os.remove(job["input_path"])
+    except OSError:
+        pass
+    if job.get("callback_url"):
+        task = asyncio.create_task(_send_callback(_public(job)))
+        _callbacks.add(task)
+        task.add_done_callback(_callbacks.discard)
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address)
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def check_callback_url(url: str):
+    """
+    Raise InvalidCallbackError unless url is an http(s) URL whose host is
+    allowed and resolves only to public addresses, so callbacks cannot be
+    aimed at the API's own network
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise InvalidCallbackError("callback_url must be an http or https URL")
+    host = parts.hostname.lower()
+    if JOB_CALLBACK_ALLOWED_HOSTS and host not in JOB_CALLBACK_ALLOWED_HOSTS:
+        raise InvalidCallbackError(f"Callbacks to {host} are not allowed")
+    if JOB_CALLBACK_ALLOW_PRIVATE:
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError) as e:
+        raise InvalidCallbackError(f"Cannot resolve callback host {host}: {e}")
+    if not all(_public_address(address[4][0]) for address in addresses):
+        raise InvalidCallbackError(f"Callbacks to {host} are not allowed: it resolves to a private address")
+
+async def _send_callback(job: Dict[str, Any]):
+    """POST the finished job to its callback URL, retrying with exponential backoff"""
+    for attempt in range(JOB_CALLBACK_RETRIES):
+        try:
+            # Checked again in case the name now resolves somewhere else
+            await check_callback_url(job["callback_url"])
+            response = await _callback_client.post(job["callback_url"], json=job)
+            response.raise_for_status()
+            return
+        except InvalidCallbackError:
+            return
+        except httpx.HTTPError:
+            await asyncio.sleep(2 ** attempt)
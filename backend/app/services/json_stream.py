@@ -0,0 +1,82 @@
+import json
+from typing import Any, Dict, List, Optional
+
+class ComponentStream:
+    """
+    Incremental parser for a model reply shaped like a Form.io form. Feed
+    it text as it arrives; every element of the top-level "components"
+    array is returned as soon as its closing brace has been seen. The whole
+    reply is kept so it can be parsed in full once the stream ends.
+    """
+
+    def __init__(self, array_key: str = "components"):
+        self.array_key = array_key
+        self._chunks: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string: List[str] = []
+        # Last string completed directly inside the top-level object, i.e. the latest key
+        self._last_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._element: Optional[List[str]] = None
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Consume the next piece of the reply and return the components it completed"""
+        self._chunks.append(text)
+        completed = []
+        element_start = 0 if self._element is not None else None
+        for index, char in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = "".join(self._string)
+                elif self._depth == 1:
+                    self._string.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._string = []
+            elif char in "{[":
+                if char == "[" and self._depth == 1 and self._last_key == self.array_key and self._array_depth is None:
+                    self._array_depth = 2
+                elif char == "{" and self._depth == self._array_depth and self._element is None:
+                    self._element = []
+                    element_start = index
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._element is not None and self._depth == self._array_depth:
+                    self._element.append(text[element_start:index + 1])
+                    completed.append(self._finish_element())
+                    element_start = None
+                elif char == "]" and self._depth == 1 and self._array_depth == 2:
+                    # The components array is closed; later arrays are not components
+                    self._array_depth = -1
+
+        if self._element is not None and element_start is not None:
+            self._element.append(text[element_start:])
+        return [component for component in completed if isinstance(component, dict)]
+
+    def _finish_element(self) -> Optional[Any]:
+        raw = "".join(self._element)
+        self._element = None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def result(self) -> Dict[str, Any]:
+        """Parse the complete reply"""
+        return json.loads(self.text)
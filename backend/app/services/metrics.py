@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import bisect
+import uuid
+import asyncio
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Instrumentation settings
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_TRACING = os.getenv("METRICS_TRACING", "false").lower() in ("1", "true", "yes")
+# With several worker processes each one leaves its samples in this
+# directory every METRICS_FLUSH_INTERVAL seconds and a scrape of any worker
+# adds them all up; unset, /metrics covers the process that answers
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Latency buckets in seconds, from cache hits up to slow model calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Size buckets in bytes, from small JSON bodies up to the upload limit
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+_tracer = None
+if METRICS_TRACING:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("elyndra")
+    except ImportError:
+        _tracer = None
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    """A named metric family with a fixed set of label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self, children: Optional[Dict[Tuple[str, ...], Any]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted((self._children if children is None else children).items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def merge(self, into: Dict[Tuple[str, ...], Any], children: Dict[Tuple[str, ...], Any], live: bool):
+        """Add another process's children to into; live is False once that process has exited"""
+        for key, child in children.items():
+            into[key] = into.get(key, 0) + child
+
+    def _render_child(self, key: Tuple[str, ...], child: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(child)}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._children[key] = self._children.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """The count so far in this process"""
+        return self._children.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    """
+    Across worker processes gauges are added up (things in flight in each
+    process), or with multiprocess_mode="max" the largest is taken (figures
+    every process reads from shared state). Exited processes do not count.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), multiprocess_mode: str = "sum"):
+        super().__init__(name, help, labels)
+        self.multiprocess_mode = multiprocess_mode
+
+    def merge(self, into: Dict[Tuple[str, ...], Any], children: Dict[Tuple[str, ...], Any], live: bool):
+        if not live:
+            return
+        for key, child in children.items():
+            if self.multiprocess_mode == "max":
+                into[key] = max(into.get(key, child), child)
+            else:
+                into[key] = into.get(key, 0) + child
+
+    def set(self, value: float, **labels):
+        self._children[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._children[key] = self._children.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in flight while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        child = self._children.get(key)
+        if child is None:
+            # Per-bucket counts (not cumulative) plus +Inf, then the sum
+            child = self._children[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        child[0][bisect.bisect_left(self.buckets, value)] += 1
+        child[1] += value
+
+    @contextmanager
+    def time(self, span: Optional[str] = None, **labels):
+        """Observe the duration of the block, optionally as a trace span too"""
+        started = time.perf_counter()
+        if _tracer is not None and span:
+            with _tracer.start_as_current_span(span, attributes={key: str(value) for key, value in labels.items()}):
+                try:
+                    yield
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+        else:
+            try:
+                yield
+            finally:
+                self.observe(time.perf_counter() - started, **labels)
+
+    def merge(self, into: Dict[Tuple[str, ...], Any], children: Dict[Tuple[str, ...], Any], live: bool):
+        for key, (counts, total) in children.items():
+            merged = into.get(key)
+            if merged is None:
+                into[key] = [list(counts), total]
+            else:
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+
+    def _render_child(self, key: Tuple[str, ...], child: Any) -> List[str]:
+        counts, total = child
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+registry: List[Metric] = []
+# Callbacks run before each scrape to refresh gauges that mirror other state
+collectors: List[Callable[[], Awaitable[None]]] = []
+
+def collector(function: Callable[[], Awaitable[None]]):
+    """Register an async function that updates gauges right before /metrics is rendered"""
+    collectors.append(function)
+    return function
+
+async def _refresh():
+    for refresh in collectors:
+        try:
+            await refresh()
+        except Exception:
+            # A broken collector must not take the whole scrape down
+            pass
+
+_snapshot_name: Tuple[int, str] = (0, "")
+
+def _own_snapshot() -> str:
+    """This process's snapshot file, named apart from an exited worker that had the same pid"""
+    global _snapshot_name
+    if _snapshot_name[0] != os.getpid():
+        _snapshot_name = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+    return _snapshot_name[1]
+
+def _snapshot() -> str:
+    # Serialized on the event loop, where the samples change
+    return json.dumps({metric.name: [[list(key), child] for key, child in metric._children.items()] for metric in registry})
+
+def _write_snapshot(snapshot: str):
+    """Leave this process's samples where the other workers' scrapes find them"""
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    path = os.path.join(METRICS_MULTIPROC_DIR, _own_snapshot())
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(snapshot)
+    os.replace(f"{path}.tmp", path)
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merged() -> Dict[str, Dict[Tuple[str, ...], Any]]:
+    """
+    Every worker's samples added up. Snapshots of exited workers are kept,
+    so counters and histograms never go backwards when a worker is
+    replaced; their gauges are left out.
+    """
+    merged: Dict[str, Dict[Tuple[str, ...], Any]] = {metric.name: {} for metric in registry}
+    by_name = {metric.name: metric for metric in registry}
+    own = _own_snapshot()
+    for name in os.listdir(METRICS_MULTIPROC_DIR):
+        pid = name.partition("-")[0]
+        if not name.endswith(".json") or not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(METRICS_MULTIPROC_DIR, name), "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        live = name == own or (int(pid) != os.getpid() and _alive(int(pid)))
+        for metric_name, children in snapshot.items():
+            metric = by_name.get(metric_name)
+            if metric is not None:
+                metric.merge(merged[metric_name], {tuple(key): child for key, child in children}, live)
+    return merged
+
+async def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    await _refresh()
+    lines: List[str] = []
+    if METRICS_MULTIPROC_DIR:
+        await asyncio.to_thread(_write_snapshot, _snapshot())
+        merged = await asyncio.to_thread(_merged)
+        for metric in registry:
+            lines.extend(metric.render(merged[metric.name]))
+    else:
+        for metric in registry:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+_flusher: Optional[asyncio.Task] = None
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await _refresh()
+            await asyncio.to_thread(_write_snapshot, _snapshot())
+        except OSError:
+            pass
+
+async def startup():
+    """Publish this worker's samples for multi-process scrapes"""
+    global _flusher
+    if METRICS_ENABLED and METRICS_MULTIPROC_DIR:
+        _flusher = asyncio.create_task(_flush_periodically())
+
+async def shutdown():
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+        # The last samples of this worker keep counting after it exits
+        try:
+            await _refresh()
+            await asyncio.to_thread(_write_snapshot, _snapshot())
+        except OSError:
+            pass
+
+# Metrics shared by several services
+stage_seconds = Histogram(
+    "elyndra_stage_seconds", "Time spent in each stage of handling a form", ("stage",)
+)
+upstream_seconds = Histogram(
+    "elyndra_upstream_request_seconds", "Duration of calls to Form.io and OpenAI", ("upstream", "operation", "status")
+)
+upstream_in_flight = Gauge(
+    "elyndra_upstream_requests_in_flight", "Calls to Form.io and OpenAI currently waiting for an answer", ("upstream",)
+)
+payload_bytes = Histogram(
+    "elyndra_payload_bytes", "Sizes of uploads, model images and upstream bodies", ("kind",), buckets=SIZE_BUCKETS
+)
+cache_requests = Counter(
+    "elyndra_cache_requests_total", "Cache lookups by cache and result", ("cache", "result")
+)
+
+http_seconds = Histogram(
+    "elyndra_http_request_seconds", "Duration of HTTP requests by route", ("method", "route", "status")
+)
+http_in_flight = Gauge("elyndra_http_requests_in_flight", "HTTP requests currently being handled")
+
+class MetricsMiddleware:
+    """
+    Time every HTTP request by its route template (not the raw path, to keep
+    label cardinality bounded) and count requests in flight
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec()
+            http_seconds.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=_route_template(scope),
+                status=status,
+            )
+
+def _route_template(scope) -> str:
+    """The matched route's path template, including any router prefix"""
+    # Newer FastAPI keeps included routers separate and puts the full path on the effective route
+    route = (scope.get("fastapi") or {}).get("effective_route_context") or scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
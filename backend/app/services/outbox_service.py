@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import sqlite3
+from typing import Dict, Any, Optional, List, Tuple
+from dotenv import load_dotenv
+from . import attachment_service, formio_service, submission_service, metrics
+
+load_dotenv()
+
+# Outbox settings. Off by default: with the outbox on, submit answers 202
+# with an outbox entry instead of 200 with the Form.io submission
+SUBMISSION_OUTBOX = os.getenv("SUBMISSION_OUTBOX", "false").lower() in ("1", "true", "yes")
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "data/outbox.sqlite3")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "1"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "300"))
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", str(24 * 3600)))
+# Entries taken for sending are hidden from other worker processes for this
+# long; if the sender dies they become due again afterwards
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "120"))
+
+QUEUED = "queued"
+SENT = "sent"
+FAILED = "failed"
+
+# Upstream answers that will not change on retry; anything else is retried
+PERMANENT_STATUS_CODES = {400, 401, 403, 404, 409, 413, 422}
+
+class InvalidSubmissionError(ValueError):
+    """Raised when a submission cannot be queued as it stands"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    form_id TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    payload_hash TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    submission_id TEXT,
+    error TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS outbox_key ON outbox (form_id, idempotency_key);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+"""
+
+COLUMNS = (
+    "id", "form_id", "idempotency_key", "payload_hash", "payload", "status",
+    "attempts", "next_attempt", "created", "updated", "submission_id", "error",
+)
+
+def _row_to_entry(row: Tuple) -> Dict[str, Any]:
+    entry = dict(zip(COLUMNS, row))
+    entry["payload"] = json.loads(entry["payload"])
+    return entry
+
+def public(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """The view of an outbox entry returned to clients"""
+    return {
+        "id": entry["id"],
+        "form": entry["form_id"],
+        "idempotencyKey": entry["idempotency_key"],
+        "status": entry["status"],
+        "attempts": entry["attempts"],
+        "created": entry["created"],
+        "submissionId": entry["submission_id"],
+        "error": entry["error"],
+        "data": entry["payload"].get("data"),
+    }
+
+class Outbox:
+    """
+    Write-ahead log of accepted submissions in SQLite. Every write is
+    committed with synchronous=FULL, so an acknowledged submission is on
+    disk; concurrent enqueues share one transaction and one fsync.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._lock = asyncio.Lock()
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+
+    def _insert_many(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert entries in one transaction; an existing key returns the stored entry instead"""
+        stored = []
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for entry in entries:
+                row = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM outbox WHERE form_id = ? AND idempotency_key = ?",
+                    (entry["form_id"], entry["idempotency_key"]),
+                ).fetchone()
+                if row is not None:
+                    stored.append(_row_to_entry(row))
+                    continue
+                self._conn.execute(
+                    f"INSERT INTO outbox ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    tuple(json.dumps(entry[column]) if column == "payload" else entry[column] for column in COLUMNS),
+                )
+                stored.append(entry)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return stored
+
+    async def insert(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Durably add an entry, group-committing with any other enqueues waiting on the lock"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((entry, future))
+        async with self._lock:
+            if not future.done():
+                batch, self._pending = self._pending, []
+                write = asyncio.ensure_future(asyncio.to_thread(self._insert_many, [item for item, _ in batch]))
+                # Settle every waiter from the write itself, even if this request goes away meanwhile
+                write.add_done_callback(lambda task: self._settle(batch, task))
+                await asyncio.wait([write])
+        return await future
+
+    @staticmethod
+    def _settle(batch: List[Tuple[Dict[str, Any], asyncio.Future]], write: asyncio.Future):
+        for index, (_, waiter) in enumerate(batch):
+            if waiter.done():
+                continue
+            if write.cancelled():
+                waiter.cancel()
+            elif write.exception() is not None:
+                waiter.set_exception(write.exception())
+            else:
+                waiter.set_result(write.result()[index])
+
+    def _due(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        # Claim the batch in the same statement so no other worker sends it too
+        rows = self._conn.execute(
+            f"UPDATE outbox SET next_attempt = ? WHERE id IN (SELECT id FROM outbox WHERE status = ? "
+            f"AND next_attempt <= ? ORDER BY created LIMIT ?) RETURNING {', '.join(COLUMNS)}",
+            (now + OUTBOX_LEASE, QUEUED, now, limit),
+        ).fetchall()
+        return sorted((_row_to_entry(row) for row in rows), key=lambda entry: entry["created"])
+
+    def _update_many(self, updates: List[Dict[str, Any]]):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "UPDATE outbox SET status = :status, attempts = :attempts, next_attempt = :next_attempt, "
+                "updated = :updated, submission_id = :submission_id, error = :error WHERE id = :id",
+                updates,
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        return _row_to_entry(row) if row else None
+
+    def _stats(self, now: float) -> Dict[str, Any]:
+        counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        oldest, next_attempt = self._conn.execute(
+            "SELECT MIN(created), MIN(next_attempt) FROM outbox WHERE status = ?", (QUEUED,)
+        ).fetchone()
+        return {
+            "depth": counts.get(QUEUED, 0),
+            "failed": counts.get(FAILED, 0),
+            "sent": counts.get(SENT, 0),
+            "lagSeconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "nextAttemptIn": round(max(0.0, next_attempt - now), 3) if next_attempt is not None else None,
+        }
+
+    def _delete_sent_before(self, timestamp: float):
+        self._conn.execute("DELETE FROM outbox WHERE status = ? AND updated < ?", (SENT, timestamp))
+
+    async def due(self, limit: int) -> List[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._due, time.time(), limit)
+
+    async def update_many(self, updates: List[Dict[str, Any]]):
+        async with self._lock:
+            await asyncio.to_thread(self._update_many, updates)
+
+    async def get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, entry_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        async with self._lock:
+            return await asyncio.to_thread(self._stats, time.time())
+
+    async def delete_sent_before(self, timestamp: float):
+        async with self._lock:
+            await asyncio.to_thread(self._delete_sent_before, timestamp)
+
+    def close(self):
+        self._conn.close()
+
+_outbox: Optional[Outbox] = None
+_flusher: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+# Process-lifetime counters reported next to the queue figures
+counters = {"flushed": 0, "retries": 0, "rejected": 0, "lastFlush": None}
+
+outbox_depth = metrics.Gauge("elyndra_outbox_depth", "Submissions waiting to be delivered to Form.io", multiprocess_mode="max")
+outbox_lag = metrics.Gauge("elyndra_outbox_lag_seconds", "Age of the oldest undelivered submission", multiprocess_mode="max")
+outbox_failed = metrics.Gauge("elyndra_outbox_failed", "Submissions Form.io rejected permanently", multiprocess_mode="max")
+
+@metrics.collector
+async def _collect_metrics():
+    if _outbox is None:
+        return
+    stats = await _outbox.stats()
+    outbox_depth.set(stats["depth"])
+    outbox_lag.set(stats["lagSeconds"])
+    outbox_failed.set(stats["failed"])
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox(OUTBOX_DB_PATH)
+    return _outbox
+
+async def startup():
+    """Open the outbox and start flushing whatever is still queued"""
+    global _flusher, _wakeup
+    get_outbox()
+    _wakeup = asyncio.Event()
+    _flusher = asyncio.create_task(_flush_periodically())
+
+async def shutdown():
+    """Stop the flusher; queued entries are sent after the next start"""
+    global _outbox, _flusher, _wakeup
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+    _wakeup = None
+    if _outbox is not None:
+        _outbox.close()
+        _outbox = None
+
+async def enqueue(form_id: str, submission: Dict[str, Any], idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Durably record a submission for Form.io and return its outbox entry once
+    it is on disk. A repeated idempotency key returns the existing entry.
+    """
+    if not isinstance(submission.get("data"), dict):
+        raise InvalidSubmissionError("Submission must include a data object")
+    # Reject bad data now rather than failing at flush time, without waiting on Form.io
+    await formio_service.validate_submission(form_id, submission, cached_only=True)
+    # Keep photos out of the log; the attachment store already deduplicates them
+    if attachment_service.has_inline_files(submission):
+        submission = await asyncio.to_thread(attachment_service.externalize, submission)
+    entry_id = uuid.uuid4().hex
+    digest = submission_service.payload_hash(submission)
+    now = time.time()
+    entry = await get_outbox().insert({
+        "id": entry_id,
+        "form_id": form_id,
+        # Entries without a client key still get one, so a resend after a crash is not duplicated
+        "idempotency_key": idempotency_key or f"outbox:{entry_id}",
+        "payload_hash": digest,
+        "payload": submission,
+        "status": QUEUED,
+        "attempts": 0,
+        "next_attempt": now,
+        "created": now,
+        "updated": now,
+        "submission_id": None,
+        "error": None,
+    })
+    if entry["payload_hash"] != digest:
+        raise submission_service.IdempotencyConflictError(
+            f"Idempotency key {idempotency_key} was used for a different submission"
+        )
+    if _wakeup is not None:
+        _wakeup.set()
+    return public(entry)
+
+async def get_entry(entry_id: str) -> Optional[Dict[str, Any]]:
+    entry = await get_outbox().get(entry_id)
+    return public(entry) if entry else None
+
+async def get_stats() -> Dict[str, Any]:
+    """Queue depth, age of the oldest unsent entry and flush counters"""
+    return {**await get_outbox().stats(), **counters}
+
+def _backoff(attempts: int) -> float:
+    delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** (attempts - 1))
+    # Jitter keeps many queued entries from retrying in lockstep
+    return delay * random.uniform(0.5, 1.0)
+
+async def flush(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """Send one batch of due entries to Form.io and record the outcomes; returns the batch size"""
+    outbox = get_outbox()
+    entries = await outbox.due(limit)
+    if not entries:
+        return 0
+    results = await submission_service.submit_batch(
+        {**entry["payload"], "formId": entry["form_id"], "idempotencyKey": entry["idempotency_key"]}
+        for entry in entries
+    )
+    now = time.time()
+    updates = []
+    for entry, result in zip(entries, results):
+        attempts = entry["attempts"] + 1
+        update = {
+            "id": entry["id"],
+            "attempts": attempts,
+            "updated": now,
+            "next_attempt": now,
+            "submission_id": None,
+            "error": None,
+        }
+        if result["status"] in (submission_service.CREATED, submission_service.DUPLICATE):
+            update.update(status=SENT, submission_id=result.get("id"))
+            counters["flushed"] += 1
+        elif result["statusCode"] in PERMANENT_STATUS_CODES:
+            update.update(status=FAILED, error=result.get("error"))
+            counters["rejected"] += 1
+        else:
+            update.update(status=QUEUED, error=result.get("error"), next_attempt=now + _backoff(attempts))
+            counters["retries"] += 1
+        updates.append(update)
+    await outbox.update_many(updates)
+    counters["lastFlush"] = now
+    return len(entries)
+
+async def _flush_periodically():
+    last_cleanup = 0.0
+    while True:
+        try:
+            # Keep going while full batches come back; otherwise wait for new work or retries
+            while await flush() == OUTBOX_BATCH_SIZE:
+                pass
+            if time.time() - last_cleanup > 3600:
+                await get_outbox().delete_sent_before(time.time() - OUTBOX_RETENTION)
+                last_cleanup = time.time()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # A broken batch stays queued and is retried on the next round
+            pass
+        try:
+            await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
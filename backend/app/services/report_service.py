@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
+from dotenv import load_dotenv
+from . import formio_service, attachment_service, worker_lock
+
+load_dotenv()
+
+# Local issue index settings
+REPORT_DB_PATH = os.getenv("REPORT_DB_PATH", "data/report.sqlite3")
+REPORT_SYNC_INTERVAL = float(os.getenv("REPORT_SYNC_INTERVAL", "30"))
+REPORT_SYNC_BATCH = 500
+# Reports wait at most this long for a due sync, then answer from the index
+REPORT_SYNC_WAIT = float(os.getenv("REPORT_SYNC_WAIT", "0.5"))
+REPORT_PAGE_SIZE = 100
+REPORT_MAX_PAGE_SIZE = 1000
+# Exports read the index in batches of this many issues, and wait at most
+# REPORT_EXPORT_SYNC_WAIT seconds for a due sync before streaming what the
+# index already holds (the sync carries on in the background)
+REPORT_EXPORT_BATCH = int(os.getenv("REPORT_EXPORT_BATCH", "500"))
+REPORT_EXPORT_SYNC_WAIT = float(os.getenv("REPORT_EXPORT_SYNC_WAIT", "0.5"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    id TEXT PRIMARY KEY,
+    form_id TEXT,
+    date_submitted TEXT,
+    modified TEXT,
+    location TEXT,
+    issue_type TEXT,
+    description TEXT,
+    photos TEXT,
+    priority TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS issues_location ON issues (location, date_submitted);
+CREATE INDEX IF NOT EXISTS issues_priority ON issues (priority, date_submitted);
+CREATE INDEX IF NOT EXISTS issues_location_priority ON issues (location, priority, date_submitted);
+CREATE INDEX IF NOT EXISTS issues_form ON issues (form_id, date_submitted);
+CREATE INDEX IF NOT EXISTS issues_date ON issues (date_submitted);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a SQLite database in WAL mode, creating its directory if needed"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def to_issue(submission: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Map a maintenance submission to a report issue, or None if it reports no issues"""
+    data = submission.get("data", {})
+    if data.get("hasIssues") != True:
+        return None
+    return {
+        "id": submission.get("_id"),
+        "formId": submission.get("form"),
+        "dateSubmitted": submission.get("created"),
+        "location": data.get("location", "Unknown"),
+        "issueType": data.get("issueType", "Unknown"),
+        "description": data.get("issueDescription", ""),
+        # Photos are referenced by attachment id and URL, never inlined
+        "photos": attachment_service.externalize(data.get("issuePhotos", [])),
+        "priority": data.get("issuePriority", "Medium"),
+        "status": "Open"
+    }
+
+ISSUE_COLUMNS = "id, form_id, date_submitted, location, issue_type, description, photos, priority, status"
+
+def _row_to_issue(row: Tuple) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "formId": row[1],
+        "dateSubmitted": row[2],
+        "location": row[3],
+        "issueType": row[4],
+        "description": row[5],
+        "photos": json.loads(row[6]),
+        "priority": row[7],
+        "status": row[8],
+    }
+
+def _filters(
+    location: Optional[str] = None,
+    priority: Optional[str] = None,
+    form_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> Tuple[str, List[Any]]:
+    """The WHERE clause and its arguments for the report filters"""
+    clauses, args = [], []
+    for column, value in (("location", location), ("priority", priority), ("form_id", form_id)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            args.append(value)
+    if date_from is not None:
+        clauses.append("date_submitted >= ?")
+        args.append(date_from)
+    if date_to is not None:
+        clauses.append("date_submitted <= ?")
+        args.append(date_to)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), args
+
+class IssueSnapshot:
+    """
+    The issues matching an export's filters, as of one moment: a read
+    transaction on a connection of its own, so the index keeps syncing
+    meanwhile and every pass over the snapshot sees the same rows. Issues
+    are fetched in batches, so memory does not grow with the report.
+    """
+
+    def __init__(self, path: str, where: str, args: List[Any], batch_size: int = REPORT_EXPORT_BATCH):
+        self.path = path
+        self.where = where
+        self.args = args
+        self.batch_size = batch_size
+        self.total = 0
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        self._conn = connect(self.path)
+        self._conn.execute("BEGIN")
+        self.total = self._conn.execute(f"SELECT COUNT(*) FROM issues {self.where}", self.args).fetchone()[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def batches(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        """The matching issues, newest first, a batch at a time"""
+        cursor = await asyncio.to_thread(
+            self._conn.execute,
+            f"SELECT {ISSUE_COLUMNS} FROM issues {self.where} ORDER BY date_submitted DESC, id",
+            self.args,
+        )
+        while True:
+            rows = await asyncio.to_thread(cursor.fetchmany, self.batch_size)
+            if not rows:
+                return
+            yield [_row_to_issue(row) for row in rows]
+
+    async def issues(self) -> AsyncIterator[Dict[str, Any]]:
+        async for batch in self.batches():
+            for issue in batch:
+                yield issue
+
+class IssueIndex:
+    """SQLite index of open issues, kept in sync incrementally from Form.io"""
+
+    def __init__(self, path: str = REPORT_DB_PATH):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        self._write_lock = threading.Lock()
+        # WAL lets readers run alongside the writer, one connection per thread
+        self._readers = threading.local()
+        self._reader_conns: List[sqlite3.Connection] = []
+        self._sync_lock = asyncio.Lock()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = connect(self.path)
+            self._reader_conns.append(conn)
+        return conn
+
+    def close(self):
+        for conn in self._reader_conns:
+            conn.close()
+        self._conn.close()
+
+    def apply(self, submissions: List[Dict[str, Any]], watermark: Optional[str] = None):
+        """Upsert issues and drop submissions that no longer report one, in one transaction"""
+        with self._write_lock, self._conn:
+            for submission in submissions:
+                issue = to_issue(submission)
+                if issue is None:
+                    self._conn.execute("DELETE FROM issues WHERE id = ?", (submission.get("_id"),))
+                    continue
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO issues (id, form_id, date_submitted, modified, location, "
+                    "issue_type, description, photos, priority, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        issue["id"], issue["formId"], issue["dateSubmitted"], submission.get("modified"),
+                        issue["location"], issue["issueType"], issue["description"],
+                        json.dumps(issue["photos"]), issue["priority"], issue["status"],
+                    ),
+                )
+            if watermark is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('modified', ?)", (watermark,)
+                )
+
+    def watermark(self) -> Optional[str]:
+        row = self._reader().execute("SELECT value FROM sync_state WHERE key = 'modified'").fetchone()
+        return row[0] if row else None
+
+    def synced_at(self) -> float:
+        """When any worker process last finished a sync"""
+        row = self._reader().execute("SELECT value FROM sync_state WHERE key = 'synced_at'").fetchone()
+        return float(row[0]) if row else 0.0
+
+    def _mark_synced(self):
+        with self._write_lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('synced_at', ?)", (str(time.time()),)
+            )
+
+    async def sync(self, force: bool = False) -> int:
+        """
+        Pull submissions modified since the last sync and apply them. Returns
+        the number of submissions applied. Deletions in Form.io are not seen
+        by the modified feed; a full rebuild (drop the database) picks them up.
+        """
+        async with self._sync_lock:
+            if not force and time.time() - await asyncio.to_thread(self.synced_at) < REPORT_SYNC_INTERVAL:
+                return 0
+            watermark = await asyncio.to_thread(self.watermark)
+            params = {"sort": "modified"}
+            if watermark:
+                # Inclusive, so submissions sharing the watermark timestamp are
+                # not missed; re-applying the last one is harmless
+                params["modified__gte"] = watermark
+            applied = 0
+            batch: List[Dict[str, Any]] = []
+            async for submission in formio_service.iter_submissions(params=params):
+                batch.append(submission)
+                watermark = max(watermark or "", submission.get("modified") or "")
+                if len(batch) >= REPORT_SYNC_BATCH:
+                    await asyncio.to_thread(self.apply, batch, watermark or None)
+                    applied += len(batch)
+                    batch = []
+            if batch:
+                await asyncio.to_thread(self.apply, batch, watermark or None)
+                applied += len(batch)
+            await asyncio.to_thread(self._mark_synced)
+            return applied
+
+    def query(
+        self,
+        location: Optional[str] = None,
+        priority: Optional[str] = None,
+        form_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = REPORT_PAGE_SIZE,
+        offset: int = 0,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """Return the total number of matching issues and one page of them, newest first"""
+        where, args = _filters(location, priority, form_id, date_from, date_to)
+        conn = self._reader()
+        total = conn.execute(f"SELECT COUNT(*) FROM issues {where}", args).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {ISSUE_COLUMNS} FROM issues {where} ORDER BY date_submitted DESC, id LIMIT ? OFFSET ?",
+            [*args, limit, offset],
+        ).fetchall()
+        return total, [_row_to_issue(row) for row in rows]
+
+    def summary(
+        self,
+        location: Optional[str] = None,
+        priority: Optional[str] = None,
+        form_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> Dict[str, int]:
+        """Count the high priority and the open issues among all matching issues, not just one page"""
+        where, args = _filters(location, priority, form_id, date_from, date_to)
+        high, open_ = self._reader().execute(
+            f"SELECT COALESCE(SUM(priority = 'High'), 0), COALESCE(SUM(status = 'Open'), 0) FROM issues {where}",
+            args,
+        ).fetchone()
+        return {"highPriorityIssues": high, "openIssues": open_}
+
+_index: Optional[IssueIndex] = None
+_sync_task: Optional[asyncio.Task] = None
+_catch_up_task: Optional[asyncio.Task] = None
+
+def get_index() -> IssueIndex:
+    global _index
+    if _index is None:
+        _index = IssueIndex()
+    return _index
+
+async def _sync_periodically():
+    while True:
+        try:
+            # One worker process keeps the shared index in sync; the others
+            # check every interval and take over if it goes away
+            if worker_lock.try_acquire("report-sync"):
+                await get_index().sync(force=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Form.io may be briefly unavailable; the next round catches up
+            pass
+        await asyncio.sleep(REPORT_SYNC_INTERVAL)
+
+async def startup():
+    """Open the issue index and keep it in sync in the background"""
+    global _sync_task
+    get_index()
+    if formio_service.FORMIO_SERVER_URL:
+        _sync_task = asyncio.create_task(_sync_periodically())
+
+async def shutdown():
+    global _index, _sync_task, _catch_up_task
+    for task in (_sync_task, _catch_up_task):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    _sync_task = _catch_up_task = None
+    worker_lock.release("report-sync")
+    if _index is not None:
+        _index.close()
+        _index = None
+
+async def generate_report(
+    location: Optional[str] = None,
+    priority: Optional[str] = None,
+    form_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = REPORT_PAGE_SIZE,
+    offset: int = 0,
+):
+    """Generate a maintenance report from the local issue index"""
+    index = get_index()
+    await _catch_up(REPORT_SYNC_WAIT)
+    filters = (location, priority, form_id, date_from, date_to)
+    total, issues = await asyncio.to_thread(index.query, *filters, min(limit, REPORT_MAX_PAGE_SIZE), offset)
+    summary = await asyncio.to_thread(index.summary, *filters)
+    return {
+        "reportDate": "Generated on: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "totalIssues": total,
+        **summary,
+        "issues": issues,
+        "limit": limit,
+        "offset": offset,
+    }
+
+async def _catch_up(timeout: float):
+    """
+    Run a sync if one is due, waiting for it at most timeout seconds. Only
+    the worker holding the sync lock runs it, and a failed sync (Form.io
+    down) leaves the index as it was, so callers always go on to answer
+    from what the index holds.
+    """
+    global _catch_up_task
+    if not worker_lock.try_acquire("report-sync"):
+        # Another worker process keeps the shared index in sync
+        return
+    if _catch_up_task is None or _catch_up_task.done():
+        _catch_up_task = asyncio.ensure_future(get_index().sync())
+        # It may finish in the background; nobody waits for its outcome
+        _catch_up_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    await asyncio.wait([_catch_up_task], timeout=timeout)
+
+@asynccontextmanager
+async def export_snapshot(
+    location: Optional[str] = None,
+    priority: Optional[str] = None,
+    form_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> AsyncIterator[IssueSnapshot]:
+    """A snapshot of the issues matching the filters, for streaming an export of any size"""
+    await _catch_up(REPORT_EXPORT_SYNC_WAIT)
+    snapshot = IssueSnapshot(get_index().path, *_filters(location, priority, form_id, date_from, date_to))
+    await asyncio.to_thread(snapshot.open)
+    try:
+        yield snapshot
+    finally:
+        await asyncio.to_thread(snapshot.close)
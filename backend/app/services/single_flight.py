@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple, TypeVar
+from . import metrics
+
+T = TypeVar("T")
+
+flight_calls = metrics.Counter(
+    "elyndra_single_flight_calls_total",
+    "Calls that ran upstream work (led) or shared an identical call already in flight (joined)",
+    ("flight", "role"),
+)
+flight_in_flight = metrics.Gauge("elyndra_single_flight_in_flight", "Distinct calls currently in flight", ("flight",))
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller
+    runs it and the others wait for its result (or its exception). Results
+    are shared between callers, who must not modify them. If the first
+    caller is cancelled, the waiters try again and one of them runs it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        flights.append(self)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Run function once for all concurrent callers with key; returns the result and whether it was shared"""
+        while True:
+            joined, result = await self.join(key)
+            if joined:
+                return result, True
+            if key not in self._calls:
+                break
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        flight_calls.inc(flight=self.name, role="led")
+        try:
+            result = await function()
+            future.set_result(result)
+            return result, False
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise the error; nobody else needs to retrieve it
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._calls[key]
+
+    async def join(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Wait for a call already in flight under key and return (True, its
+        result). Returns (False, None) if there is none or it was cancelled.
+        """
+        pending = self._calls.get(key)
+        if pending is None:
+            return False, None
+        await asyncio.wait([pending])
+        if pending.cancelled():
+            return False, None
+        flight_calls.inc(flight=self.name, role="joined")
+        return True, pending.result()
+
+flights: List[SingleFlight] = []
+
+@metrics.collector
+async def _collect_metrics():
+    for flight in flights:
+        flight_in_flight.set(len(flight), flight=flight.name)
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+from typing import Dict, Any, Optional, List, AsyncIterator, Iterable, Union
+import httpx
+from dotenv import load_dotenv
+from . import formio_service, validation_service
+
+load_dotenv()
+
+# Batch ingestion settings
+SUBMISSION_DB_PATH = os.getenv("SUBMISSION_DB_PATH", "data/submissions.sqlite3")
+SUBMISSION_BATCH_CONCURRENCY = int(os.getenv("SUBMISSION_BATCH_CONCURRENCY", "8"))
+SUBMISSION_BATCH_MAX_ITEMS = int(os.getenv("SUBMISSION_BATCH_MAX_ITEMS", "1000"))
+IDEMPOTENCY_RETENTION = float(os.getenv("IDEMPOTENCY_RETENTION", str(7 * 24 * 3600)))
+# A key reserved by a worker that has not answered for this long (it died
+# mid-request) may be taken over by another worker
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "120"))
+# How often a request waits on a key another worker process is sending
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+
+CREATED = "created"
+DUPLICATE = "duplicate"
+CONFLICT = "conflict"
+INVALID = "invalid"
+FAILED = "failed"
+
+# Item fields that address the submission rather than being part of it
+ITEM_FORM_ID_FIELDS = ("formId", "form_id")
+ITEM_KEY_FIELDS = ("idempotencyKey", "idempotency_key")
+
+class BatchTooLargeError(ValueError):
+    """Raised when a batch holds more items than SUBMISSION_BATCH_MAX_ITEMS"""
+
+class IdempotencyConflictError(ValueError):
+    """Raised when an idempotency key is reused with a different submission"""
+
+class InvalidLine:
+    """Stands in for an NDJSON line that could not be decoded"""
+
+    def __init__(self, error: str):
+        self.error = error
+
+def payload_hash(submission: Dict[str, Any]) -> str:
+    """Stable fingerprint of a submission, used to spot reused idempotency keys"""
+    encoded = json.dumps(submission, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+class IdempotencyStore:
+    """
+    Results of accepted submissions by (form id, idempotency key), kept in
+    SQLite, and the keys currently being sent, so that worker processes
+    sharing the database send each key to Form.io once
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            "form_id TEXT NOT NULL, key TEXT NOT NULL, payload_hash TEXT NOT NULL, "
+            "created REAL NOT NULL, result TEXT NOT NULL, PRIMARY KEY (form_id, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idempotency_created ON idempotency (created)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_pending ("
+            "form_id TEXT NOT NULL, key TEXT NOT NULL, payload_hash TEXT NOT NULL, "
+            "reserved REAL NOT NULL, PRIMARY KEY (form_id, key))"
+        )
+        self._lock = asyncio.Lock()
+
+    def _get(self, form_id: str, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT payload_hash, result FROM idempotency WHERE form_id = ? AND key = ?", (form_id, key)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"payload_hash": row[0], "result": json.loads(row[1])}
+
+    def _reserve(self, form_id: str, key: str, digest: str, lease: float) -> Optional[Dict[str, Any]]:
+        """
+        The saved result if there is one, else reserve the key for sending.
+        Returns None once reserved, or {"pending": payload hash} while another
+        worker holds an unexpired reservation.
+        """
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            saved = self._get(form_id, key)
+            if saved is None:
+                # Taken over from a reservation whose worker stopped answering
+                self._conn.execute(
+                    "DELETE FROM idempotency_pending WHERE form_id = ? AND key = ? AND reserved < ?",
+                    (form_id, key, now - lease),
+                )
+                reserved = self._conn.execute(
+                    "INSERT INTO idempotency_pending (form_id, key, payload_hash, reserved) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT DO NOTHING",
+                    (form_id, key, digest, now),
+                ).rowcount
+                if not reserved:
+                    row = self._conn.execute(
+                        "SELECT payload_hash FROM idempotency_pending WHERE form_id = ? AND key = ?", (form_id, key)
+                    ).fetchone()
+                    saved = {"pending": row[0]}
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return saved
+
+    def _complete(self, form_id: str, key: str, digest: str, result: Dict[str, Any]):
+        """Save the result of a reserved key and release the reservation"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency (form_id, key, payload_hash, created, result) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (form_id, key, digest, time.time(), json.dumps(result)),
+            )
+            self._conn.execute("DELETE FROM idempotency_pending WHERE form_id = ? AND key = ?", (form_id, key))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _release(self, form_id: str, key: str):
+        self._conn.execute("DELETE FROM idempotency_pending WHERE form_id = ? AND key = ?", (form_id, key))
+
+    def _delete_before(self, timestamp: float):
+        self._conn.execute("DELETE FROM idempotency WHERE created < ?", (timestamp,))
+        self._conn.execute("DELETE FROM idempotency_pending WHERE reserved < ?", (timestamp,))
+
+    async def get(self, form_id: str, key: str) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, form_id, key)
+
+    async def reserve(self, form_id: str, key: str, digest: str, lease: float = IDEMPOTENCY_LEASE) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._reserve, form_id, key, digest, lease)
+
+    async def complete(self, form_id: str, key: str, digest: str, result: Dict[str, Any]):
+        async with self._lock:
+            await asyncio.to_thread(self._complete, form_id, key, digest, result)
+
+    async def release(self, form_id: str, key: str):
+        async with self._lock:
+            await asyncio.to_thread(self._release, form_id, key)
+
+    async def delete_before(self, timestamp: float):
+        async with self._lock:
+            await asyncio.to_thread(self._delete_before, timestamp)
+
+    async def close(self):
+        self._conn.close()
+
+_store: Optional[IdempotencyStore] = None
+# Keyed submissions currently being sent, so concurrent retries share one request
+_in_flight: Dict[tuple, asyncio.Future] = {}
+
+def get_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        _store = IdempotencyStore(SUBMISSION_DB_PATH)
+    return _store
+
+async def startup():
+    await get_store().delete_before(time.time() - IDEMPOTENCY_RETENTION)
+
+async def shutdown():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+async def submit(form_id: str, submission: Dict[str, Any], idempotency_key: Optional[str] = None):
+    """
+    Submit to Form.io once per idempotency key. Returns the submission and
+    whether it was created now (False when an earlier result was replayed).
+    """
+    if not idempotency_key:
+        return await formio_service.submit_form(form_id, submission), True
+
+    digest = payload_hash(submission)
+    flight_key = (form_id, idempotency_key)
+    pending = _in_flight.get(flight_key)
+    if pending is not None:
+        await asyncio.wait([pending])
+        if pending.cancelled():
+            # The first request was abandoned before Form.io answered; try again
+            return await submit(form_id, submission, idempotency_key)
+        previous_digest, result, _ = pending.result()
+        if previous_digest != digest:
+            raise IdempotencyConflictError(f"Idempotency key {idempotency_key} was used for a different submission")
+        return result, False
+
+    # Registered before the first await, so concurrent requests for the key wait on this one
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[flight_key] = future
+    try:
+        previous_digest, result, created = await _submit_once(form_id, submission, idempotency_key, digest)
+        future.set_result((previous_digest, result, created))
+    except Exception as e:
+        future.set_exception(e)
+        # Waiters re-raise the error; nobody else needs to retrieve it
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _in_flight.pop(flight_key, None)
+    if previous_digest != digest:
+        raise IdempotencyConflictError(f"Idempotency key {idempotency_key} was used for a different submission")
+    return result, created
+
+async def _submit_once(form_id: str, submission: Dict[str, Any], idempotency_key: str, digest: str):
+    """
+    Send a keyed submission unless its key already has a result, waiting
+    while another worker process sends it. Returns (payload hash the key
+    was used with, result, whether it was sent now).
+    """
+    store = get_store()
+    while True:
+        saved = await store.reserve(form_id, idempotency_key, digest)
+        if saved is None:
+            break
+        if "pending" not in saved:
+            return saved["payload_hash"], saved["result"], False
+        if saved["pending"] != digest:
+            raise IdempotencyConflictError(f"Idempotency key {idempotency_key} was used for a different submission")
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    try:
+        result = await formio_service.submit_form(form_id, submission)
+    except BaseException:
+        await asyncio.shield(store.release(form_id, idempotency_key))
+        raise
+    await asyncio.shield(store.complete(form_id, idempotency_key, digest, result))
+    return digest, result, True
+
+def _split_item(item: Any):
+    """Pull the form id and idempotency key out of a batch item"""
+    if isinstance(item, InvalidLine):
+        raise ValueError(item.error)
+    if not isinstance(item, dict):
+        raise ValueError("Each item must be a JSON object")
+    submission = dict(item)
+    form_id = next((submission.pop(field) for field in ITEM_FORM_ID_FIELDS if field in submission), None)
+    key = next((submission.pop(field) for field in ITEM_KEY_FIELDS if field in submission), None)
+    if not form_id or not isinstance(form_id, str):
+        raise ValueError("Missing formId")
+    if key is not None and not isinstance(key, str):
+        raise ValueError("idempotencyKey must be a string")
+    if not isinstance(submission.get("data"), dict):
+        raise ValueError("Missing data object")
+    return form_id, key, submission
+
+async def _submit_item(index: int, item: Any) -> Dict[str, Any]:
+    """Submit one batch item and describe the outcome without raising"""
+    result: Dict[str, Any] = {"index": index}
+    try:
+        form_id, key, submission = _split_item(item)
+    except ValueError as e:
+        return {**result, "status": INVALID, "statusCode": 400, "error": str(e)}
+
+    result.update({"formId": form_id, "idempotencyKey": key})
+    try:
+        created, is_new = await submit(form_id, submission, key)
+    except IdempotencyConflictError as e:
+        return {**result, "status": CONFLICT, "statusCode": 409, "error": str(e)}
+    except validation_service.SubmissionValidationError as e:
+        return {**result, "status": INVALID, "statusCode": 400, "error": str(e), "details": e.details}
+    except httpx.HTTPStatusError as e:
+        return {**result, "status": FAILED, "statusCode": e.response.status_code, "error": str(e)}
+    except Exception as e:
+        return {**result, "status": FAILED, "statusCode": 502, "error": str(e)}
+    return {
+        **result,
+        "status": CREATED if is_new else DUPLICATE,
+        "statusCode": 201 if is_new else 200,
+        "id": created.get("_id") if isinstance(created, dict) else None,
+    }
+
+async def submit_batch(
+    items: Union[Iterable[Any], AsyncIterator[Any]],
+    concurrency: int = SUBMISSION_BATCH_CONCURRENCY,
+    max_items: int = SUBMISSION_BATCH_MAX_ITEMS,
+) -> List[Dict[str, Any]]:
+    """
+    Push a batch of submissions (possibly for different forms) to Form.io,
+    at most `concurrency` at a time. Items are started as they arrive, so an
+    async iterator (such as a streamed NDJSON body) overlaps reading with
+    sending. Returns one result per item, in input order.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+    tasks: List[asyncio.Task] = []
+
+    async def run(index: int, item: Any) -> Dict[str, Any]:
+        try:
+            return await _submit_item(index, item)
+        finally:
+            slots.release()
+
+    async def start(item: Any):
+        if len(tasks) >= max_items:
+            raise BatchTooLargeError(f"A batch may hold at most {max_items} submissions")
+        # Waiting for a slot here also stops reading the body while Form.io is busy
+        await slots.acquire()
+        tasks.append(asyncio.create_task(run(len(tasks), item)))
+
+    try:
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await start(item)
+        else:
+            for item in items:
+                await start(item)
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {"total": len(results), "counts": counts, "results": results}
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Decode newline-delimited JSON from a byte stream, one value per non-empty line"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _decode_line(line, line_number)
+    if buffer.strip():
+        yield _decode_line(buffer, line_number + 1)
+
+def _decode_line(line: bytes, line_number: int) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        # A bad line becomes an invalid item instead of failing the whole batch
+        return InvalidLine(f"Line {line_number}: {e}")
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from typing import Dict, Any, Optional, List, Tuple
+from dotenv import load_dotenv
+from . import document_service, metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Template library settings. With matching on, an upload whose pages look
+# like a form digitized before (same page count, every page at least
+# TEMPLATE_THRESHOLD similar) gets that form's schema without a model call.
+# Off by default: the threshold has to be validated on a deployment's own
+# scans first, using the similarity logged for every match.
+TEMPLATE_MATCHING = os.getenv("TEMPLATE_MATCHING", "false").lower() in ("1", "true", "yes")
+TEMPLATE_THRESHOLD = float(os.getenv("TEMPLATE_THRESHOLD", "0.86"))
+# Whether new model digitizations are added to the library
+TEMPLATE_LEARN = os.getenv("TEMPLATE_LEARN", "true").lower() in ("1", "true", "yes")
+TEMPLATE_DB_PATH = os.getenv("TEMPLATE_DB_PATH", "data/templates.sqlite3")
+# The least recently used templates are dropped beyond this many
+TEMPLATE_MAX = int(os.getenv("TEMPLATE_MAX", "5000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    version TEXT NOT NULL,
+    pages INTEGER NOT NULL,
+    fingerprints TEXT NOT NULL,
+    form TEXT NOT NULL,
+    title TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS templates_last_used ON templates (last_used);
+"""
+
+Fingerprints = Tuple[int, ...]
+
+def _encode(fingerprints: Fingerprints) -> str:
+    return ",".join(format(value, "x") for value in fingerprints)
+
+def _decode(text: str) -> Fingerprints:
+    return tuple(int(value, 16) for value in text.split(","))
+
+class TemplateLibrary:
+    """
+    Digitized forms in SQLite with the layout fingerprints of their pages,
+    and an in-memory index of the fingerprints grouped by model version and
+    page count. Lookups scan the matching group with XOR and popcount,
+    which takes microseconds per template. Templates added by other worker
+    processes are picked up on the next lookup.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = asyncio.Lock()
+        self._index: Dict[Tuple[str, int], Dict[int, Fingerprints]] = {}
+        self._last_id = 0
+
+    def __len__(self) -> int:
+        return sum(len(group) for group in self._index.values())
+
+    def _refresh(self):
+        """Index the templates added since the last refresh, by any process"""
+        rows = self._conn.execute(
+            "SELECT id, version, pages, fingerprints FROM templates WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        for template_id, version, pages, fingerprints in rows:
+            self._index.setdefault((version, pages), {})[template_id] = _decode(fingerprints)
+            self._last_id = template_id
+
+    def _nearest(self, fingerprints: Fingerprints, version: str) -> Tuple[Optional[int], float]:
+        """
+        The closest template of the same version and page count. Documents
+        are as similar as their least similar pair of pages.
+        """
+        best_id, best_distance = None, document_service.FINGERPRINT_BITS + 1
+        for template_id, stored in self._index.get((version, len(fingerprints)), {}).items():
+            distance = 0
+            for x, y in zip(fingerprints, stored):
+                distance = max(distance, (x ^ y).bit_count())
+                if distance >= best_distance:
+                    break
+            else:
+                best_id, best_distance = template_id, distance
+        return best_id, 1 - best_distance / document_service.FINGERPRINT_BITS
+
+    def _match(self, fingerprints: Fingerprints, version: str, threshold: float) -> Optional[Tuple[int, float, Dict[str, Any]]]:
+        self._refresh()
+        while True:
+            template_id, score = self._nearest(fingerprints, version)
+            if template_id is None or score < threshold:
+                return None
+            row = self._conn.execute(
+                "UPDATE templates SET hits = hits + 1, last_used = ? WHERE id = ? RETURNING form",
+                (time.time(), template_id),
+            ).fetchone()
+            if row is not None:
+                return template_id, score, json.loads(row[0])
+            # Deleted by another worker process since it was indexed
+            self._forget(template_id)
+
+    def _add(self, fingerprints: Fingerprints, version: str, form: Dict[str, Any]) -> int:
+        now = time.time()
+        template_id = self._conn.execute(
+            "INSERT INTO templates (version, pages, fingerprints, form, title, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id",
+            (version, len(fingerprints), _encode(fingerprints), json.dumps(form), form.get("title"), now, now),
+        ).fetchone()[0]
+        self._conn.execute(
+            "DELETE FROM templates WHERE id IN (SELECT id FROM templates ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (TEMPLATE_MAX,),
+        )
+        self._refresh()
+        return template_id
+
+    def _forget(self, template_id: int):
+        for group in self._index.values():
+            group.pop(template_id, None)
+
+    def _list(self) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT id, version, pages, title, created, last_used, hits FROM templates ORDER BY last_used DESC"
+        ).fetchall()
+        return [
+            {"id": row[0], "version": row[1], "pages": row[2], "title": row[3], "created": row[4], "lastUsed": row[5], "hits": row[6]}
+            for row in rows
+        ]
+
+    def _delete(self, template_id: int) -> bool:
+        self._forget(template_id)
+        return self._conn.execute("DELETE FROM templates WHERE id = ?", (template_id,)).rowcount > 0
+
+    async def match(self, fingerprints: Fingerprints, version: str, threshold: float) -> Optional[Tuple[int, float, Dict[str, Any]]]:
+        """The closest template at least threshold similar, as (id, similarity, form), or None"""
+        async with self._lock:
+            return await asyncio.to_thread(self._match, fingerprints, version, threshold)
+
+    async def add(self, fingerprints: Fingerprints, version: str, form: Dict[str, Any]) -> int:
+        async with self._lock:
+            return await asyncio.to_thread(self._add, fingerprints, version, form)
+
+    async def list(self) -> List[Dict[str, Any]]:
+        async with self._lock:
+            return await asyncio.to_thread(self._list)
+
+    async def delete(self, template_id: int) -> bool:
+        async with self._lock:
+            return await asyncio.to_thread(self._delete, template_id)
+
+    def close(self):
+        self._conn.close()
+
+_library: Optional[TemplateLibrary] = None
+
+template_count = metrics.Gauge("elyndra_templates", "Form templates indexed for matching", multiprocess_mode="max")
+template_similarity = metrics.Histogram(
+    "elyndra_template_similarity",
+    "Similarity of matched uploads to their template",
+    buckets=(0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1.0),
+)
+
+@metrics.collector
+async def _collect_metrics():
+    if _library is not None:
+        template_count.set(len(_library))
+
+def get_library() -> TemplateLibrary:
+    global _library
+    if _library is None:
+        _library = TemplateLibrary(TEMPLATE_DB_PATH)
+    return _library
+
+async def startup():
+    """Open the template library and index the stored templates"""
+    if TEMPLATE_MATCHING:
+        library = get_library()
+        async with library._lock:
+            await asyncio.to_thread(library._refresh)
+
+async def shutdown():
+    global _library
+    if _library is not None:
+        _library.close()
+        _library = None
+
+async def match(fingerprints: List[int], version: str) -> Optional[Dict[str, Any]]:
+    """
+    The form schema of the closest stored template if the pages are at
+    least TEMPLATE_THRESHOLD similar to it, else None
+    """
+    found = await get_library().match(tuple(fingerprints), version, TEMPLATE_THRESHOLD)
+    if found is None:
+        metrics.cache_requests.inc(cache="template", result="miss")
+        return None
+    template_id, score, form = found
+    metrics.cache_requests.inc(cache="template", result="hit")
+    template_similarity.observe(score)
+    logger.info(
+        "Template %s (%r) matched a %d-page upload with similarity %.3f (threshold %.3f)",
+        template_id, form.get("title"), len(fingerprints), score, TEMPLATE_THRESHOLD,
+    )
+    return form
+
+async def learn(fingerprints: List[int], version: str, form: Dict[str, Any]):
+    """Add a digitized form to the library, when learning is on"""
+    if TEMPLATE_LEARN:
+        await get_library().add(tuple(fingerprints), version, form)
+
+async def list_templates() -> List[Dict[str, Any]]:
+    return await get_library().list()
+
+async def delete_template(template_id: int) -> bool:
+    return await get_library().delete(template_id)
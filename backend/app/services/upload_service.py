@@ -0,0 +1,214 @@
+import os
+import base64
+import shutil
+import hashlib
+import tempfile
+from typing import BinaryIO, Iterator, Optional, Union
+from dotenv import load_dotenv
+from fastapi import UploadFile
+from starlette.responses import PlainTextResponse
+from . import metrics
+
+load_dotenv()
+
+# Upload handling settings
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Allowance for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Base64 turns every 3 input bytes into 4 output characters, so chunks that
+# are a multiple of 3 bytes encode independently and concatenate cleanly
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds UPLOAD_MAX_BYTES"""
+
+class Upload:
+    """
+    An uploaded file kept in memory while small and spooled to a named
+    temporary file past the threshold, hashed as it is written
+    """
+
+    def __init__(self, content_type: str, filename: Optional[str] = None, spool_threshold: int = UPLOAD_SPOOL_THRESHOLD):
+        self.content_type = content_type
+        self.filename = filename
+        self.size = 0
+        self._spool_threshold = spool_threshold
+        self._hash = hashlib.sha256()
+        self._chunks: Optional[list] = []
+        self._content: Optional[bytes] = None
+        self._path: Optional[str] = None
+        self._file: Optional[BinaryIO] = None
+        self._owned = True
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._hash.update(chunk)
+        if self._chunks is not None and self.size > self._spool_threshold:
+            self._file = tempfile.NamedTemporaryFile(prefix="upload-", dir=UPLOAD_SPOOL_DIR, delete=False)
+            self._path = self._file.name
+            for buffered in self._chunks:
+                self._file.write(buffered)
+            self._chunks = None
+        if self._chunks is not None:
+            self._chunks.append(chunk)
+        else:
+            self._file.write(chunk)
+
+    def finish(self):
+        """Close the spool file or join the in-memory chunks; call once all chunks are written"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._chunks is not None:
+            self._content = b"".join(self._chunks)
+            self._chunks = None
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """The content as bytes while in memory, otherwise the path of the spool file"""
+        if self._content is not None:
+            return self._content
+        return self._path
+
+    def chunks(self, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        return iter_chunks(self.source, chunk_size)
+
+    def read(self) -> bytes:
+        """Load the whole content; only for callers that really need it in memory"""
+        return b"".join(self.chunks())
+
+    def save_to(self, path: str):
+        """Move or copy the content to path, which then belongs to the caller"""
+        if self._content is not None:
+            with open(path, "wb") as f:
+                f.write(self._content)
+        else:
+            shutil.move(self._path, path)
+            # Still readable from its new place, but close() must leave it there
+            self._path = path
+            self._owned = False
+
+    def close(self):
+        self.finish()
+        self._content = None
+        if self._path is not None and self._owned:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+async def ingest(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> Upload:
+    """Read an UploadFile in chunks, enforcing the size limit as it goes"""
+    upload = Upload(file.content_type, file.filename)
+    try:
+        with metrics.stage_seconds.time(stage="upload_read"):
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if upload.size + len(chunk) > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+                upload.write(chunk)
+            upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    metrics.payload_bytes.observe(upload.size, kind="upload")
+    return upload
+
+def from_bytes(content: bytes, content_type: str, filename: Optional[str] = None) -> Upload:
+    """Wrap content that is already in memory"""
+    upload = Upload(content_type, filename, spool_threshold=len(content))
+    upload.write(content)
+    upload.finish()
+    return upload
+
+def from_path(path: str, content_type: str, filename: Optional[str] = None, owned: bool = True) -> Upload:
+    """
+    Wrap a file on disk, hashing it in chunks. By default the upload takes
+    ownership and the file is removed on close; with owned=False it is left alone.
+    """
+    upload = Upload(content_type, filename, spool_threshold=-1)
+    upload._owned = owned
+    for chunk in iter_chunks(path):
+        upload.size += len(chunk)
+        upload._hash.update(chunk)
+    upload._chunks = None
+    upload._path = path
+    return upload
+
+def iter_chunks(source: Union[bytes, str], chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield chunks of in-memory bytes or of the file at a path"""
+    if isinstance(source, bytes):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+        return
+    with open(source, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def data_url(source: Union[bytes, str], mime_type: str) -> str:
+    """Build a base64 data URL chunk by chunk, without a full intermediate copy of the encoding"""
+    with metrics.stage_seconds.time(stage="base64_encode"):
+        parts = [f"data:{mime_type};base64,"]
+        for chunk in iter_chunks(source, BASE64_CHUNK_SIZE):
+            parts.append(base64.b64encode(chunk).decode("ascii"))
+        return "".join(parts)
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject multipart request bodies larger than UPLOAD_MAX_BYTES before they
+    are parsed: up front from Content-Length, or by ending the stream once a
+    chunked body passes the limit
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes + MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+        content_length = headers.get(b"content-length")
+        if content_length is not None and not content_length.strip().isdigit():
+            response = PlainTextResponse("Invalid Content-Length", status_code=400)
+            return await response(scope, receive, send)
+        if content_length is not None and int(content_length) > self.max_bytes:
+            response = PlainTextResponse("Upload too large", status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    return {"type": "http.disconnect"}
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,201 @@
+import os
+import re
+from typing import Dict, Any, Optional, List, Tuple
+from dotenv import load_dotenv
+from .cache import LRUCache
+
+load_dotenv()
+
+# Local validation settings
+VALIDATE_SUBMISSIONS = os.getenv("VALIDATE_SUBMISSIONS", "true").lower() in ("1", "true", "yes")
+VALIDATOR_CACHE_SIZE = int(os.getenv("VALIDATOR_CACHE_SIZE", "256"))
+
+# Components whose children store their data under the component's own key.
+# Their contents are left to Form.io rather than guessed at here.
+NESTED_DATA_TYPES = {"container", "datagrid", "editgrid", "datamap", "tree", "form", "dynamicWizard"}
+
+class SubmissionValidationError(ValueError):
+    """Raised when a submission fails the form's validation rules; details mirror Form.io's"""
+
+    def __init__(self, details: List[Dict[str, Any]]):
+        super().__init__("; ".join(detail["message"] for detail in details))
+        self.details = details
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": "ValidationError", "details": self.details}
+
+def _length(value: Any) -> Optional[int]:
+    """A minLength/maxLength setting as an int, or None when it is blank or not a number"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+def _compile_pattern(pattern: Any) -> Optional[re.Pattern]:
+    if not pattern or not isinstance(pattern, str):
+        return None
+    try:
+        # Form.io anchors patterns at both ends
+        return re.compile(f"(?:{pattern})\\Z")
+    except re.error:
+        # A JavaScript-only construct; let Form.io judge it
+        return None
+
+def _as_text(value: Any) -> str:
+    """Stringify a value the way Form.io compares conditional values"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return ""
+    return str(value)
+
+def _compile_condition(component: Dict[str, Any]) -> Optional[Tuple[str, str, bool]]:
+    conditional = component.get("conditional") or {}
+    when = conditional.get("when")
+    show = conditional.get("show")
+    if not when or show in ("", None):
+        return None
+    return when, _as_text(conditional.get("eq")), show is True or show == "true"
+
+def _is_empty(value: Any, component_type: str) -> bool:
+    if value is None or value == "" or value == [] or value == {}:
+        return True
+    if component_type == "checkbox":
+        return value is False
+    if component_type == "selectboxes" and isinstance(value, dict):
+        return not any(value.values())
+    return False
+
+class Field:
+    """One input component reduced to the checks that apply to it"""
+
+    __slots__ = ("key", "label", "type", "multiple", "required", "pattern", "pattern_source", "min_length", "max_length", "conditions")
+
+    def __init__(self, component: Dict[str, Any], conditions: Tuple[Tuple[str, str, bool], ...]):
+        validate = component.get("validate") or {}
+        self.key = component["key"]
+        self.label = component.get("label") or self.key
+        self.type = component.get("type", "")
+        self.multiple = bool(component.get("multiple"))
+        self.required = bool(validate.get("required"))
+        self.pattern = _compile_pattern(validate.get("pattern"))
+        self.pattern_source = validate.get("pattern")
+        self.min_length = _length(validate.get("minLength"))
+        self.max_length = _length(validate.get("maxLength"))
+        self.conditions = conditions
+
+    @property
+    def has_checks(self) -> bool:
+        return bool(self.required or self.pattern or self.min_length is not None or self.max_length is not None)
+
+    def error(self, message: str, rule: str) -> Dict[str, Any]:
+        return {
+            "message": message,
+            "type": rule,
+            "path": [self.key],
+            "context": {"key": self.key, "label": self.label},
+        }
+
+    def check(self, value: Any, errors: List[Dict[str, Any]]):
+        if _is_empty(value, self.type):
+            if self.required:
+                errors.append(self.error(f"{self.label} is required", "required"))
+            return
+        values = value if self.multiple and isinstance(value, list) else (value,)
+        for item in values:
+            if not isinstance(item, str):
+                continue
+            if self.min_length is not None and len(item) < self.min_length:
+                errors.append(self.error(f"{self.label} must have at least {self.min_length} characters", "minLength"))
+            if self.max_length is not None and len(item) > self.max_length:
+                errors.append(self.error(f"{self.label} must have no more than {self.max_length} characters", "maxLength"))
+            if self.pattern is not None and item and not self.pattern.match(item):
+                errors.append(self.error(f"{self.label} does not match the pattern {self.pattern_source}", "pattern"))
+
+class FormValidator:
+    """
+    Validation rules of a form, flattened once from its component tree. Only
+    fields with a check are kept, each with the chain of conditionals (its
+    own and those of the layout components around it) that can hide it.
+    """
+
+    def __init__(self, form: Dict[str, Any]):
+        self.fields: List[Field] = []
+        self._collect(form.get("components") or [], ())
+        # Fields grouped by their conditional chain, so each chain is evaluated once per submission
+        groups: Dict[Tuple, List[Field]] = {}
+        for field in self.fields:
+            groups.setdefault(field.conditions, []).append(field)
+        self._groups = list(groups.items())
+
+    def _collect(self, components: List[Dict[str, Any]], conditions: Tuple[Tuple[str, str, bool], ...]):
+        for component in components:
+            if not isinstance(component, dict):
+                continue
+            condition = _compile_condition(component)
+            chain = conditions + (condition,) if condition else conditions
+            component_type = component.get("type")
+            if component_type in NESTED_DATA_TYPES or component.get("tree"):
+                continue
+            if component.get("input") and component.get("key") and component_type != "button":
+                field = Field(component, () if component.get("validateWhenHidden") else chain)
+                if field.has_checks:
+                    self.fields.append(field)
+            self._collect(component.get("components") or [], chain)
+            for column in component.get("columns") or []:
+                self._collect(column.get("components") or [], chain)
+            for row in component.get("rows") or []:
+                for cell in row if isinstance(row, list) else []:
+                    self._collect(cell.get("components") or [], chain)
+
+    @staticmethod
+    def _visible(conditions: Tuple[Tuple[str, str, bool], ...], data: Dict[str, Any]) -> bool:
+        for when, eq, show in conditions:
+            value = data.get(when)
+            if isinstance(value, dict):
+                # Select boxes: the condition matches when that option is ticked
+                matches = bool(value.get(eq))
+            elif isinstance(value, list):
+                matches = eq in (_as_text(item) for item in value)
+            else:
+                matches = _as_text(value) == eq
+            if matches != show:
+                return False
+        return True
+
+    def errors(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        errors: List[Dict[str, Any]] = []
+        for conditions, fields in self._groups:
+            # Hidden fields are not validated, matching validateWhenHidden=false
+            if conditions and not self._visible(conditions, data):
+                continue
+            for field in fields:
+                field.check(data.get(field.key), errors)
+        return errors
+
+    def validate(self, submission: Dict[str, Any]):
+        """Raise SubmissionValidationError if the submission's data breaks any rule"""
+        data = submission.get("data")
+        if not isinstance(data, dict):
+            raise SubmissionValidationError([{"message": "Submission must include a data object", "type": "data", "path": []}])
+        errors = self.errors(data)
+        if errors:
+            raise SubmissionValidationError(errors)
+
+# Compiled validators by form id, with the definition they were built from
+_validators = LRUCache(VALIDATOR_CACHE_SIZE)
+
+def get_validator(form_id: str, form: Dict[str, Any]) -> FormValidator:
+    """
+    The compiled validator for a form. Definitions come from the shared form
+    cache, so an unchanged definition is the same object and is compiled once.
+    """
+    cached = _validators.get(form_id)
+    if cached is not None and cached[0] is form:
+        return cached[1]
+    validator = FormValidator(form)
+    _validators.set(form_id, (form, validator))
+    return validator
@@ -0,0 +1,45 @@
+import os
+from typing import Dict
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows runs a single process
+    fcntl = None
+
+load_dotenv()
+
+# Lock files for duties that one worker process performs on behalf of all
+WORKER_LOCK_DIR = os.getenv("WORKER_LOCK_DIR", "data/locks")
+# Worker processes serving the app (serve.py sets it); concurrency limits
+# are configured for the whole server and each process takes its share
+WORKER_PROCESSES = max(1, int(os.getenv("WORKER_PROCESSES", "1")))
+
+_held: Dict[str, int] = {}
+
+def try_acquire(name: str) -> bool:
+    """
+    Take the named lock unless another process holds it. It is kept until
+    released or the process exits, when the operating system frees it and
+    the next worker to ask takes over.
+    """
+    if fcntl is None or name in _held:
+        return True
+    os.makedirs(WORKER_LOCK_DIR, exist_ok=True)
+    fd = os.open(os.path.join(WORKER_LOCK_DIR, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _held[name] = fd
+    return True
+
+def release(name: str):
+    fd = _held.pop(name, None)
+    if fd is not None:
+        os.close(fd)
+
+def share(limit: int) -> int:
+    """This process's share of a limit configured for the whole server, at least 1"""
+    return max(1, limit // WORKER_PROCESSES)
@@ -0,0 +1,73 @@
+"""
+Show that light endpoints stay responsive while digitizations are running.
+
+Starts the OpenAI stub with a slow completion, fires several uploads at
+/api/ai/process-form and measures the latency of GET / in the meantime.
+`--mode blocking` swaps in a synchronous OpenAI call to reproduce the old
+behaviour.
+
+    python -m benchmarks.ai_event_loop --uploads 4 --model-latency 3
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from .formio_client import percentile
+from .stub_formio import serve_in_thread
+from . import stub_openai
+
+async def main(args):
+    from app.main import app
+    from app.services import ai_service
+
+    if args.mode == "blocking":
+        import openai
+        sync_client = openai.OpenAI(api_key="stub", base_url=ai_service.OPENAI_BASE_URL)
+
+        async def blocking_chat_completion(**kwargs):
+            return sync_client.chat.completions.create(**kwargs)
+
+        ai_service._create_completion = blocking_chat_completion
+
+    server = serve_in_thread(app, port=args.app_port)
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            async def upload():
+                files = {"file": ("form.png", b"\x89PNG stub", "image/png")}
+                response = await client.post("/api/ai/process-form", files=files)
+                response.raise_for_status()
+
+            uploads = [asyncio.create_task(upload()) for _ in range(args.uploads)]
+            await asyncio.sleep(0.2)
+            latencies = []
+            while not all(task.done() for task in uploads):
+                started = time.perf_counter()
+                await client.get("/")
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.05)
+            await asyncio.gather(*uploads)
+
+        print(f"mode={args.mode} uploads={args.uploads} light requests={len(latencies)}")
+        print(f"GET / p50 {percentile(latencies, 50) * 1000:.1f} ms   p99 {percentile(latencies, 99) * 1000:.1f} ms")
+    finally:
+        server.should_exit = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["async", "blocking"], default="async")
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--model-latency", type=float, default=3.0)
+    parser.add_argument("--app-port", type=int, default=8767)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    stub = serve_in_thread(stub_openai.create_app(latency=args.model_latency), port=args.openai_port)
+    try:
+        asyncio.run(main(args))
+    finally:
+        stub.should_exit = True
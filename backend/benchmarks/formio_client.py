@@ -0,0 +1,71 @@
+"""
+Compare a fresh httpx.AsyncClient per call (the old formio_service behaviour)
+against the shared pooled client, using the local Form.io stub.
+
+    python -m benchmarks.formio_client --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+
+from .stub_formio import create_app, serve_in_thread
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def drive(call: Callable[[], Awaitable[None]], total: int, concurrency: int):
+    latencies: List[float] = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return total / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+async def main(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    os.environ["FORMIO_SERVER_URL"] = base_url
+    from app.services import formio_service
+    formio_service.FORMIO_SERVER_URL = base_url
+
+    form = await formio_service.create_form({"title": "Bench", "components": []})
+    form_id = form["_id"]
+
+    async def per_call_client():
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"{base_url}/form/{form_id}")
+            response.raise_for_status()
+            response.json()
+
+    async def shared_client():
+        await formio_service.get_form(form_id)
+
+    for name, call in (("per-call client", per_call_client), ("shared client", shared_client)):
+        rps, p50, p99 = await drive(call, args.requests, args.concurrency)
+        print(f"{name:16} {rps:8.0f} req/s   p50 {p50 * 1000:6.1f} ms   p99 {p99 * 1000:6.1f} ms")
+
+    await formio_service.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = serve_in_thread(create_app(), port=args.port)
+    try:
+        asyncio.run(main(args))
+    finally:
+        server.should_exit = True
@@ -0,0 +1,99 @@
+"""
+CPU cost per request of the /api/formio routes: relaying Form.io's bytes
+(pass-through) against decoding and re-encoding them, with orjson and with
+the standard library json module. The Form.io stub runs in its own process
+so only the API's CPU time is counted. Each path is measured cold (the form
+cache cleared before every request, so every read goes to Form.io and is
+parsed for the cache) and warm (answered from the cache).
+
+    python -m benchmarks.formio_proxy --forms 50 --components 200 --requests 300
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+
+import httpx
+import uvicorn
+
+from .stub_formio import create_app
+from .stub_openai import synthetic_form
+
+def run_stub(port: int, latency: float):
+    uvicorn.run(create_app(latency=latency), host="127.0.0.1", port=port, log_level="warning")
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int, concurrency: int, reset):
+    remaining = iter(range(requests))
+    size = 0
+
+    async def worker():
+        nonlocal size
+        for _ in remaining:
+            reset()
+            response = await client.get(path)
+            response.raise_for_status()
+            size = len(response.content)
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return cpu / requests * 1000, requests / wall, size
+
+async def main(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    os.environ["FORMIO_SERVER_URL"] = base_url
+    from app.main import app
+    from app.services import formio_service, fast_json
+    formio_service.FORMIO_SERVER_URL = base_url
+    await formio_service.startup()
+
+    async with httpx.AsyncClient(base_url=base_url) as stub:
+        form_id = None
+        for index in range(args.forms):
+            form = synthetic_form(args.components)
+            form["title"] = f"Bench {index}"
+            form_id = (await stub.post("/form", json=form)).json()["_id"]
+
+    orjson = fast_json.orjson
+    modes = [("pass-through", True, orjson), ("decoded, json", False, None)]
+    if orjson is not None:
+        modes.insert(1, ("decoded, orjson", False, orjson))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+        for label, path in (("form list", "/api/formio/forms"), ("one form", f"/api/formio/forms/{form_id}")):
+            for name, passthrough, backend in modes:
+                formio_service.FORMIO_PASSTHROUGH = passthrough
+                fast_json.orjson = backend
+                for cache, reset in (("cold", formio_service.form_cache.clear), ("warm", lambda: None)):
+                    # Warm up connections and code paths
+                    await measure(client, path, 5, 1, reset)
+                    cpu_ms, rps, size = await measure(client, path, args.requests, args.concurrency, reset)
+                    print(f"{label:10} {name:16} {cache:4} {cpu_ms:8.2f} ms CPU/request {rps:8.0f} req/s   {size / 1024:8.0f} KiB")
+    fast_json.orjson = orjson
+    await formio_service.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--forms", type=int, default=50)
+    parser.add_argument("--components", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub Form.io latency in seconds")
+    parser.add_argument("--port", type=int, default=8796)
+    args = parser.parse_args()
+    stub = multiprocessing.Process(target=run_stub, args=(args.port, args.latency), daemon=True)
+    stub.start()
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{args.port}/form", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise SystemExit("The Form.io stub did not start")
+                time.sleep(0.1)
+        asyncio.run(main(args))
+    finally:
+        stub.terminate()
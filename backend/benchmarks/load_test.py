@@ -0,0 +1,285 @@
+"""
+Mixed-workload load test of the whole API against local Form.io and OpenAI
+stubs. The app runs in its own uvicorn process so its memory can be
+measured; results are printed and saved as JSON for comparison across
+commits.
+
+    python -m benchmarks.load_test --duration 30 --concurrency 32 \\
+        --mix upload=1,render=10,submit=5,report=2
+    python -m benchmarks.load_test --compare data/benchmarks/<earlier>.json
+
+Stub behaviour is configurable with --formio-latency, --model-latency,
+--model-components (size of the model's reply) and --submission-bytes
+(size of each seeded submission).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from . import stub_formio, stub_openai
+from .formio_client import percentile
+
+WORKLOADS = ("upload", "render", "submit", "report")
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload {name!r}; choose from {', '.join(WORKLOADS)}")
+        weights[name] = int(weight or 1)
+    return weights
+
+def make_image(seed: int) -> bytes:
+    """A small scanned-form-like PNG; distinct seeds give distinct uploads (cache misses)"""
+    from PIL import Image, ImageDraw
+    image = Image.new("L", (1200, 1600), 255)
+    draw = ImageDraw.Draw(image)
+    for line in range(20):
+        y = 100 + line * 70
+        draw.text((80, y), f"Field {line} {seed}", fill=0)
+        draw.line((400, y + 12, 1100, y + 12), fill=0)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def process_rss(pid: int) -> Dict[str, float]:
+    """Resident memory of a process and its children (the document pool) in MiB, from /proc"""
+    def status(process_id: int) -> Dict[str, int]:
+        values = {}
+        try:
+            with open(f"/proc/{process_id}/status") as handle:
+                for line in handle:
+                    key, _, value = line.partition(":")
+                    if key in ("VmRSS", "VmHWM"):
+                        values[key] = int(value.split()[0])
+        except OSError:
+            pass
+        return values
+
+    def children(process_id: int) -> List[int]:
+        try:
+            with open(f"/proc/{process_id}/task/{process_id}/children") as handle:
+                return [int(child) for child in handle.read().split()]
+        except OSError:
+            return []
+
+    main = status(pid)
+    total = main.get("VmRSS", 0) + sum(status(child).get("VmRSS", 0) for child in children(pid))
+    return {"app_rss_mib": main.get("VmRSS", 0) / 1024, "app_hwm_mib": main.get("VmHWM", 0) / 1024, "total_rss_mib": total / 1024}
+
+def start_app(args, data_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "FORMIO_SERVER_URL": f"http://127.0.0.1:{args.formio_port}",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": "stub",
+        "REPORT_DB_PATH": os.path.join(data_dir, "report.sqlite3"),
+        "SUBMISSION_DB_PATH": os.path.join(data_dir, "submissions.sqlite3"),
+        "OUTBOX_DB_PATH": os.path.join(data_dir, "outbox.sqlite3"),
+        "JOB_DB_PATH": os.path.join(data_dir, "jobs.sqlite3"),
+        "ATTACHMENT_DIR": os.path.join(data_dir, "attachments"),
+        # The synthetic scans share one layout; every upload should reach the model stub
+        "TEMPLATE_MATCHING": "false",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.app_port), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.app_port}/", timeout=1).raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("The app did not start")
+
+async def run(args) -> Dict[str, Any]:
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    weights = parse_mix(args.mix)
+    choices = [name for name, weight in weights.items() for _ in range(weight)]
+    images = [make_image(seed) for seed in range(args.distinct_uploads)]
+    padding = "x" * args.submission_bytes
+    latencies: Dict[str, List[float]] = {name: [] for name in weights}
+    errors: Dict[str, int] = {name: 0 for name in weights}
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        form = (await client.post("/api/forms/create", json={"title": "Load test", "components": [
+            {"type": "textfield", "input": True, "key": "location", "label": "Location", "validate": {"required": True}},
+        ]})).json()
+        form_id = form["_id"]
+        # Seed the report with submissions of the configured size
+        for i in range(args.seed_submissions):
+            await client.post(f"/api/forms/{form_id}/submit", json={"data": {
+                "location": f"Building {i % 10}", "hasIssues": True, "issuePriority": "High", "notes": padding,
+            }})
+
+        async def upload():
+            image = random.choice(images)
+            return await client.post("/api/forms/upload", files={"file": ("scan.png", image, "image/png")})
+
+        async def render():
+            return await client.get(f"/api/forms/{form_id}")
+
+        async def submit():
+            return await client.post(f"/api/forms/{form_id}/submit", json={"data": {"location": "Building A", "notes": padding}})
+
+        async def report():
+            return await client.get("/api/forms/report", params={"limit": 50})
+
+        calls = {"upload": upload, "render": render, "submit": submit, "report": report}
+        memory_samples: List[Dict[str, float]] = []
+        deadline = time.perf_counter() + args.duration
+        stop = asyncio.Event()
+
+        async def sample_memory():
+            while not stop.is_set():
+                memory_samples.append(process_rss(args.app_pid))
+                try:
+                    await asyncio.wait_for(stop.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = random.choice(choices)
+                started = time.perf_counter()
+                try:
+                    response = await calls[name]()
+                    if response.status_code >= 400:
+                        errors[name] += 1
+                except httpx.HTTPError:
+                    errors[name] += 1
+                latencies[name].append(time.perf_counter() - started)
+
+        sampler = asyncio.create_task(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+    def summary(samples: List[float], error_count: int) -> Dict[str, Any]:
+        if not samples:
+            return {"requests": 0, "errors": error_count}
+        return {
+            "requests": len(samples),
+            "errors": error_count,
+            "rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        }
+
+    every = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "workloads": {name: summary(latencies[name], errors[name]) for name in weights},
+        "total": summary(every, sum(errors.values())),
+        "memory": {
+            "peak_app_rss_mib": round(max((sample["app_rss_mib"] for sample in memory_samples), default=0), 1),
+            "peak_total_rss_mib": round(max((sample["total_rss_mib"] for sample in memory_samples), default=0), 1),
+            "app_hwm_mib": round(memory_samples[-1]["app_hwm_mib"], 1) if memory_samples else None,
+        },
+    }
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    def delta(current: Optional[float], previous: Optional[float]) -> str:
+        if current is None or not previous:
+            return ""
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    print(f"{'workload':10} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = {**results["workloads"], "total": results["total"]}
+    for name, row in rows.items():
+        before = (baseline or {}).get("workloads", {}).get(name) if name != "total" else (baseline or {}).get("total")
+        before = before or {}
+        print(
+            f"{name:10} {row['requests']:>9} {row['errors']:>7} "
+            f"{row.get('rps', 0):>9.1f} {row.get('p50_ms', 0):>9.1f} {row.get('p95_ms', 0):>9.1f} {row.get('p99_ms', 0):>9.1f}"
+            + (f"   rps{delta(row.get('rps'), before.get('rps'))} p99{delta(row.get('p99_ms'), before.get('p99_ms'))}" if before else "")
+        )
+    memory = results["memory"]
+    print(
+        f"memory: app peak {memory['peak_app_rss_mib']} MiB, with document workers {memory['peak_total_rss_mib']} MiB"
+        + delta(memory["peak_total_rss_mib"], (baseline or {}).get("memory", {}).get("peak_total_rss_mib"))
+    )
+
+def main(args):
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+
+    random.seed(args.seed)
+    formio = stub_formio.serve_in_thread(stub_formio.create_app(latency=args.formio_latency), port=args.formio_port)
+    openai = stub_formio.serve_in_thread(
+        stub_openai.create_app(latency=args.model_latency, components=args.model_components), port=args.openai_port
+    )
+    data_dir = tempfile.mkdtemp(prefix="elyndra-load-")
+    app = start_app(args, data_dir)
+    args.app_pid = app.pid
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        app.terminate()
+        app.wait(timeout=30)
+        formio.should_exit = True
+        openai.should_exit = True
+
+    config = {key: value for key, value in vars(args).items() if key not in ("compare", "output", "app_pid")}
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": config,
+        **results,
+    }
+    print_results(record, baseline)
+
+    output = args.output or os.path.join(
+        "data", "benchmarks", f"load-{record['commit'] or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(record, handle, indent=2)
+    print(f"saved {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run the mixed workload")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default="upload=1,render=10,submit=5,report=2")
+    parser.add_argument("--distinct-uploads", type=int, default=20, help="fewer distinct files means more cache hits")
+    parser.add_argument("--seed-submissions", type=int, default=200)
+    parser.add_argument("--submission-bytes", type=int, default=1024)
+    parser.add_argument("--formio-latency", type=float, default=0.05)
+    parser.add_argument("--model-latency", type=float, default=2.0)
+    parser.add_argument("--model-components", type=int, default=20)
+    parser.add_argument("--app-port", type=int, default=8790)
+    parser.add_argument("--formio-port", type=int, default=8791)
+    parser.add_argument("--openai-port", type=int, default=8792)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="where to save the JSON results (default data/benchmarks/)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    main(parser.parse_args())
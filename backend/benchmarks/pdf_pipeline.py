@@ -0,0 +1,64 @@
+"""
+Time process_form on a multi-page PDF against the OpenAI stub, varying the
+number of render processes and parallel model calls.
+
+    python -m benchmarks.pdf_pipeline --pages 10 --model-latency 2
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from .stub_formio import serve_in_thread
+from . import stub_openai
+
+SAMPLE_PDF = os.path.join(os.path.dirname(__file__), "..", "..", "PaperForm.pdf")
+
+def build_pdf(pages: int) -> bytes:
+    """Repeat the sample paper form until the document has the requested page count"""
+    import io
+    import pypdfium2 as pdfium
+    source = pdfium.PdfDocument(SAMPLE_PDF)
+    document = pdfium.PdfDocument.new()
+    for index in range(pages):
+        document.import_pages(source, [index % len(source)])
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+async def run(content: bytes, workers: int, concurrency: int) -> float:
+    from app.services import ai_service, document_service
+    document_service.shutdown()
+    document_service.DOCUMENT_WORKERS = workers
+    ai_service.OPENAI_MAX_CONCURRENCY = concurrency
+    ai_service._semaphore = None
+    started = time.perf_counter()
+    await ai_service._process_form(content, "application/pdf")
+    return time.perf_counter() - started
+
+async def main(args):
+    content = build_pdf(args.pages)
+    cores = os.cpu_count() or 1
+    for workers, concurrency in ((1, 1), (cores, 1), (1, args.pages), (cores, args.pages)):
+        elapsed = await run(content, workers, concurrency)
+        print(f"render processes={workers:2}  model calls={concurrency:2}  "
+              f"{elapsed:6.2f} s  {args.pages / elapsed:5.2f} pages/s")
+    from app.services import ai_service, document_service
+    document_service.shutdown()
+    await ai_service.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--model-latency", type=float, default=2.0)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    # Repeated runs of the same pages must reach the model stub, not the template library
+    os.environ["TEMPLATE_MATCHING"] = "false"
+    stub = serve_in_thread(stub_openai.create_app(latency=args.model_latency), port=args.openai_port)
+    try:
+        asyncio.run(main(args))
+    finally:
+        stub.should_exit = True
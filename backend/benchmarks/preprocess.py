@@ -0,0 +1,76 @@
+"""
+Measure the bytes sent to the model and the end-to-end digitization
+latency with image preprocessing off and on, for the sample PDFs in the
+repository and a simulated phone photo of the paper form.
+
+The OpenAI stub charges a delay per request byte (--uplink, in MB/s) so
+payload size shows up in latency the way a real upload does.
+
+    python -m benchmarks.preprocess --uplink 2
+"""
+import argparse
+import asyncio
+import io
+import os
+import time
+
+from .stub_formio import serve_in_thread
+from . import stub_openai
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+SAMPLE_PDFS = ["PaperForm.pdf", "Digital Form Builder Challenge.pdf"]
+
+def phone_photo() -> bytes:
+    """Render the paper form at camera resolution, tilted and with a border, as a high-quality JPEG"""
+    import pypdfium2 as pdfium
+    from PIL import Image
+    document = pdfium.PdfDocument(os.path.join(REPO_ROOT, "PaperForm.pdf"))
+    page = document[0].render(scale=4000 / max(document[0].get_size())).to_pil().convert("RGB")
+    canvas = Image.new("RGB", (page.width + 600, page.height + 600), (140, 120, 100))
+    canvas.paste(page, (300, 300))
+    canvas = canvas.rotate(3, resample=Image.BICUBIC, fillcolor=(140, 120, 100))
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+def samples():
+    for name in SAMPLE_PDFS:
+        with open(os.path.join(REPO_ROOT, name), "rb") as f:
+            yield name, f.read(), "application/pdf"
+    yield "phone photo (PaperForm)", phone_photo(), "image/jpeg"
+
+async def main():
+    from app.services import ai_service, document_service
+    for name, content, content_type in samples():
+        for enabled in (False, True):
+            document_service.IMAGE_PREPROCESS = enabled
+            upload_before = document_service.document_bytes.value(kind="upload")
+            model_before = document_service.document_bytes.value(kind="model_image")
+            started = time.perf_counter()
+            await ai_service._process_form(content, content_type)
+            elapsed = time.perf_counter() - started
+            upload_bytes = document_service.document_bytes.value(kind="upload") - upload_before
+            model_bytes = document_service.document_bytes.value(kind="model_image") - model_before
+            # Negative when the page images are larger than the upload, as for a compact PDF
+            saved = upload_bytes - model_bytes
+            print(f"{name:36} preprocess={'on ' if enabled else 'off'}  upload {upload_bytes / 1024:8.0f} KiB  "
+                  f"to model {model_bytes / 1024:8.0f} KiB  saved {saved / 1024:8.0f} KiB  {elapsed:6.2f} s")
+    document_service.shutdown()
+    await ai_service.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uplink", type=float, default=2.0, help="emulated uplink in MB/s")
+    parser.add_argument("--model-latency", type=float, default=1.0)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    # Repeated runs of the same pages must reach the model stub, not the template library
+    os.environ["TEMPLATE_MATCHING"] = "false"
+    app = stub_openai.create_app(latency=args.model_latency, bytes_per_second=args.uplink * 1024 * 1024)
+    stub = serve_in_thread(app, port=args.openai_port)
+    try:
+        asyncio.run(main())
+    finally:
+        stub.should_exit = True
@@ -0,0 +1,83 @@
+"""
+Compare the old full-rescan report with queries against the local issue
+index, on synthetic maintenance submissions.
+
+    python -m benchmarks.report_index --submissions 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app.services import report_service
+
+LOCATIONS = [f"Building {chr(65 + i)}" for i in range(20)]
+PRIORITIES = ["Low", "Medium", "High"]
+FORMS = [f"form{i:02d}" for i in range(10)]
+
+def synthetic_submissions(count: int):
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        created = (start + timedelta(minutes=7 * i)).isoformat() + "Z"
+        yield {
+            "_id": f"{i:024x}",
+            "form": random.choice(FORMS),
+            "created": created,
+            "modified": created,
+            "data": {
+                "hasIssues": random.random() < 0.3,
+                "location": random.choice(LOCATIONS),
+                "issueType": "Electrical",
+                "issueDescription": "Loose socket cover",
+                "issuePriority": random.choice(PRIORITIES),
+                "issuePhotos": [],
+            },
+        }
+
+def timed(fn, repeat: int = 20):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return sorted(samples)[len(samples) // 2] * 1000
+
+def main(args):
+    random.seed(1)
+    submissions = list(synthetic_submissions(args.submissions))
+
+    def full_rescan():
+        issues = [issue for issue in map(report_service.to_issue, submissions) if issue is not None]
+        return len(issues)
+
+    print(f"full rescan (in memory, no download)   {timed(full_rescan, 5):9.1f} ms")
+
+    index = report_service.IssueIndex(os.path.join(tempfile.mkdtemp(), "report.sqlite3"))
+    started = time.perf_counter()
+    for offset in range(0, len(submissions), report_service.REPORT_SYNC_BATCH):
+        batch = submissions[offset:offset + report_service.REPORT_SYNC_BATCH]
+        index.apply(batch, batch[-1]["modified"])
+    print(f"initial index build                    {(time.perf_counter() - started) * 1000:9.1f} ms")
+
+    changed = random.sample(submissions, 100)
+    started = time.perf_counter()
+    index.apply(changed, changed[-1]["modified"])
+    print(f"incremental sync of 100 changes        {(time.perf_counter() - started) * 1000:9.1f} ms")
+
+    queries = {
+        "first page, no filter": {},
+        "location": {"location": "Building C"},
+        "location + priority": {"location": "Building C", "priority": "High"},
+        "form + date range": {"form_id": "form03", "date_from": "2024-03-01", "date_to": "2024-04-01"},
+        "deep page (offset 20000)": {"offset": 20000},
+    }
+    for name, filters in queries.items():
+        print(f"query: {name:32} {timed(lambda: index.query(**filters)):9.2f} ms")
+    index.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=100000)
+    main(parser.parse_args())
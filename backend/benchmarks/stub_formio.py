@@ -0,0 +1,125 @@
+"""
+Local stub of the Form.io REST endpoints used by formio_service.
+
+Run standalone with `python -m benchmarks.stub_formio` or start it in a
+background thread from a benchmark with `serve_in_thread`.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+def create_app(latency: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Form.io stub")
+    forms: Dict[str, Dict[str, Any]] = {}
+    submissions: Dict[str, Dict[str, Any]] = {}
+
+    async def delay():
+        if latency:
+            await asyncio.sleep(latency)
+
+    def with_etag(body, request: Request):
+        """Return body with an ETag, or 304 if the client already has it"""
+        raw = json.dumps(body).encode()
+        etag = '"' + hashlib.md5(raw).hexdigest() + '"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(raw, media_type="application/json", headers={"ETag": etag})
+
+    @app.get("/form")
+    async def list_forms(request: Request):
+        await delay()
+        return with_etag(list(forms.values()), request)
+
+    @app.post("/form")
+    async def create_form(form: Dict[str, Any]):
+        await delay()
+        form_id = uuid.uuid4().hex[:24]
+        form = {**form, "_id": form_id}
+        forms[form_id] = form
+        return form
+
+    @app.get("/form/{form_id}")
+    async def get_form(form_id: str, request: Request):
+        await delay()
+        if form_id not in forms:
+            raise HTTPException(status_code=404, detail="Form not found")
+        return with_etag(forms[form_id], request)
+
+    @app.put("/form/{form_id}")
+    async def update_form(form_id: str, form: Dict[str, Any]):
+        await delay()
+        forms[form_id] = {**form, "_id": form_id}
+        return forms[form_id]
+
+    @app.delete("/form/{form_id}")
+    async def delete_form(form_id: str):
+        await delay()
+        forms.pop(form_id, None)
+        return {}
+
+    @app.post("/form/{form_id}/submission")
+    async def create_submission(form_id: str, submission: Dict[str, Any]):
+        await delay()
+        submission_id = uuid.uuid4().hex[:24]
+        timestamp = now()
+        submission = {**submission, "_id": submission_id, "form": form_id, "created": timestamp, "modified": timestamp}
+        submissions[submission_id] = submission
+        return submission
+
+    def page(items, request: Request, response: Response, limit: int, skip: int):
+        """Form.io style paging (limit/skip, Content-Range) with sort and modified__gt(e) filters"""
+        params = request.query_params
+        if "modified__gt" in params:
+            items = [s for s in items if s["modified"] > params["modified__gt"]]
+        if "modified__gte" in params:
+            items = [s for s in items if s["modified"] >= params["modified__gte"]]
+        sort = params.get("sort")
+        if sort:
+            items = sorted(items, key=lambda s: s.get(sort.lstrip("-"), ""), reverse=sort.startswith("-"))
+        selected = items[skip:skip + limit]
+        end = skip + len(selected) - 1 if selected else skip
+        response.headers["Content-Range"] = f"{skip}-{end}/{len(items)}"
+        return selected
+
+    @app.get("/form/{form_id}/submission")
+    async def list_form_submissions(form_id: str, request: Request, response: Response, limit: int = 10, skip: int = 0):
+        await delay()
+        return page([s for s in submissions.values() if s["form"] == form_id], request, response, limit, skip)
+
+    @app.put("/form/{form_id}/submission/{submission_id}")
+    async def update_submission(form_id: str, submission_id: str, submission: Dict[str, Any]):
+        await delay()
+        if submission_id not in submissions:
+            raise HTTPException(status_code=404, detail="Submission not found")
+        submissions[submission_id].update(data=submission.get("data", {}), modified=now())
+        return submissions[submission_id]
+
+    @app.get("/submission")
+    async def list_submissions(request: Request, response: Response, limit: int = 10, skip: int = 0):
+        await delay()
+        return page(list(submissions.values()), request, response, limit, skip)
+
+    return app
+
+def serve_in_thread(app, host: str = "127.0.0.1", port: int = 8765) -> uvicorn.Server:
+    """Start an ASGI app on a background thread and wait until it accepts connections"""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+if __name__ == "__main__":
+    uvicorn.run(create_app(), host="127.0.0.1", port=8765)
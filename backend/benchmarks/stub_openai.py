@@ -0,0 +1,99 @@
+"""
+Local stub of the OpenAI chat-completions endpoint used by ai_service.
+
+Point the service at it with OPENAI_BASE_URL=http://127.0.0.1:8766/v1.
+"""
+import asyncio
+import json
+import time
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+SAMPLE_FORM = {
+    "title": "Site Inspection",
+    "display": "form",
+    "type": "form",
+    "name": "siteInspection",
+    "path": "siteinspection",
+    "components": [
+        {"label": "Location", "key": "location", "type": "textfield", "input": True, "tableView": True},
+        {"label": "Inspector", "key": "inspector", "type": "textfield", "input": True, "tableView": True},
+        {"label": "Issues found", "key": "hasIssues", "type": "checkbox", "input": True, "tableView": False},
+    ],
+}
+
+# Characters per streamed chunk, roughly a few tokens
+STREAM_CHUNK_CHARS = 16
+
+def synthetic_form(components: int) -> Dict[str, Any]:
+    """A form with the given number of text fields, to emulate larger replies"""
+    return {
+        **SAMPLE_FORM,
+        "components": [
+            {"label": f"Field {i}", "key": f"field{i}", "type": "textfield", "input": True, "tableView": True}
+            for i in range(components)
+        ],
+    }
+
+def create_app(latency: float = 0.0, bytes_per_second: float = 0.0, components: int = 0) -> FastAPI:
+    """
+    latency is a fixed delay per completion; bytes_per_second adds a delay
+    proportional to the request size to emulate a limited uplink; components
+    replaces the sample form with a synthetic one of that many fields
+    """
+    app = FastAPI(title="OpenAI stub")
+    form = synthetic_form(components) if components else SAMPLE_FORM
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        raw = await request.body()
+        body: Dict[str, Any] = json.loads(raw)
+        upload_delay = len(raw) / bytes_per_second if bytes_per_second else 0.0
+        if body.get("response_format", {}).get("type") == "json_object":
+            content = json.dumps(form, indent=2)
+        else:
+            content = "Site Inspection\nLocation: ____\nInspector: ____"
+        if body.get("stream"):
+            # Spread the latency over the reply, as a model generating tokens would
+            return StreamingResponse(stream_chunks(body, content, upload_delay), media_type="text/event-stream")
+        delay = latency + upload_delay
+        if delay:
+            await asyncio.sleep(delay)
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 200, "total_tokens": 1200},
+        }
+
+    async def stream_chunks(body: Dict[str, Any], content: str, upload_delay: float):
+        if upload_delay:
+            await asyncio.sleep(upload_delay)
+        pieces = [content[offset:offset + STREAM_CHUNK_CHARS] for offset in range(0, len(content), STREAM_CHUNK_CHARS)]
+        for piece in pieces:
+            if latency:
+                await asyncio.sleep(latency / len(pieces))
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+if __name__ == "__main__":
+    uvicorn.run(create_app(latency=2.0), host="127.0.0.1", port=8766)
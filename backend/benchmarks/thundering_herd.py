@@ -0,0 +1,102 @@
+"""
+Thundering-herd test of request coalescing against local Form.io and OpenAI
+stubs: many devices fetching a newly rolled out form at once, and the same
+scan digitized several times at once (double clicks). Each herd hits a cold
+cache, once through the uncoalesced miss path and once through the
+single-flight layer, and the stubs count the upstream calls.
+
+    python -m benchmarks.thundering_herd --clients 200 --uploads 10
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from . import stub_formio, stub_openai
+from .load_test import make_image
+
+class CountingApp:
+    """ASGI wrapper counting the requests a stub receives"""
+
+    def __init__(self, app):
+        self.app = app
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.calls += 1
+        await self.app(scope, receive, send)
+
+async def herd(stub: CountingApp, clients: int, call):
+    """Start clients identical calls at once; returns upstream calls and elapsed seconds"""
+    before = stub.calls
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(clients)))
+    return stub.calls - before, time.perf_counter() - started
+
+def report(name: str, calls: int, elapsed: float, clients: int):
+    print(f"{name:34} {clients:5} callers {calls:5} upstream calls {elapsed * 1000:9.1f} ms")
+
+async def main(args, formio: CountingApp, openai: CountingApp):
+    from app.services import formio_service, ai_service, upload_service, document_service
+
+    form = await formio_service.create_form(stub_openai.synthetic_form(args.components))
+    form_id = form["_id"]
+    key, path = f"form:{form_id}", f"/form/{form_id}"
+
+    def cold_form_cache():
+        formio_service.form_cache.clear()
+
+    cold_form_cache()
+    calls, elapsed = await herd(formio, args.clients, lambda: formio_service._fetch(key, path, None))
+    report("get_form, uncoalesced", calls, elapsed, args.clients)
+    cold_form_cache()
+    calls, elapsed = await herd(formio, args.clients, lambda: formio_service.get_form(form_id))
+    report("get_form, single-flight", calls, elapsed, args.clients)
+
+    image = make_image(0)
+
+    async def digitize_uncoalesced():
+        with upload_service.from_bytes(image, "image/png") as upload:
+            await ai_service._process_form(upload.source, upload.content_type)
+
+    async def digitize():
+        with upload_service.from_bytes(image, "image/png") as upload:
+            await ai_service.process_upload(upload)
+
+    ai_service.digitization_cache.memory.clear()
+    calls, elapsed = await herd(openai, args.uploads, digitize_uncoalesced)
+    report("process_upload, uncoalesced", calls, elapsed, args.uploads)
+    ai_service.digitization_cache.memory.clear()
+    calls, elapsed = await herd(openai, args.uploads, digitize)
+    report("process_upload, single-flight", calls, elapsed, args.uploads)
+
+    await formio_service.shutdown()
+    await ai_service.shutdown()
+    document_service.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="concurrent readers of one form")
+    parser.add_argument("--uploads", type=int, default=10, help="concurrent digitizations of one scan")
+    parser.add_argument("--components", type=int, default=200, help="size of the form")
+    parser.add_argument("--formio-latency", type=float, default=0.1)
+    parser.add_argument("--model-latency", type=float, default=1.0)
+    parser.add_argument("--formio-port", type=int, default=8797)
+    parser.add_argument("--openai-port", type=int, default=8798)
+    args = parser.parse_args()
+
+    formio = CountingApp(stub_formio.create_app(latency=args.formio_latency))
+    openai = CountingApp(stub_openai.create_app(latency=args.model_latency))
+    stub_formio.serve_in_thread(formio, port=args.formio_port)
+    stub_formio.serve_in_thread(openai, port=args.openai_port)
+    os.environ.update(
+        FORMIO_SERVER_URL=f"http://127.0.0.1:{args.formio_port}",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.openai_port}/v1",
+        OPENAI_API_KEY="stub",
+        TEMPLATE_MATCHING="false",
+    )
+    # Only the in-memory cache tiers, so clearing them makes every herd cold
+    for name in ("SHARED_CACHE_PATH", "DIGITIZATION_CACHE_DIR"):
+        os.environ.pop(name, None)
+    asyncio.run(main(args, formio, openai))
@@ -0,0 +1,73 @@
+"""
+Peak Python memory for concurrent uploads, comparing the old
+read / b64encode / f-string path with the streaming ingest path.
+
+Uploads are handed to the service as spooled UploadFiles, the way
+Starlette delivers them, and the model call is replaced by a short sleep
+so only the upload handling is measured.
+
+    python -m benchmarks.upload_memory --uploads 50 --size-mb 20
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from .stub_openai import SAMPLE_FORM
+
+MODEL_LATENCY = 0.2
+
+async def fake_completion(**kwargs):
+    await asyncio.sleep(MODEL_LATENCY)
+    message = SimpleNamespace(content=json.dumps(SAMPLE_FORM))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def make_upload(size: int) -> UploadFile:
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    chunk = os.urandom(1024 * 1024)
+    for _ in range(size // len(chunk)):
+        spool.write(chunk)
+    spool.seek(0)
+    return UploadFile(spool, size=size, filename="scan.jpg", headers=Headers({"content-type": "image/jpeg"}))
+
+async def old_path(file: UploadFile):
+    content = await file.read()
+    encoded_image = base64.b64encode(content).decode('utf-8')
+    await fake_completion(url=f"data:image/jpeg;base64,{encoded_image}")
+
+async def new_path(file: UploadFile):
+    from app.services import ai_service
+    await ai_service.process_form(file)
+
+async def measure(path, uploads: int, size: int) -> float:
+    files = [make_upload(size) for _ in range(uploads)]
+    tracemalloc.start()
+    await asyncio.gather(*(path(file) for file in files))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for file in files:
+        file.file.close()
+    return peak
+
+async def main(args):
+    from app.services import ai_service, document_service
+    document_service.IMAGE_PREPROCESS = False
+    ai_service._create_completion = fake_completion
+    size = args.size_mb * 1024 * 1024
+    for name, path in (("read + b64encode", old_path), ("streaming ingest", new_path)):
+        peak = await measure(path, args.uploads, size)
+        print(f"{name:18} {args.uploads} x {args.size_mb} MB   peak {peak / 1024 / 1024:8.1f} MiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--size-mb", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args))
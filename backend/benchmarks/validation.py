@@ -0,0 +1,76 @@
+"""
+Time compiling and running the local submission validator on a synthetic
+form with required, pattern, length and conditional rules.
+
+    python -m benchmarks.validation --fields 500
+"""
+import argparse
+import random
+import time
+
+from app.services import validation_service
+
+def synthetic_form(fields: int):
+    """Panels of ten fields; every third field is shown only when its panel's toggle is "yes" """
+    panels = []
+    for panel_index in range(0, fields, 10):
+        toggle = f"toggle{panel_index}"
+        components = [{
+            "type": "radio", "input": True, "key": toggle, "label": f"Toggle {panel_index}",
+            "values": [{"label": "yes", "value": "yes"}, {"label": "no", "value": "no"}],
+            "validate": {"required": True},
+        }]
+        for i in range(panel_index, min(fields, panel_index + 10)):
+            component = {
+                "type": "textfield", "input": True, "key": f"field{i}", "label": f"Field {i}",
+                "validate": {
+                    "required": i % 2 == 0,
+                    "minLength": 2 if i % 5 == 0 else "",
+                    "maxLength": 40,
+                    "pattern": "[A-Za-z0-9 ]*" if i % 4 == 0 else "",
+                },
+            }
+            if i % 3 == 0:
+                component["conditional"] = {"show": True, "when": toggle, "eq": "yes"}
+            components.append(component)
+        panels.append({"type": "panel", "key": f"panel{panel_index}", "title": f"Panel {panel_index}", "components": components})
+    return {"title": "Synthetic", "components": panels}
+
+def valid_data(fields: int):
+    data = {f"field{i}": f"value {i}" for i in range(fields)}
+    data.update({f"toggle{i}": random.choice(["yes", "no"]) for i in range(0, fields, 10)})
+    return data
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+def main(args):
+    random.seed(1)
+    form = synthetic_form(args.fields)
+    started = time.perf_counter()
+    validator = validation_service.get_validator("synthetic", form)
+    print(f"compile {args.fields} fields              {(time.perf_counter() - started) * 1000:8.2f} ms")
+    print(f"cached lookup                     {timed(lambda: validation_service.get_validator('synthetic', form), args.repeat)[0] * 1000:8.2f} us")
+
+    valid = {"data": valid_data(args.fields)}
+    invalid = {"data": {**valid["data"], "field0": "", "field4": "no!", "field5": "x"}}
+    for name, submission in (("valid", valid), ("invalid", invalid)):
+        def run():
+            try:
+                validator.validate(submission)
+            except validation_service.SubmissionValidationError:
+                pass
+        p50, p99 = timed(run, args.repeat)
+        print(f"validate {name:8} p50 {p50:6.3f} ms  p99 {p99:6.3f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=1000)
+    main(parser.parse_args())
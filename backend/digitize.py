@@ -0,0 +1,307 @@
+"""
+Batch digitization: run every PDF, JPEG and PNG in a directory (searched
+recursively) or a ZIP archive through the same pipeline as
+/api/forms/upload, several files at a time, and write each form structure
+to a JSON file under --output. With --create-forms each form is also
+created in Form.io, named after its file.
+
+    python digitize.py scans/site-42.zip --concurrency 8 --create-forms
+
+Progress is checkpointed to a SQLite file in the output directory after
+every file, so an interrupted run (Ctrl-C, a crash, a quota error) picks up
+where it stopped when started again with the same arguments: files already
+digitized are not sent to the model again, and files that failed or were
+digitized but not created in Form.io are retried. A file that changed since
+it was recorded is digitized again.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+import zipfile
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services import ai_service, document_service, formio_service, template_service, upload_service
+
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+DIGITIZED = "digitized"
+CREATED = "created"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    signature TEXT NOT NULL,
+    status TEXT NOT NULL,
+    sha256 TEXT,
+    cache TEXT,
+    output TEXT,
+    form_id TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+class Source:
+    """A form file in the input directory or archive"""
+
+    def __init__(self, name: str, content_type: str, size: int, signature: str):
+        self.name = name
+        self.content_type = content_type
+        self.size = size
+        # Changes when the file does, without reading it
+        self.signature = signature
+
+def _skipped(name: str) -> bool:
+    """Hidden files, the metadata macOS adds to archives and members that would escape the output directory"""
+    return name.startswith("/") or any(part.startswith(".") or part == "__MACOSX" for part in name.split("/"))
+
+def list_directory(root: str) -> List[Source]:
+    sources = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            content_type = CONTENT_TYPES.get(os.path.splitext(filename)[1].lower())
+            if content_type and not _skipped(name):
+                stat = os.stat(path)
+                sources.append(Source(name, content_type, stat.st_size, f"{stat.st_size}:{stat.st_mtime_ns}"))
+    return sources
+
+def list_archive(archive: zipfile.ZipFile) -> List[Source]:
+    sources = []
+    for info in archive.infolist():
+        content_type = CONTENT_TYPES.get(os.path.splitext(info.filename)[1].lower())
+        if content_type and not info.is_dir() and not _skipped(info.filename):
+            sources.append(Source(info.filename, content_type, info.file_size, f"{info.file_size}:{info.CRC:08x}"))
+    return sources
+
+def open_upload(input_path: str, archive: Optional[zipfile.ZipFile], source: Source) -> upload_service.Upload:
+    """
+    An upload for a source file: files in a directory are read where they
+    are, archive members are extracted into memory or the upload spool
+    """
+    if source.size > upload_service.UPLOAD_MAX_BYTES:
+        raise upload_service.UploadTooLargeError(f"File exceeds the {upload_service.UPLOAD_MAX_BYTES} byte limit")
+    filename = os.path.basename(source.name)
+    if archive is None:
+        return upload_service.from_path(os.path.join(input_path, source.name), source.content_type, filename, owned=False)
+    upload = upload_service.Upload(source.content_type, filename)
+    try:
+        with archive.open(source.name) as member:
+            while True:
+                chunk = member.read(upload_service.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+class Checkpoint:
+    """What has been done with each file, committed as each one finishes"""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        self._conn.row_factory = sqlite3.Row
+        try:
+            return {row["name"]: dict(row) for row in self._conn.execute("SELECT * FROM files")}
+        finally:
+            self._conn.row_factory = None
+
+    def record(self, name: str, signature: str, status: str, **fields):
+        fields = {"sha256": None, "cache": None, "output": None, "form_id": None, "error": None, **fields}
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (name, signature, status, sha256, cache, output, form_id, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, signature, status, fields["sha256"], fields["cache"], fields["output"], fields["form_id"], fields["error"], time.time()),
+        )
+
+    def close(self):
+        self._conn.close()
+
+def form_name(prefix: str, name: str) -> str:
+    """A Form.io name and path for a file, like the upload page derives them from the form name"""
+    stem = os.path.splitext(name)[0]
+    return prefix + re.sub(r"[^a-z0-9]+", "_", stem.lower()).strip("_")
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class Progress:
+    """Throughput of this run and the time left at that rate"""
+
+    def __init__(self, total: int, done: int):
+        self.total = total
+        self.done = done
+        self.finished = 0
+        self.started = time.monotonic()
+
+    def advance(self, name: str, outcome: str, seconds: float):
+        self.finished += 1
+        self.done += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.finished / elapsed if elapsed else 0.0
+        eta = format_duration((self.total - self.done) / rate) if rate else "?"
+        print(
+            f"[{self.done}/{self.total}] {name}: {outcome} in {seconds:.1f}s | "
+            f"{rate * 60:.1f} files/min, ETA {eta}",
+            flush=True,
+        )
+
+def _done(row: Optional[Dict[str, Any]], source: Source, create_forms: bool) -> bool:
+    if row is None or row["signature"] != source.signature:
+        return False
+    return row["status"] == CREATED or (row["status"] == DIGITIZED and not create_forms)
+
+async def process(args, source: Source, row: Optional[Dict[str, Any]], archive, checkpoint: Checkpoint, output_dir: str) -> str:
+    """Digitize one file (unless an earlier run already did), create its form if asked; returns the outcome"""
+    output = os.path.join(output_dir, source.name + ".json")
+    if (
+        row is not None and row["signature"] == source.signature
+        and row["status"] == DIGITIZED and os.path.exists(output)
+    ):
+        # Digitized by an earlier run that stopped before creating the form
+        with open(output) as f:
+            form_structure = json.load(f)
+        fields = {"sha256": row["sha256"], "cache": row["cache"], "output": output}
+        outcome = "from checkpoint"
+    else:
+        try:
+            upload = await asyncio.to_thread(open_upload, args.input, archive, source)
+            with upload:
+                form_structure, cache_status = await ai_service.process_upload(upload)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, "w") as f:
+                json.dump(form_structure, f, indent=2)
+        except Exception as e:
+            await asyncio.to_thread(checkpoint.record, source.name, source.signature, FAILED, error=str(e))
+            raise
+        fields = {"sha256": upload.sha256, "cache": cache_status, "output": output}
+        outcome = cache_status
+        await asyncio.to_thread(checkpoint.record, source.name, source.signature, DIGITIZED, **fields)
+    if not args.create_forms:
+        return outcome
+    name = form_name(args.prefix, source.name)
+    form_data = {
+        **form_structure,
+        "title": form_structure.get("title") or os.path.splitext(os.path.basename(source.name))[0],
+        "name": name,
+        "path": name,
+    }
+    try:
+        created = await formio_service.create_form(form_data)
+    except Exception as e:
+        # The digitization is kept, so a rerun only retries the creation
+        await asyncio.to_thread(checkpoint.record, source.name, source.signature, DIGITIZED, **fields, error=str(e))
+        raise
+    await asyncio.to_thread(checkpoint.record, source.name, source.signature, CREATED, **fields, form_id=created.get("_id"))
+    return f"{outcome}, form {created.get('_id')}"
+
+async def run(args) -> int:
+    archive = zipfile.ZipFile(args.input) if zipfile.is_zipfile(args.input) else None
+    if archive is None and not os.path.isdir(args.input):
+        print(f"{args.input} is neither a directory nor a ZIP archive", file=sys.stderr)
+        return 2
+    output_dir = args.output or os.path.join("data", "digitized", os.path.splitext(os.path.basename(os.path.normpath(args.input)))[0])
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(output_dir, "checkpoint.sqlite3"))
+    sources = list_archive(archive) if archive is not None else list_directory(args.input)
+    rows = checkpoint.load()
+    pending = [source for source in sources if not _done(rows.get(source.name), source, args.create_forms)]
+    print(
+        f"{len(sources)} files in {args.input}, {len(sources) - len(pending)} already done, "
+        f"{len(pending)} to go with {args.concurrency} at a time; output in {output_dir}",
+        flush=True,
+    )
+
+    progress = Progress(len(sources), len(sources) - len(pending))
+    outcomes = Counter()
+    queue = iter(pending)
+
+    async def worker():
+        for source in queue:
+            started = time.monotonic()
+            try:
+                outcome = await process(args, source, rows.get(source.name), archive, checkpoint, output_dir)
+                outcomes[outcome.split(",")[0]] += 1
+            except Exception as e:
+                outcome = f"failed ({e})"
+                outcomes[FAILED] += 1
+            progress.advance(source.name, outcome, time.monotonic() - started)
+
+    if args.create_forms:
+        await formio_service.startup()
+    await template_service.startup()
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, args.concurrency))))
+    finally:
+        await template_service.shutdown()
+        await formio_service.shutdown()
+        await ai_service.shutdown()
+        document_service.shutdown()
+        checkpoint.close()
+        if archive is not None:
+            archive.close()
+        elapsed = time.monotonic() - progress.started
+        summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+        print(
+            f"{progress.finished} files in {format_duration(elapsed)}"
+            + (f" ({progress.finished / elapsed * 60:.1f} files/min)" if elapsed else "")
+            + (f": {summary}" if summary else ""),
+            flush=True,
+        )
+    if outcomes[FAILED]:
+        print(f"{outcomes[FAILED]} files failed; run again to retry them", file=sys.stderr)
+        return 1
+    return 0
+
+def main(args) -> int:
+    # Template matches are logged with their similarity
+    logging.basicConfig(format="%(levelname)s: %(name)s: %(message)s")
+    logging.getLogger("app").setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    try:
+        return asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("Interrupted; run again with the same arguments to resume", file=sys.stderr)
+        return 130
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="directory or ZIP archive of scanned forms")
+    parser.add_argument("--output", help="directory for the form JSON files and the checkpoint (default data/digitized/<input name>)")
+    parser.add_argument(
+        "--concurrency", type=int, default=int(os.getenv("DIGITIZE_CONCURRENCY", "4")),
+        help="files digitized at a time; model calls are still limited by OPENAI_MAX_CONCURRENCY",
+    )
+    parser.add_argument("--create-forms", action="store_true", help="create each digitized form in Form.io")
+    parser.add_argument("--prefix", default="", help="prefix for the Form.io name and path of created forms")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""
+Production entry point: several worker processes sharing one socket, with
+uvloop and httptools when they are installed. Runs under gunicorn (the app
+is preloaded once and forked, workers are recycled after
+--max-requests) when it is installed, otherwise under uvicorn's own
+process manager. Send SIGHUP to restart the workers without closing the
+socket; SIGTERM lets requests in progress finish for --graceful-timeout.
+
+    python serve.py --workers 4 --port 8000
+
+Caches, the job store and the per-client rate limits are shared between
+the workers through SQLite (SHARED_CACHE_PATH, JOB_STORE=sqlite), which
+this script turns on unless they are configured otherwise. Concurrency
+limits (ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE,
+OPENAI_MAX_CONCURRENCY) are for the whole server: each worker takes an
+equal share. /metrics adds up the samples every worker leaves in
+METRICS_MULTIPROC_DIR. For development use run.py instead.
+"""
+import argparse
+import glob
+import importlib.util
+import os
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def uvicorn_options(args) -> dict:
+    return {
+        "loop": "uvloop" if installed("uvloop") else "asyncio",
+        "http": "httptools" if installed("httptools") else "h11",
+        "timeout_keep_alive": args.keep_alive,
+        "backlog": args.backlog,
+        # The API sits behind a proxy in production; trust its client address headers
+        "proxy_headers": True,
+        "forwarded_allow_ips": args.forwarded_allow_ips,
+    }
+
+def serve_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+    try:
+        from uvicorn_worker import UvicornWorker
+    except ImportError:
+        from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, **uvicorn_options(args)}
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": Worker,
+                "preload_app": True,
+                "graceful_timeout": args.graceful_timeout,
+                # Streaming digitizations keep a request busy for minutes
+                "timeout": args.worker_timeout,
+                "keepalive": args.keep_alive,
+                "backlog": args.backlog,
+                "max_requests": args.max_requests,
+                "max_requests_jitter": args.max_requests // 10,
+                "forwarded_allow_ips": args.forwarded_allow_ips,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app.main import app
+            return app
+
+    Application().run()
+
+def serve_uvicorn(args):
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=args.max_requests // 10,
+        **uvicorn_options(args),
+    )
+
+def main(args):
+    if args.workers > 1:
+        # Per-process caches would be filled once per worker and per-process
+        # job records would only be visible to the worker that took the job
+        os.environ.setdefault("SHARED_CACHE_PATH", "data/cache.sqlite3")
+        os.environ.setdefault("JOB_STORE", "sqlite")
+        # Process-wide limits and metrics need to know they are one of several
+        os.environ["WORKER_PROCESSES"] = str(args.workers)
+        metrics_dir = os.environ.setdefault("METRICS_MULTIPROC_DIR", "data/metrics")
+        # Samples left by an earlier run would be counted again
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+    if args.server == "gunicorn" or (args.server == "auto" and installed("gunicorn")):
+        serve_gunicorn(args)
+    else:
+        serve_uvicorn(args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--server", choices=("auto", "gunicorn", "uvicorn"), default=os.getenv("SERVER_MANAGER", "auto"))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")))
+    parser.add_argument("--worker-timeout", type=int, default=int(os.getenv("SERVER_WORKER_TIMEOUT", "300")))
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("SERVER_KEEP_ALIVE", "5")))
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("SERVER_BACKLOG", "2048")))
+    parser.add_argument(
+        "--max-requests", type=int, default=int(os.getenv("SERVER_MAX_REQUESTS", "0")),
+        help="restart a worker after this many requests (0 never)",
+    )
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("SERVER_FORWARDED_ALLOW_IPS", "127.0.0.1"))
+    main(parser.parse_args())
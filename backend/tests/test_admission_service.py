@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.services import admission_service
+
+def _scope(method, path, client="203.0.113.7", headers=()):
+    return {"type": "http", "method": method, "path": path, "headers": list(headers), "client": (client, 50000)}
+
+def test_report_export_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(admission_service, "buckets", admission_service.TokenBuckets())
+    rule = admission_service.rules["/api/forms/report/export"]
+
+    async def main():
+        admitted = [await admission_service.admit(_scope("GET", "/api/forms/report/export")) for _ in range(int(rule["burst"]))]
+        try:
+            await admission_service.admit(_scope("GET", "/api/forms/report/export"))
+        except admission_service.AdmissionError as e:
+            return admitted, e
+        return admitted, None
+
+    admitted, error = asyncio.run(main())
+    assert all(result == (admission_service.BATCH, False) for result in admitted)
+    assert error is not None and error.status_code == 429
+
+def test_workers_draw_from_one_shared_bucket(tmp_path):
+    # Two stores on one database stand for two worker processes
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = admission_service.SharedTokenBuckets(path), admission_service.SharedTokenBuckets(path)
+    key = ("203.0.113.7", "/api/ai/process-form")
+    waits = [store.take(key, 0.01, 4) for store in (first, second, first, second, first, second)]
+    assert waits[:4] == [0.0] * 4
+    assert all(wait > 0 for wait in waits[4:])
+    assert len(first) == 1
+
+def test_concurrency_limits_are_split_between_workers(monkeypatch):
+    from app.services import worker_lock
+
+    monkeypatch.setattr(worker_lock, "WORKER_PROCESSES", 4)
+    assert worker_lock.share(8) == 2
+    assert worker_lock.share(2) == 1
+
+def test_rotating_a_client_header_does_not_bypass_the_limit(monkeypatch):
+    monkeypatch.setattr(admission_service, "buckets", admission_service.TokenBuckets())
+    rule = admission_service.rules["/api/forms/report/export"]
+
+    async def main():
+        for attempt in range(int(rule["burst"]) + 1):
+            await admission_service.admit(_scope("GET", "/api/forms/report/export", headers=[(b"x-tenant-id", str(attempt).encode())]))
+
+    with pytest.raises(admission_service.AdmissionError) as error:
+        asyncio.run(main())
+    assert error.value.status_code == 429
+
+def test_gateway_identity_header_is_used_when_configured(monkeypatch):
+    monkeypatch.setattr(admission_service, "ADMISSION_CLIENT_HEADER", "x-authenticated-user")
+    scope = _scope("GET", "/", headers=[(b"x-authenticated-user", b"alice")])
+    assert admission_service.client_id(scope) == "alice"
+    assert admission_service.client_id(_scope("GET", "/")) == "203.0.113.7"
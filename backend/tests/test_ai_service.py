@@ -0,0 +1,115 @@
+import asyncio
+import copy
+
+import pytest
+
+from app.services import ai_service
+
+def _field(key, **extra):
+    return {"type": "textfield", "key": key, "label": key, "input": True, **extra}
+
+def _fields(prefix, count):
+    return [_field(f"{prefix}{i}") for i in range(count)]
+
+def _section_keys(plan):
+    """The input keys of every section in a plan, in order, shells included"""
+    keys = []
+    for kind, value in plan:
+        if kind == "section":
+            keys.append(ai_service._input_keys(value))
+        elif kind == "shell":
+            for _, children in value[1]:
+                keys.extend(_section_keys(children))
+    return keys
+
+def test_flat_fields_are_grouped_up_to_the_limit():
+    plan = ai_service.plan_sections(_fields("f", 7) + [copy.deepcopy(ai_service.SUBMIT_BUTTON)], max_fields=3)
+    assert [kind for kind, _ in plan] == ["section", "section", "section", "keep"]
+    assert _section_keys(plan) == [["f0", "f1", "f2"], ["f3", "f4", "f5"], ["f6"]]
+
+def test_small_panel_is_one_section():
+    panel = {"type": "panel", "key": "panel", "input": False, "components": _fields("p", 3)}
+    plan = ai_service.plan_sections([_field("before"), panel], max_fields=3)
+    assert plan == [("section", [_field("before")]), ("section", [panel])]
+
+def test_oversized_panel_is_split_into_its_children():
+    panel = {"type": "panel", "key": "panel", "input": False, "components": _fields("p", 5)}
+    plan = ai_service.plan_sections([panel], max_fields=2)
+    assert [kind for kind, _ in plan] == ["shell"]
+    assert _section_keys(plan) == [["p0", "p1"], ["p2", "p3"], ["p4"]]
+
+def test_oversized_columns_are_split_per_column():
+    columns = {
+        "type": "columns", "key": "columns", "input": False,
+        "columns": [{"width": 6, "components": _fields("left", 3)}, {"width": 6, "components": _fields("right", 2)}],
+    }
+    plan = ai_service.plan_sections([columns], max_fields=3)
+    assert [kind for kind, _ in plan] == ["shell"]
+    assert [place for place, _ in plan[0][1][1]] == [("columns", 0), ("columns", 1)]
+    assert _section_keys(plan) == [["left0", "left1", "left2"], ["right0", "right1"]]
+
+def test_oversized_table_is_split_per_cell():
+    table = {
+        "type": "table", "key": "table", "input": False,
+        "rows": [[{"components": _fields(f"r{row}c{cell}", 1)} for cell in range(2)] for row in range(2)],
+    }
+    plan = ai_service.plan_sections([table], max_fields=3)
+    assert [kind for kind, _ in plan] == ["shell"]
+    assert _section_keys(plan) == [["r0c00"], ["r0c10"], ["r1c00"], ["r1c10"]]
+
+def test_reconcile_renames_added_fields_that_clash():
+    components = [_field("name"), _field("name", _added=True), _field("notes", _added=True)]
+    ai_service._reconcile_keys(components, ["name"])
+    assert [component["key"] for component in components] == ["name", "name2", "notes"]
+    assert not any("_added" in component for component in components)
+
+def test_reconcile_keeps_the_original_key_when_an_added_field_comes_first():
+    components = [_field("name", _added=True), _field("name")]
+    ai_service._reconcile_keys(components, ["name"])
+    assert [component["key"] for component in components] == ["name2", "name"]
+
+def test_reconcile_renames_a_repeated_original_key():
+    components = [_field("name"), _field("name")]
+    ai_service._reconcile_keys(components, ["name"])
+    assert [component["key"] for component in components] == ["name", "name2"]
+
+def test_reconcile_drops_conditionals_on_missing_fields():
+    components = [
+        _field("kept", conditional={"show": True, "when": "name", "eq": "x"}),
+        _field("name"),
+        _field("orphan", conditional={"show": True, "when": "gone", "eq": "x"}),
+    ]
+    ai_service._reconcile_keys(components, ["kept", "name", "orphan"])
+    assert components[0]["conditional"]["when"] == "name"
+    assert components[2]["conditional"] == {"show": "", "when": None, "eq": ""}
+
+@pytest.fixture
+def enhance_sections(monkeypatch):
+    """Stand-in for the model: every section comes back with a "notes" field added"""
+    sections = []
+
+    async def enhance_section(components, form_keys):
+        sections.append(ai_service._input_keys(components))
+        return copy.deepcopy(components) + [_field("notes", description="added")]
+
+    monkeypatch.setattr(ai_service, "_enhance_section", enhance_section)
+    monkeypatch.setattr(ai_service, "ENHANCE_SECTION_FIELDS", 2)
+    return sections
+
+def test_enhanced_sections_merge_back_in_place(enhance_sections):
+    columns = {
+        "type": "columns", "key": "columns", "input": False,
+        "columns": [{"width": 6, "components": _fields("left", 2)}, {"width": 6, "components": _fields("right", 1)}],
+    }
+    form = {"title": "Inspection", "components": [_field("notes"), columns]}
+    enhanced = asyncio.run(ai_service.enhance_form(form))
+
+    assert enhance_sections == [["notes"], ["left0", "left1"], ["right0"]]
+    # Every section added a "notes" field; the original keeps its key and the
+    # additions are renamed so keys stay unique across sections
+    keys = [component["key"] for component in ai_service.iter_components(enhanced["components"])]
+    assert keys == ["notes", "notes2", "columns", "left0", "left1", "notes3", "right0", "notes4"]
+    assert enhanced["components"][0] == _field("notes")
+    assert [column["width"] for column in enhanced["components"][2]["columns"]] == [6, 6]
+    # The caller's form is left as it was
+    assert form["components"][1]["columns"][0]["components"] == _fields("left", 2)
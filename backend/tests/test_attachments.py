@@ -0,0 +1,84 @@
+import asyncio
+import io
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from PIL import Image
+
+from app.routers import attachments
+from app.services import attachment_service
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(document.cookie)</script></svg>'
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachment_service, "ATTACHMENT_DIR", str(tmp_path))
+    return tmp_path
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _post(content: bytes, content_type: str, filename: str = "photo"):
+    app = FastAPI()
+    app.include_router(attachments.router, prefix="/api/attachments")
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+            response = await client.post("/api/attachments", files={"file": (filename, content, content_type)})
+            if response.status_code != 200:
+                return response, None
+            return response, await client.get(response.json()["url"])
+
+    return asyncio.run(main())
+
+def _blobs(store):
+    return [name for _, _, names in os.walk(store) for name in names]
+
+def test_photo_is_stored_with_the_type_read_from_its_content(store, monkeypatch):
+    async def ensure_thumbnail(attachment_id):
+        return attachment_service.thumbnail_path(attachment_id)
+
+    monkeypatch.setattr(attachment_service, "ensure_thumbnail", ensure_thumbnail)
+    response, download = _post(_png(), "image/jpeg")
+    assert response.status_code == 200
+    assert response.json()["type"] == "image/png"
+    assert download.headers["content-type"] == "image/png"
+    assert download.headers["x-content-type-options"] == "nosniff"
+
+@pytest.mark.parametrize("content, content_type", [
+    (SVG, "image/svg+xml"),
+    (SVG, "image/png"),
+    (b"GIF89a not really", "image/gif"),
+])
+def test_content_that_is_not_a_raster_image_is_refused(store, content, content_type):
+    response, _ = _post(content, content_type)
+    assert response.status_code == 400
+    assert _blobs(store) == []
+
+def test_failed_thumbnail_leaves_no_blob_behind(store, monkeypatch):
+    async def ensure_thumbnail(attachment_id):
+        raise OSError("image file is truncated")
+
+    monkeypatch.setattr(attachment_service, "ensure_thumbnail", ensure_thumbnail)
+    response, _ = _post(_png(), "image/png")
+    assert response.status_code == 400
+    assert _blobs(store) == []
+
+def test_inline_svg_is_only_served_as_a_download(store):
+    reference = attachment_service.store_bytes(SVG, "image/svg+xml")
+    assert reference["type"] == attachment_service.DOWNLOAD_TYPE
+    app = FastAPI()
+    app.include_router(attachments.router, prefix="/api/attachments")
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+            return await client.get(reference["url"])
+
+    response = asyncio.run(main())
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["content-disposition"].startswith("attachment")
+    assert response.headers["x-content-type-options"] == "nosniff"
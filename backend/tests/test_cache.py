@@ -0,0 +1,43 @@
+import os
+import time
+
+from app.services.cache import DiskCache
+
+def _files(directory):
+    return sum(name.endswith(".json") for _, _, names in os.walk(directory) for name in names)
+
+def test_disk_cache_walks_the_directory_once_per_slack_of_new_entries(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), max_entries=20)
+    walks = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda now: walks.append(now) or entries(now))
+    for index in range(200):
+        cache.set(f"key-{index}", {"index": index})
+        assert _files(tmp_path) <= 20
+    # The first write counts the directory; each eviction goes down to 18
+    # entries, so it runs at the 21st new entry and every third one after
+    assert len(walks) == 1 + len(range(21, 201, 3))
+    # Overwrites do not add entries
+    for _ in range(50):
+        cache.set("key-199", {"index": 199})
+    assert len(walks) == 1 + len(range(21, 201, 3))
+    assert cache.get("key-199") == {"index": 199}
+    assert cache.get("key-0") is None
+
+def test_disk_cache_evicts_the_oldest_entries(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=10)
+    for index in range(11):
+        cache.set(f"key-{index}", index)
+        path = cache._path(f"key-{index}")
+        os.utime(path, (time.time() - 100 + index, time.time() - 100 + index))
+    assert _files(tmp_path) == 9
+    assert cache.get("key-0") is None and cache.get("key-1") is None
+    assert cache.get("key-10") == 10
+
+def test_disk_cache_counts_entries_left_by_an_earlier_process(tmp_path):
+    earlier = DiskCache(str(tmp_path), max_entries=10)
+    for index in range(10):
+        earlier.set(f"key-{index}", index)
+    cache = DiskCache(str(tmp_path), max_entries=10)
+    cache.set("key-10", 10)
+    assert _files(tmp_path) == 9
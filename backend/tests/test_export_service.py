@@ -0,0 +1,131 @@
+import asyncio
+import csv
+import io
+
+import pypdfium2 as pdfium
+import pytest
+from PIL import Image
+
+from app.services import attachment_service, export_service
+
+class FakeSnapshot:
+    """Stands in for an IssueSnapshot over a list of issues"""
+
+    def __init__(self, issues, batch_size=3):
+        self.issues_list = issues
+        self.total = len(issues)
+        self.batch_size = batch_size
+
+    async def batches(self):
+        for start in range(0, len(self.issues_list), self.batch_size):
+            yield self.issues_list[start:start + self.batch_size]
+
+    async def issues(self):
+        async for batch in self.batches():
+            for issue in batch:
+                yield issue
+
+def _issue(index, photos=()):
+    return {
+        "id": f"i{index}", "formId": "f1", "dateSubmitted": f"2024-05-{index % 28 + 1:02d}T10:30:00Z",
+        "location": f"Building {index}", "issueType": "Leak", "priority": "High", "status": "Open",
+        "description": "Water dripping from the ceiling " * (index % 5 + 1),
+        "photos": [{"id": photo, "url": f"/api/attachments/{photo}"} for photo in photos],
+    }
+
+@pytest.fixture
+def thumbnails(tmp_path, monkeypatch):
+    """Thumbnails on disk for attachments a and b, counting how often each is asked for"""
+    requested = []
+    for name, color in (("a", "red"), ("b", "blue")):
+        Image.new("RGB", (160, 120), color).save(tmp_path / f"{name}.jpg", format="JPEG")
+
+    async def ensure_thumbnail(attachment_id):
+        requested.append(attachment_id)
+        if attachment_id not in ("a", "b"):
+            raise attachment_service.AttachmentNotFoundError(attachment_id)
+        return str(tmp_path / f"{attachment_id}.jpg")
+
+    monkeypatch.setattr(attachment_service, "ensure_thumbnail", ensure_thumbnail)
+    return requested
+
+def _export(writer, snapshot, **options):
+    async def collect():
+        return b"".join([chunk async for chunk in writer(snapshot, base_url="http://api/", **options)])
+    return asyncio.run(collect())
+
+ISSUES = [_issue(0, ("a", "b")), _issue(1), _issue(2, ("missing",)), _issue(3, ("b",)), _issue(4)]
+
+def test_csv_lists_every_issue_with_photo_links(thumbnails):
+    data = _export(export_service.write_csv, FakeSnapshot(ISSUES))
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+    assert rows[0][-1] == "Photos"
+    assert [row[1] for row in rows[1:]] == [f"Building {index}" for index in range(5)]
+    assert rows[1][-1] == "http://api/api/attachments/a http://api/api/attachments/b"
+
+HOSTILE = {**_issue(5), "location": "=1+2", "description": '=HYPERLINK("http://evil","click")', "issueType": "@SUM(A1)"}
+
+def test_csv_neutralises_formulas_in_submitted_text(thumbnails):
+    data = _export(export_service.write_csv, FakeSnapshot([HOSTILE, {**_issue(6), "location": "-5", "issueType": "\tx"}]))
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+    assert rows[1][1:3] == ["'=1+2", "'@SUM(A1)"]
+    assert rows[1][5] == "'=HYPERLINK(\"http://evil\",\"click\")"
+    assert rows[2][1:3] == ["'-5", "'\tx"]
+    # Ordinary text is left alone
+    assert rows[2][5].startswith("Water dripping")
+
+def test_xlsx_stores_submitted_text_as_text(thumbnails):
+    openpyxl = pytest.importorskip("openpyxl")
+    data = _export(export_service.write_xlsx, FakeSnapshot([HOSTILE]))
+    row = openpyxl.load_workbook(io.BytesIO(data)).active[2]
+    assert [(cell.value, cell.data_type) for cell in row[1:3]] == [("=1+2", "s"), ("@SUM(A1)", "s")]
+    assert (row[5].value, row[5].data_type) == ('=HYPERLINK("http://evil","click")', "s")
+
+def test_xlsx_opens_in_openpyxl_with_rows_links_and_thumbnails(thumbnails):
+    openpyxl = pytest.importorskip("openpyxl")
+    data = _export(export_service.write_xlsx, FakeSnapshot(ISSUES))
+    sheet = openpyxl.load_workbook(io.BytesIO(data)).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert rows[0][:3] == ("Date submitted", "Location", "Issue type")
+    assert len(rows) == 1 + len(ISSUES)
+    assert rows[1][0].isoformat() == "2024-05-01T10:30:00"
+    assert rows[1][1] == "Building 0"
+    assert rows[1][8] == '=HYPERLINK("http://api/api/attachments/a","Open photo")'
+    assert sheet.auto_filter.ref == "A1:L6"
+    assert sorted(image.anchor._from.row for image in sheet._images) == [1, 1, 4]
+    # Each thumbnail is looked up once, in the one pass over the snapshot
+    assert sorted(thumbnails) == ["a", "b", "b", "missing"]
+
+def test_xlsx_without_photos_has_no_images(thumbnails):
+    openpyxl = pytest.importorskip("openpyxl")
+    data = _export(export_service.write_xlsx, FakeSnapshot(ISSUES), photos=False)
+    sheet = openpyxl.load_workbook(io.BytesIO(data)).active
+    assert sheet._images == []
+    assert thumbnails == []
+
+def test_pdf_opens_in_pdfium_with_every_issue(thumbnails):
+    issues = [_issue(index, ("a",) if index % 3 == 0 else ()) for index in range(60)]
+    data = _export(export_service.write_pdf, FakeSnapshot(issues))
+    document = pdfium.PdfDocument(data)
+    try:
+        assert len(document) > 1
+        text = "".join(document[index].get_textpage().get_text_range() for index in range(len(document)))
+        for index in range(60):
+            assert f"Building {index}" in text
+        images = sum(
+            1 for index in range(len(document))
+            for item in document[index].get_objects() if item.type == pdfium.raw.FPDF_PAGEOBJ_IMAGE
+        )
+        assert images == 20
+    finally:
+        document.close()
+    assert len(thumbnails) == 20
+
+def test_abandoned_xlsx_export_stops_its_writer_thread(thumbnails):
+    async def main():
+        stream = export_service.write_xlsx(FakeSnapshot([_issue(index, ("a",)) for index in range(200)]))
+        first = await anext(stream)
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(main()).startswith(b"PK")
@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.routers import formio
+from app.services import formio_service
+
+SUBMISSIONS = [{"_id": f"s{i}", "data": {}} for i in range(23)]
+
+def _upstream(monkeypatch, cap, content_range=True):
+    """Form.io stand-in that returns at most cap submissions per page, whatever limit asks for"""
+    skips = []
+
+    def handler(request: httpx.Request):
+        skip = int(request.url.params["skip"])
+        limit = min(int(request.url.params["limit"]), cap)
+        skips.append(skip)
+        page = SUBMISSIONS[skip:skip + limit]
+        headers = {}
+        if content_range:
+            headers["content-range"] = f"{skip}-{skip + len(page) - 1}/{len(SUBMISSIONS)}"
+        return httpx.Response(200, json=page, headers=headers)
+
+    monkeypatch.setattr(formio_service, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://formio"))
+    return skips
+
+def _ids(**kwargs):
+    async def main():
+        return [submission["_id"] async for submission in formio_service.iter_submissions(page_size=10, **kwargs)]
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+@pytest.mark.parametrize("content_range", [True, False])
+def test_all_submissions_when_formio_caps_the_page_size(monkeypatch, concurrency, content_range):
+    _upstream(monkeypatch, cap=4, content_range=content_range)
+    assert _ids(concurrency=concurrency) == [submission["_id"] for submission in SUBMISSIONS]
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_pages_stop_at_the_total(monkeypatch, concurrency):
+    skips = _upstream(monkeypatch, cap=10)
+    assert _ids(concurrency=concurrency) == [submission["_id"] for submission in SUBMISSIONS]
+    assert sorted(skips) == [0, 10, 20]
+
+@pytest.mark.parametrize("query", [
+    "page_size=0",
+    f"page_size={formio_service.FORMIO_MAX_PAGE_SIZE + 1}",
+    "concurrency=0",
+    f"concurrency={formio_service.FORMIO_MAX_PAGE_CONCURRENCY + 1}",
+])
+def test_submission_stream_rejects_out_of_range_paging(monkeypatch, query):
+    skips = _upstream(monkeypatch, cap=10)
+    app = FastAPI()
+    app.include_router(formio.router, prefix="/api/formio")
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+            return await client.get(f"/api/formio/forms/f1/submissions?{query}")
+
+    assert asyncio.run(main()).status_code == 422
+    assert skips == []
@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.routers import formio
+from app.services import formio_service
+
+FORM = b'{"_id": "f1", "title": "Inspection",   "components": []}'
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Form.io stand-in that counts reads and answers slowly enough for them to overlap"""
+    reads = []
+
+    async def handler(request: httpx.Request):
+        reads.append(request.url.path)
+        await asyncio.sleep(0.05)
+        if request.url.path == "/form/missing":
+            return httpx.Response(404, json={"message": "Not found"})
+        return httpx.Response(200, content=FORM, headers={"content-type": "application/json", "etag": '"v1"'})
+
+    monkeypatch.setattr(formio_service, "FORMIO_PASSTHROUGH", True)
+    monkeypatch.setattr(formio_service, "shared_form_cache", None)
+    monkeypatch.setattr(formio_service, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://formio"))
+    formio_service.form_cache.clear()
+    yield reads
+    formio_service.form_cache.clear()
+
+def _client():
+    app = FastAPI()
+    app.include_router(formio.router, prefix="/api/formio")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api")
+
+def test_passthrough_reads_are_coalesced_and_cached(upstream):
+    async def main():
+        async with _client() as client:
+            first = await asyncio.gather(*(client.get("/api/formio/forms/f1") for _ in range(5)))
+            again = await client.get("/api/formio/forms/f1")
+            return first, again
+
+    first, again = asyncio.run(main())
+    assert upstream == ["/form/f1"]
+    for response in [*first, again]:
+        assert response.status_code == 200
+        # Relayed byte for byte, not re-serialized
+        assert response.content == FORM
+        assert response.headers["etag"] == '"v1"'
+
+def test_passthrough_answers_conditional_reads(upstream):
+    async def main():
+        async with _client() as client:
+            return await client.get("/api/formio/forms/f1", headers={"If-None-Match": '"v1"'})
+
+    response = asyncio.run(main())
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_passthrough_relays_upstream_errors(upstream):
+    async def main():
+        async with _client() as client:
+            return await client.get("/api/formio/forms/missing")
+
+    response = asyncio.run(main())
+    assert response.status_code == 404
+    assert response.json() == {"message": "Not found"}
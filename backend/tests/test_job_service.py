@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.routers import forms
+from app.services import ai_service, job_service, upload_service
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_service, "JOB_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(job_service, "JOB_WORKERS", 1)
+    monkeypatch.setattr(job_service, "JOB_STORE", "memory")
+    return tmp_path
+
+def _job(tmp_path, **fields):
+    path = tmp_path / "input"
+    path.write_bytes(b"%PDF-1.4")
+    now = 0.0
+    return {
+        "id": "j1", "tenant": "default", "status": job_service.QUEUED, "filename": "form.pdf",
+        "content_type": "application/pdf", "input_path": str(path), "callback_url": None,
+        "created": now, "updated": now, "result": None, "cache": None, "error": None, "worker": None,
+        **fields,
+    }
+
+def test_cancelled_job_keeps_its_input(jobs, monkeypatch):
+    started = asyncio.Event()
+
+    async def process_upload(upload):
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(ai_service, "process_upload", process_upload)
+
+    async def main():
+        await job_service.startup()
+        job = _job(jobs)
+        task = asyncio.create_task(job_service._run_job(job))
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await job_service.shutdown()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == job_service.RUNNING
+    assert os.path.exists(job["input_path"])
+
+def test_finished_job_removes_its_input(jobs, monkeypatch):
+    async def process_upload(upload):
+        return {"components": []}, "miss"
+
+    monkeypatch.setattr(ai_service, "process_upload", process_upload)
+
+    async def main():
+        await job_service.startup()
+        job = _job(jobs)
+        await job_service._run_job(job)
+        await job_service.shutdown()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == job_service.SUCCEEDED
+    assert not os.path.exists(job["input_path"])
+
+def test_slow_callback_does_not_hold_the_worker(jobs, monkeypatch):
+
+    async def process_upload(upload):
+        return {"components": []}, "miss"
+
+    async def send_callback(job):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(ai_service, "process_upload", process_upload)
+    monkeypatch.setattr(job_service, "_send_callback", send_callback)
+
+    async def main():
+        await job_service.startup()
+        job = _job(jobs, callback_url="https://hooks.example.com/done")
+        await asyncio.wait_for(job_service._run_job(job), timeout=5)
+        pending = len(job_service._callbacks)
+        await job_service.shutdown()
+        return pending
+
+    assert asyncio.run(main()) == 1
+
+@pytest.mark.parametrize("url", [
+    "file:///etc/passwd",
+    "http://127.0.0.1:8000/api/forms/create",
+    "http://10.0.0.5/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://localhost/hook",
+])
+def test_callback_to_internal_address_is_rejected(url):
+    with pytest.raises(job_service.InvalidCallbackError):
+        asyncio.run(job_service.check_callback_url(url))
+
+def test_callback_to_public_address_is_accepted():
+    asyncio.run(job_service.check_callback_url("https://8.8.8.8/hook"))
+
+def test_callback_host_allowlist(monkeypatch):
+    monkeypatch.setattr(job_service, "JOB_CALLBACK_ALLOWED_HOSTS", {"hooks.example.com"})
+    with pytest.raises(job_service.InvalidCallbackError):
+        asyncio.run(job_service.check_callback_url("https://8.8.8.8/hook"))
+
+def test_spooled_upload_runs_to_completion(jobs, monkeypatch):
+    monkeypatch.setattr(upload_service, "UPLOAD_SPOOL_DIR", str(jobs))
+    content = b"%PDF-1.4\n" + b"x" * (upload_service.UPLOAD_SPOOL_THRESHOLD + 1024 * 1024)
+    received = []
+
+    async def process_upload(upload):
+        received.append(upload.read())
+        return {"components": [{"key": "room"}]}, "miss"
+
+    monkeypatch.setattr(ai_service, "process_upload", process_upload)
+    app = FastAPI()
+    app.include_router(forms.router, prefix="/api/forms")
+
+    async def main():
+        await job_service.startup()
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+                response = await client.post("/api/forms/jobs", files={"file": ("big.pdf", content, "application/pdf")})
+                assert response.status_code == 202
+                job_id = response.json()["id"]
+                for _ in range(100):
+                    job = (await client.get(f"/api/forms/jobs/{job_id}")).json()
+                    if job["status"] not in (job_service.QUEUED, job_service.RUNNING):
+                        return job
+                    await asyncio.sleep(0.05)
+        finally:
+            await job_service.shutdown()
+
+    job = asyncio.run(main())
+    assert job["status"] == job_service.SUCCEEDED, job["error"]
+    assert job["result"] == {"components": [{"key": "room"}]}
+    assert received == [content]
+    assert os.listdir(jobs / "spool") == []
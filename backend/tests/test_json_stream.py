@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from app.services.json_stream import ComponentStream
+
+FORM = {
+    "title": "Boiler {inspection}",
+    "display": "form",
+    "components": [
+        {"type": "textfield", "key": "room", "label": "Room \"A\" {or} [B]", "validate": {"required": True}},
+        {"type": "panel", "key": "checks", "components": [{"type": "checkbox", "key": "valve", "label": "Valve \\ ok"}]},
+        {"type": "select", "key": "status", "data": {"values": [{"label": "Open", "value": "open"}]}},
+    ],
+    "tags": [{"not": "a component"}],
+}
+REPLY = json.dumps(FORM)
+
+def _stream(chunks):
+    parser = ComponentStream()
+    events = []
+    for chunk in chunks:
+        events.append(parser.feed(chunk))
+    return parser, events
+
+def test_components_arrive_one_by_one_as_they_close():
+    parser, events = _stream(REPLY)
+    completed = [(index, component) for index, batch in enumerate(events) for component in batch]
+    assert [component for _, component in completed] == FORM["components"]
+    # Each one as soon as the model wrote its closing brace
+    for index, component in completed:
+        text = json.dumps(component)
+        assert index == REPLY.index(text) + len(text) - 1
+    assert parser.result() == FORM
+
+@pytest.mark.parametrize("split", range(1, len(REPLY)))
+def test_any_chunk_boundary_gives_the_same_components(split):
+    parser, events = _stream([REPLY[:split], REPLY[split:]])
+    assert [component for batch in events for component in batch] == FORM["components"]
+
+def test_text_around_the_json_is_ignored():
+    parser, events = _stream(["Here is the form:\n```json\n", REPLY, "\n```"])
+    assert [component for batch in events for component in batch] == FORM["components"]
+
+def test_nested_components_arrays_are_not_top_level_components():
+    reply = json.dumps({"components": [{"type": "panel", "components": [{"key": "a"}, {"key": "b"}]}]})
+    _, events = _stream([reply])
+    assert events == [[{"type": "panel", "components": [{"key": "a"}, {"key": "b"}]}]]
+
+def test_non_object_elements_are_skipped():
+    _, events = _stream(['{"components": ["stray", 1, {"key": "a"}]}'])
+    assert events == [[{"key": "a"}]]
+
+def test_an_unfinished_reply_yields_what_was_complete():
+    parser, events = _stream([REPLY[:REPLY.index('"select"')]])
+    assert [component for batch in events for component in batch] == FORM["components"][:2]
+    with pytest.raises(ValueError):
+        parser.result()
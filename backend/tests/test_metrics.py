@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from app.services import metrics
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "registry", [])
+    monkeypatch.setattr(metrics, "collectors", [])
+    return tmp_path
+
+def _other_worker(directory, pid, samples):
+    with open(os.path.join(directory, f"{pid}-0000.json"), "w") as f:
+        json.dump(samples, f)
+
+def _exited_pid():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+def test_scrape_adds_up_every_worker(registry):
+    requests = metrics.Counter("requests_total", "Requests", ("route",))
+    latency = metrics.Histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    in_flight = metrics.Gauge("in_flight", "In flight")
+    depth = metrics.Gauge("depth", "Shared queue depth", multiprocess_mode="max")
+    requests.inc(2, route="/a")
+    latency.observe(0.05)
+    in_flight.set(1)
+    depth.set(7)
+    # A live worker (the test runner's parent) and one that has exited
+    live = {
+        "requests_total": [[["/a"], 3], [["/b"], 1]],
+        "latency_seconds": [[[], [[0, 1, 0], 0.5]]],
+        "in_flight": [[[], 2]],
+        "depth": [[[], 7]],
+    }
+    _other_worker(registry, os.getppid(), live)
+    _other_worker(registry, _exited_pid(), {"requests_total": [[["/a"], 10]], "in_flight": [[[], 5]], "depth": [[[], 9]]})
+
+    text = asyncio.run(metrics.render())
+    assert 'requests_total{route="/a"} 15' in text
+    assert 'requests_total{route="/b"} 1' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert "latency_seconds_count 2" in text
+    # Gauges of exited workers are left out; shared figures are not multiplied
+    assert "in_flight 3" in text
+    assert "depth 7" in text
+
+def test_single_process_scrape_leaves_no_files(registry, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", None)
+    metrics.Counter("requests_total", "Requests").inc()
+    assert "requests_total 1" in asyncio.run(metrics.render())
+    assert os.listdir(registry) == []
+
+def test_document_counters_follow_uploads_and_page_images(monkeypatch):
+    from app.services import document_service
+    monkeypatch.setattr(document_service, "IMAGE_PREPROCESS", False)
+    uploads = document_service.document_bytes.value(kind="upload")
+    images = document_service.document_bytes.value(kind="model_image")
+    pages = document_service.pages_rendered.value()
+
+    async def main():
+        await document_service.count_pages(b"x" * 100, "image/png")
+        await document_service.render_page(b"x" * 100, "image/png", 0)
+
+    asyncio.run(main())
+    assert document_service.document_bytes.value(kind="upload") == uploads + 100
+    assert document_service.document_bytes.value(kind="model_image") == images + 100
+    assert document_service.pages_rendered.value() == pages + 1
+    assert "elyndra_document_bytes_total" in asyncio.run(metrics.render())
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.routers import forms
+from app.services import outbox_service, submission_service
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = outbox_service.Outbox(path)
+    monkeypatch.setattr(outbox_service, "_outbox", outbox)
+    monkeypatch.setattr(outbox_service, "counters", {"flushed": 0, "retries": 0, "rejected": 0, "lastFlush": None})
+    yield path
+    outbox.close()
+
+def _enqueue(form_id, key=None, data=None):
+    return asyncio.run(outbox_service.enqueue(form_id, {"data": data or {"room": "B12"}}, key))
+
+def _status_error(status_code):
+    request = httpx.Request("POST", "http://formio/form/f1/submission")
+    return httpx.HTTPStatusError("upstream", request=request, response=httpx.Response(status_code, request=request))
+
+def test_repeated_key_returns_the_queued_entry(outbox):
+    first = _enqueue("f1", "k1")
+    assert _enqueue("f1", "k1")["id"] == first["id"]
+    with pytest.raises(submission_service.IdempotencyConflictError):
+        _enqueue("f1", "k1", {"room": "C7"})
+
+def test_claimed_entries_are_leased_from_other_workers(outbox, monkeypatch):
+    monkeypatch.setattr(outbox_service, "OUTBOX_LEASE", 60)
+    entry = _enqueue("f1")
+    # A second connection stands for another worker process
+    other = outbox_service.Outbox(outbox)
+    try:
+        now = time.time()
+        assert [claimed["id"] for claimed in outbox_service.get_outbox()._due(now, 10)] == [entry["id"]]
+        assert other._due(now, 10) == []
+        # The first worker died without recording an outcome; the lease runs out
+        assert [claimed["id"] for claimed in other._due(now + 61, 10)] == [entry["id"]]
+    finally:
+        other.close()
+
+def test_flush_records_sent_retried_and_rejected_entries(outbox, monkeypatch):
+    async def submit(form_id, submission, key):
+        if form_id == "down":
+            raise _status_error(503)
+        if form_id == "invalid":
+            raise _status_error(422)
+        return {"_id": f"sub-{form_id}"}, True
+
+    monkeypatch.setattr(submission_service, "submit", submit)
+    monkeypatch.setattr(outbox_service, "OUTBOX_RETRY_BASE", 10)
+    sent, retried, rejected = _enqueue("ok"), _enqueue("down"), _enqueue("invalid")
+
+    async def main():
+        flushed = await outbox_service.flush()
+        entries = [await outbox_service.get_outbox().get(entry["id"]) for entry in (sent, retried, rejected)]
+        again = await outbox_service.flush()
+        return flushed, entries, again
+
+    started = time.time()
+    flushed, (sent, retried, rejected), again = asyncio.run(main())
+    assert flushed == 3
+    assert (sent["status"], sent["submission_id"]) == (outbox_service.SENT, "sub-ok")
+    assert (rejected["status"], rejected["attempts"]) == (outbox_service.FAILED, 1)
+    assert (retried["status"], retried["attempts"]) == (outbox_service.QUEUED, 1)
+    # Backed off by the first retry delay, with jitter between half and all of it
+    assert started + 5 <= retried["next_attempt"] <= time.time() + 10
+    # Nothing is due until the backoff has passed
+    assert again == 0
+    assert outbox_service.counters["flushed"] == 1
+    assert outbox_service.counters["retries"] == 1
+    assert outbox_service.counters["rejected"] == 1
+
+def test_backoff_doubles_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(outbox_service, "OUTBOX_RETRY_BASE", 1)
+    monkeypatch.setattr(outbox_service, "OUTBOX_RETRY_MAX", 30)
+    monkeypatch.setattr(outbox_service.random, "uniform", lambda low, high: high)
+    assert [outbox_service._backoff(attempts) for attempts in (1, 2, 3, 6, 20)] == [1, 2, 4, 30, 30]
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_submit_answers_with_the_submission_unless_the_outbox_is_on(outbox, monkeypatch, enabled):
+    async def submit(form_id, submission, key):
+        return {"_id": "s1", "form": form_id, **submission}, True
+
+    monkeypatch.setattr(submission_service, "submit", submit)
+    monkeypatch.setattr(outbox_service, "SUBMISSION_OUTBOX", enabled)
+    app = FastAPI()
+    app.include_router(forms.router, prefix="/api/forms")
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+            return await client.post("/api/forms/f1/submit", json={"data": {"room": "B12"}})
+
+    response = asyncio.run(main())
+    if enabled:
+        assert response.status_code == 202
+        assert response.json()["status"] == outbox_service.QUEUED
+    else:
+        assert response.status_code == 200
+        assert response.json() == {"_id": "s1", "form": "f1", "data": {"room": "B12"}}
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import formio_service, report_service, worker_lock
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker_lock, "WORKER_LOCK_DIR", str(tmp_path / "locks"))
+    monkeypatch.setattr(report_service, "REPORT_SYNC_WAIT", 0.2)
+    index = report_service.IssueIndex(str(tmp_path / "report.sqlite3"))
+    index.apply([{
+        "_id": "s1", "form": "f1", "created": "2024-05-01T10:00:00Z", "modified": "2024-05-01T10:00:00Z",
+        "data": {"hasIssues": True, "location": "Boiler room", "issueDescription": "Leak"},
+    }])
+    monkeypatch.setattr(report_service, "_index", index)
+    monkeypatch.setattr(report_service, "_catch_up_task", None)
+    yield index
+    worker_lock.release("report-sync")
+    index.close()
+
+def test_report_answers_from_the_index_when_formio_is_down(index, monkeypatch):
+    async def iter_submissions(params=None):
+        raise formio_service.httpx.ConnectError("Form.io is down")
+        yield
+
+    monkeypatch.setattr(formio_service, "iter_submissions", iter_submissions)
+    report = asyncio.run(report_service.generate_report())
+    assert report["totalIssues"] == 1
+    assert report["issues"][0]["location"] == "Boiler room"
+
+def test_report_does_not_wait_for_a_slow_sync(index, monkeypatch):
+    async def iter_submissions(params=None):
+        await asyncio.sleep(5)
+        yield {}
+
+    monkeypatch.setattr(formio_service, "iter_submissions", iter_submissions)
+
+    async def main():
+        started = time.monotonic()
+        report = await report_service.generate_report()
+        elapsed = time.monotonic() - started
+        # The sync is still running in the background
+        assert not report_service._catch_up_task.done()
+        return report, elapsed
+
+    report, elapsed = asyncio.run(main())
+    assert report["totalIssues"] == 1
+    assert elapsed < 2
+
+def test_report_leaves_the_sync_to_the_worker_holding_the_lock(index, monkeypatch):
+    calls = []
+
+    async def iter_submissions(params=None):
+        calls.append(params)
+        return
+        yield
+
+    monkeypatch.setattr(formio_service, "iter_submissions", iter_submissions)
+    monkeypatch.setattr(worker_lock, "try_acquire", lambda name: False)
+    report = asyncio.run(report_service.generate_report())
+    assert report["totalIssues"] == 1
+    assert calls == []
+
+def test_report_counts_every_matching_issue_not_just_the_page(index, monkeypatch):
+    index.apply([
+        {
+            "_id": f"h{i}", "form": "f1", "created": f"2024-05-02T10:{i:02d}:00Z", "modified": "2024-05-02T10:00:00Z",
+            "data": {"hasIssues": True, "location": "Roof", "issuePriority": "High"},
+        }
+        for i in range(5)
+    ])
+    monkeypatch.setattr(worker_lock, "try_acquire", lambda name: False)
+    report = asyncio.run(report_service.generate_report(limit=2))
+    assert len(report["issues"]) == 2
+    assert report["totalIssues"] == 6
+    assert report["highPriorityIssues"] == 5
+    assert report["openIssues"] == 6
+    report = asyncio.run(report_service.generate_report(location="Boiler room", limit=2))
+    assert (report["totalIssues"], report["highPriorityIssues"], report["openIssues"]) == (1, 0, 1)
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.services import formio_service, submission_service
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = submission_service.IdempotencyStore(str(tmp_path / "submissions.sqlite3"))
+    monkeypatch.setattr(submission_service, "_store", store)
+    yield store
+    store._conn.close()
+
+@pytest.fixture
+def formio(monkeypatch):
+    """Stands in for Form.io, counting the submissions it receives"""
+    calls = []
+
+    async def submit_form(form_id, submission, timeout=None):
+        calls.append((form_id, submission))
+        await asyncio.sleep(0.05)
+        return {"_id": f"s{len(calls)}", "data": submission["data"]}
+
+    monkeypatch.setattr(formio_service, "submit_form", submit_form)
+    return calls
+
+def test_concurrent_submits_with_one_key_post_once(store, formio):
+    async def main():
+        return await asyncio.gather(*(
+            submission_service.submit("f", {"data": {"a": 1}}, "k") for _ in range(3)
+        ))
+
+    results = asyncio.run(main())
+    assert len(formio) == 1
+    assert [result["_id"] for result, _ in results] == ["s1"] * 3
+    assert sorted(created for _, created in results) == [False, False, True]
+    assert submission_service._in_flight == {}
+
+def test_replay_returns_saved_result(store, formio):
+    first, created = asyncio.run(submission_service.submit("f", {"data": {"a": 1}}, "k"))
+    again, replayed = asyncio.run(submission_service.submit("f", {"data": {"a": 1}}, "k"))
+    assert created and not replayed
+    assert again == first
+    assert len(formio) == 1
+
+def test_reused_key_with_different_payload_conflicts(store, formio):
+    asyncio.run(submission_service.submit("f", {"data": {"a": 1}}, "k"))
+    with pytest.raises(submission_service.IdempotencyConflictError):
+        asyncio.run(submission_service.submit("f", {"data": {"a": 2}}, "k"))
+
+def test_concurrent_conflicting_payloads(store, formio):
+    async def main():
+        return await asyncio.gather(
+            submission_service.submit("f", {"data": {"a": 1}}, "k"),
+            submission_service.submit("f", {"data": {"a": 2}}, "k"),
+            return_exceptions=True,
+        )
+
+    first, second = asyncio.run(main())
+    assert first[1] is True
+    assert isinstance(second, submission_service.IdempotencyConflictError)
+    assert len(formio) == 1
+
+def test_failed_submit_releases_the_key(store, monkeypatch):
+    attempts = []
+
+    async def failing(form_id, submission, timeout=None):
+        attempts.append(submission)
+        raise RuntimeError("Form.io is down")
+
+    monkeypatch.setattr(formio_service, "submit_form", failing)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(submission_service.submit("f", {"data": {}}, "k"))
+    assert len(attempts) == 2
+
+def test_reservation_is_shared_between_processes(store, tmp_path):
+    # A second connection to the same database stands in for another worker
+    other = submission_service.IdempotencyStore(str(tmp_path / "submissions.sqlite3"))
+    try:
+        assert store._reserve("f", "k", "d1", lease=60) is None
+        assert other._reserve("f", "k", "d1", lease=60) == {"pending": "d1"}
+        store._complete("f", "k", "d1", {"_id": "s1"})
+        assert other._reserve("f", "k", "d1", lease=60) == {"payload_hash": "d1", "result": {"_id": "s1"}}
+    finally:
+        other._conn.close()
+
+def test_expired_reservation_is_taken_over(store):
+    assert store._reserve("f", "k", "d1", lease=60) is None
+    assert store._reserve("f", "k", "d1", lease=-1) is None
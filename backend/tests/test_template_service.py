@@ -0,0 +1,41 @@
+import asyncio
+import logging
+
+import pytest
+
+from app.services import template_service
+
+FINGERPRINTS = [0x0F0F_0F0F_0F0F_0F0F, 0x00FF_00FF_00FF_00FF]
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    library = template_service.TemplateLibrary(str(tmp_path / "templates.sqlite3"))
+    monkeypatch.setattr(template_service, "_library", library)
+    yield library
+    library.close()
+
+def test_each_match_is_logged_with_its_similarity(library, monkeypatch, caplog):
+    monkeypatch.setattr(template_service, "TEMPLATE_THRESHOLD", 0.9)
+
+    async def main():
+        await library.add(tuple(FINGERPRINTS), "v1", {"title": "Boiler inspection", "components": []})
+        # One bit off on the first page
+        return await template_service.match([FINGERPRINTS[0] ^ 1, FINGERPRINTS[1]], "v1")
+
+    with caplog.at_level(logging.INFO, logger="app.services.template_service"):
+        form = asyncio.run(main())
+    assert form["title"] == "Boiler inspection"
+    [record] = caplog.records
+    assert "'Boiler inspection'" in record.getMessage()
+    assert "similarity 0.999" in record.getMessage()
+
+def test_no_log_without_a_match(library, monkeypatch, caplog):
+    monkeypatch.setattr(template_service, "TEMPLATE_THRESHOLD", 0.99)
+
+    async def main():
+        await library.add(tuple(FINGERPRINTS), "v1", {"title": "Boiler inspection"})
+        return await template_service.match([~FINGERPRINTS[0] & (2 ** 64 - 1), FINGERPRINTS[1]], "v1")
+
+    with caplog.at_level(logging.INFO, logger="app.services.template_service"):
+        assert asyncio.run(main()) is None
+    assert caplog.records == []
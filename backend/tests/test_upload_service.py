@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+import pytest
+
+from app.services import upload_service
+
+def _call(content_length: bytes):
+    reached = []
+    sent = []
+
+    async def app(scope, receive, send):
+        reached.append(scope["path"])
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = upload_service.UploadSizeLimitMiddleware(app, max_bytes=1024)
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/forms/upload",
+        "headers": [(b"content-type", b"multipart/form-data; boundary=x"), (b"content-length", content_length)],
+    }
+    asyncio.run(middleware(scope, receive, send))
+    status = sent[0]["status"] if sent else None
+    return status, reached
+
+@pytest.mark.parametrize("content_length", [b"abc", b"-1", b"1e3", b""])
+def test_malformed_content_length_is_a_bad_request(content_length):
+    assert _call(content_length) == (400, [])
+
+def test_oversized_content_length_is_refused():
+    assert _call(str(10 * 1024 * 1024).encode()) == (413, [])
+
+def test_upload_within_the_limit_reaches_the_app():
+    assert _call(b"512") == (None, ["/api/forms/upload"])
+
+def test_saved_spool_file_survives_close(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_service, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    upload = upload_service.Upload("application/pdf", "big.pdf", spool_threshold=1024 * 1024)
+    content = b"%PDF-1.4\n" + b"x" * (2 * 1024 * 1024)
+    for start in range(0, len(content), upload_service.UPLOAD_CHUNK_SIZE):
+        upload.write(content[start:start + upload_service.UPLOAD_CHUNK_SIZE])
+    upload.finish()
+    assert isinstance(upload.source, str)
+    spool = upload.source
+    destination = tmp_path / "job-input"
+    with upload:
+        upload.save_to(str(destination))
+    assert not os.path.exists(spool)
+    assert destination.read_bytes() == content
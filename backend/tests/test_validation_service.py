@@ -0,0 +1,76 @@
+import pytest
+
+from app.services import validation_service
+
+FORM = {
+    "components": [
+        {"type": "textfield", "input": True, "key": "name", "label": "Name", "validate": {"required": True, "maxLength": "10"}},
+        {"type": "textfield", "input": True, "key": "code", "label": "Code", "validate": {"pattern": "[A-Z]{3}", "minLength": ""}},
+        {"type": "checkbox", "input": True, "key": "agree", "label": "Agree", "validate": {"required": True}},
+        {"type": "radio", "input": True, "key": "damaged", "label": "Damaged"},
+        {
+            "type": "panel", "key": "damage", "conditional": {"show": True, "when": "damaged", "eq": "yes"},
+            "components": [
+                {"type": "textarea", "input": True, "key": "details", "label": "Details", "validate": {"required": True}},
+                {
+                    "type": "columns", "key": "cols", "columns": [{"components": [
+                        {"type": "textfield", "input": True, "key": "photoRef", "label": "Photo", "validate": {"required": True}, "validateWhenHidden": True},
+                    ]}],
+                },
+            ],
+        },
+        {"type": "textfield", "input": True, "key": "tags", "label": "Tags", "multiple": True, "validate": {"minLength": 2}},
+        {"type": "datagrid", "input": True, "key": "rows", "components": [
+            {"type": "textfield", "input": True, "key": "inner", "validate": {"required": True}},
+        ]},
+        {"type": "button", "input": True, "key": "submit", "validate": {"required": True}},
+    ],
+}
+
+def _rules(data):
+    return sorted((error["context"]["key"], error["type"]) for error in validation_service.FormValidator(FORM).errors(data))
+
+def _valid(**data):
+    return {"name": "Ada", "agree": True, "photoRef": "p1", **data}
+
+def test_valid_submission_passes():
+    validation_service.FormValidator(FORM).validate({"data": _valid(code="ABC", tags=["ab", "cd"])})
+
+def test_each_rule_is_reported_with_the_field():
+    data = {"name": "A much too long name", "code": "abc", "agree": False, "tags": ["ok", "x"]}
+    assert _rules(data) == [
+        ("agree", "required"), ("code", "pattern"), ("name", "maxLength"), ("photoRef", "required"), ("tags", "minLength"),
+    ]
+
+def test_patterns_are_anchored_at_both_ends():
+    assert _rules(_valid(code="ABCD")) == [("code", "pattern")]
+    assert _rules(_valid(code="xABC")) == [("code", "pattern")]
+
+def test_fields_hidden_by_a_layout_conditional_are_skipped():
+    assert _rules(_valid(damaged="no")) == []
+    assert _rules(_valid(damaged="yes")) == [("details", "required")]
+
+def test_validate_when_hidden_ignores_the_conditional():
+    data = _valid(damaged="no")
+    del data["photoRef"]
+    assert _rules(data) == [("photoRef", "required")]
+
+def test_nested_data_and_buttons_are_left_to_formio():
+    assert _rules(_valid(rows=[{}])) == []
+
+def test_validate_raises_with_formio_shaped_details():
+    with pytest.raises(validation_service.SubmissionValidationError) as error:
+        validation_service.FormValidator(FORM).validate({"data": {"agree": True, "photoRef": "p1"}})
+    assert error.value.to_dict() == {
+        "name": "ValidationError",
+        "details": [{"message": "Name is required", "type": "required", "path": ["name"], "context": {"key": "name", "label": "Name"}}],
+    }
+    with pytest.raises(validation_service.SubmissionValidationError):
+        validation_service.FormValidator(FORM).validate({"data": "not an object"})
+
+def test_a_definition_is_compiled_once():
+    form = {"components": [dict(FORM["components"][0])]}
+    validator = validation_service.get_validator("cached-form", form)
+    assert validation_service.get_validator("cached-form", form) is validator
+    # A new definition (a fresh object from the form cache) is compiled again
+    assert validation_service.get_validator("cached-form", {**form}) is not validator
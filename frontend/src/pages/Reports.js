@@ -2,9 +2,15 @@ import React, { useState, useEffect } from 'react';
 import { Container, Row, Col, Card, Button, Badge, Alert, Spinner, Modal, Image } from 'react-bootstrap';
 import axios from 'axios';
 
+// Issues fetched per request; the rest load on demand
+const PAGE_SIZE = 100;
+
 const Reports = () => {
   const [reports, setReports] = useState([]);
+  // Counts over every issue in the report, not just the pages loaded so far
+  const [summary, setSummary] = useState({ totalIssues: 0, highPriorityIssues: 0, openIssues: 0 });
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
   const [showPhotoModal, setShowPhotoModal] = useState(false);
   const [selectedPhoto, setSelectedPhoto] = useState('');
@@ -13,11 +19,17 @@ const Reports = () => {
     fetchReports();
   }, []);
 
+  const fetchPage = async (offset) => {
+    const response = await axios.get('/api/forms/report', { params: { limit: PAGE_SIZE, offset } });
+    const { issues = [], totalIssues = 0, highPriorityIssues = 0, openIssues = 0 } = response.data;
+    setSummary({ totalIssues, highPriorityIssues, openIssues });
+    return issues;
+  };
+
   const fetchReports = async () => {
     setLoading(true);
     try {
-      const response = await axios.get('/api/forms/report');
-      setReports(response.data.issues || []);
+      setReports(await fetchPage(0));
       setError(null);
     } catch (err) {
       setError('Error loading reports: ' + (err.response?.data?.detail || err.message));
@@ -26,11 +38,29 @@ const Reports = () => {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const issues = await fetchPage(reports.length);
+      setReports((loaded) => [...loaded, ...issues]);
+      setError(null);
+    } catch (err) {
+      setError('Error loading reports: ' + (err.response?.data?.detail || err.message));
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handlePhotoClick = (photoUrl) => {
     setSelectedPhoto(photoUrl);
     setShowPhotoModal(true);
   };
 
+  // Photos are attachment references ({ id, url, thumbnailUrl }); older
+  // issues may still hold a plain URL
+  const photoUrl = (photo) => (typeof photo === 'string' ? photo : photo.url);
+  const thumbnailUrl = (photo) => (typeof photo === 'string' ? photo : photo.thumbnailUrl || photo.url);
+
   const renderPriorityBadge = (priority) => {
     const variant = 
       priority === 'High' ? 'danger' :
@@ -95,15 +125,15 @@ const Reports = () => {
                   <Card.Title>Summary</Card.Title>
                   <Row>
                     <Col xs={4} className="text-center border-end">
-                      <h3>{reports.length}</h3>
+                      <h3>{summary.totalIssues}</h3>
                       <p className="text-muted">Total Issues</p>
                     </Col>
                     <Col xs={4} className="text-center border-end">
-                      <h3>{reports.filter(r => r.priority === 'High').length}</h3>
+                      <h3>{summary.highPriorityIssues}</h3>
                       <p className="text-muted">High Priority</p>
                     </Col>
                     <Col xs={4} className="text-center">
-                      <h3>{reports.filter(r => r.status === 'Open').length}</h3>
+                      <h3>{summary.openIssues}</h3>
                       <p className="text-muted">Open Issues</p>
                     </Col>
                   </Row>
@@ -140,11 +170,11 @@ const Reports = () => {
                         <div className="photo-thumbnails">
                           {issue.photos.map((photo, photoIndex) => (
                             <img
-                              key={photoIndex}
-                              src={photo}
+                              key={photo.id || photoIndex}
+                              src={thumbnailUrl(photo)}
                               alt={`Issue ${index + 1} photo ${photoIndex + 1}`}
                               className="photo-thumbnail"
-                              onClick={() => handlePhotoClick(photo)}
+                              onClick={() => handlePhotoClick(photoUrl(photo))}
                             />
                           ))}
                         </div>
@@ -157,6 +187,22 @@ const Reports = () => {
               </Card.Body>
             </Card>
           ))}
+
+          {reports.length < summary.totalIssues && (
+            <div className="text-center mb-4">
+              <p className="text-muted">Showing {reports.length} of {summary.totalIssues} issues</p>
+              <Button variant="outline-primary" onClick={loadMore} disabled={loadingMore}>
+                {loadingMore ? (
+                  <>
+                    <Spinner as="span" animation="border" size="sm" role="status" aria-hidden="true" />
+                    <span className="ms-2">Loading...</span>
+                  </>
+                ) : (
+                  'Load more'
+                )}
+              </Button>
+            </div>
+          )}
         </div>
       )}
 